@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 import datetime
 import os
+from importlib.util import find_spec
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -44,6 +45,10 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = 'UserApp.NovelUser'
 
 MIDDLEWARE = [
+    # 各阶段耗时写入响应头Server-Timing, 并累计到 /metrics 的监控指标
+    'Novel_Server.utils.metrics.ServerTimingMiddleware',
+    # 压缩较大的响应, 放在其他中间件之前, 压缩耗时计入Server-Timing
+    'Novel_Server.utils.http_compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -94,6 +99,68 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+# chapters 使用数据库缓存, 第一次部署时需要执行 python manage.py createcachetable
+
+# 本地搜索索引(SQLite FTS5)的文件, 见 Novel_Server/utils/search_index.py
+SEARCH_INDEX_PATH = os.path.join(BASE_DIR, 'cache', 'search_index.sqlite3')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # 进程内的间贴缓存, 只短暂保存
+    'line_comments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'line_comments',
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,
+        }
+    },
+    # 已验证的token与用户数据, 多台机器部署时需要换成共享的缓存(如memcached)
+    'auth': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'auth'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        }
+    },
+    # 同一台机器上所有进程共享的爬虫登录会话
+    'spider_sessions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'spider_sessions'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        }
+    },
+    # 所有进程共享的页面数据缓存(排行榜, 搜索结果)
+    'pages': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'novel_page_cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+            'CULL_FREQUENCY': 4,
+        }
+    },
+    # 所有进程共享的章节存储, 超出容量时淘汰最早过期(读取时续期, 即最久没有读取)的章节
+    # Django的DatabaseCache按缓存键的顺序淘汰, 会删除经常读取的章节, 见 Novel_Server/utils/db_cache.py
+    'chapters': {
+        'BACKEND': 'Novel_Server.utils.db_cache.ExpiryCullingDatabaseCache',
+        'LOCATION': 'novel_chapter_cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'CULL_FREQUENCY': 10,
+        }
+    },
+}
+
+
+# 访问监控指标(/metrics)的令牌, 请求头需要带有 Authorization: Bearer <令牌>, 没有设置时不允许访问
+# 部署在反向代理之后时所有请求的地址都是127.0.0.1, 不能按地址判断, 反向代理也需要拒绝外部访问/metrics
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -137,12 +204,17 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.BasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
-    'DEFAULT_RENDERER_CLASSES': (
-        'rest_framework.renderers.JSONRenderer',
-        'rest_framework.renderers.BrowsableAPIRenderer',
-    ),
+    # 默认返回JSON(安装了orjson时使用orjson), 安装了msgpack时可以通过Accept选择MessagePack,
+    # 可以在浏览器中查看的BrowsableAPIRenderer只在DEBUG时使用
+    'DEFAULT_RENDERER_CLASSES': ['Novel_Server.utils.renderers.FastJSONRenderer'] +
+                                (['Novel_Server.utils.renderers.MessagePackRenderer'] if find_spec('msgpack') else []) +
+                                (['rest_framework.renderers.BrowsableAPIRenderer'] if DEBUG else []),
 }
 
+# 大于该字节数的响应在客户端支持时压缩(gzip, 安装了brotli时优先使用br), brotli的压缩等级(0-11)
+RESPONSE_COMPRESS_MIN_SIZE = 1024
+RESPONSE_BROTLI_QUALITY = 5
+
 # JWT_EXPIRATION_DELTA 指明token的有效期
 JWT_AUTH = {
     'JWT_EXPIRATION_DELTA': datetime.timedelta(days=1),
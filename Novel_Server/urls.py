@@ -1,6 +1,9 @@
 from django.urls import path, include
 from rest_framework_jwt.views import obtain_jwt_token
 
+from Novel_Server.utils.metrics import metrics_view
+
 urlpatterns = [
     path('api/', include('UserApp.urls')),
+    path('metrics', metrics_view),
 ]
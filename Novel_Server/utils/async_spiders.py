@@ -0,0 +1,299 @@
+#!/user/bin/env python
+# 每天都要有好心情
+# 异步信息获取模块
+# 网络请求使用httpx.AsyncClient, 页面解析复用同步爬虫的parse_*方法
+import asyncio
+
+import httpx
+from asgiref.sync import sync_to_async
+
+from Novel_Server.utils import metrics
+from Novel_Server.utils.paragraphs import PackedChapter
+from Novel_Server.utils.search_index import search_index
+from Novel_Server.utils.spiders import Spider_YouDu
+from Novel_Server.utils.spider_registry import SpiderRegistry
+from Novel_Server.utils.throttle import AsyncSingleFlight
+from Novel_Server.utils.spiders_setting import *
+
+
+class AsyncSpider_YouDu(Spider_YouDu):
+    """
+    有毒小说网的异步爬虫, 所有接口都是协程, 需要在事件循环中await调用
+    """
+    # 与同步爬虫分开保存实例, 避免把httpx的客户端交给同步代码使用
+    _instance = SpiderRegistry(SPIDER_REGISTRY_MAX_SIZE, SPIDER_REGISTRY_IDLE_TIMEOUT)
+    # 协程之间合并相同的请求, 限速与同步爬虫共用同一个令牌桶
+    flights = AsyncSingleFlight()
+
+    @classmethod
+    def create(cls, shelf):
+        spider = super().create(shelf)
+        # 同一个书架的多个协程同时发现未登录时, 只有一个协程进行登录, 等待时不阻塞事件循环
+        spider.login_lock = asyncio.Lock()
+        return spider
+
+    def close(self):
+        """
+        关闭会话, 爬虫实例被淘汰时调用
+        httpx的异步客户端需要在事件循环中关闭
+        :return:
+        """
+        if self.session is not None:
+            try:
+                asyncio.get_running_loop().create_task(self.session.aclose())
+            except RuntimeError:
+                pass
+        self.is_login = False
+
+    async def login(self):
+        """
+        有毒小说网只通过cookie来验证用户登录,所以只需要设置cookie即可
+        其他进程已经验证过的会话会直接使用, 不再请求原网站
+        :return:
+        """
+        async with self.login_lock:
+            # 等待锁的过程中其他协程已经登录
+            if self.is_login:
+                return
+            # 取消SSL认证, 跟随重定向以便判断是否登录成功
+            session = httpx.AsyncClient(
+                headers=self.make_headers(),
+                verify=False,
+                follow_redirects=True,
+                timeout=ASYNC_SPIDER_TIMEOUT,
+                limits=httpx.Limits(max_connections=ASYNC_SPIDER_MAX_CONNECTIONS,
+                                    max_keepalive_connections=ASYNC_SPIDER_MAX_CONNECTIONS),
+            )
+            # 先换上新的会话再关闭旧的会话, 之后的请求都使用新的会话
+            old_session, self.session = self.session, session
+            if old_session is not None:
+                await old_session.aclose()
+            # 会话存储是文件缓存, 在线程中读写, 不阻塞事件循环
+            cookies = await sync_to_async(self.session_store.get, thread_sensitive=False)(self.site, self.shelf)
+            if cookies is not None:
+                self.session.cookies.update(cookies)
+                self.is_login = True
+                return
+            await self.check_login()
+            await sync_to_async(self.session_store.set, thread_sensitive=False)(
+                self.site, self.shelf, self.session.cookies)
+
+    async def _request(self, method, url, **kwargs):
+        if self.rate_limiter is not None:
+            with metrics.phase('throttle'):
+                await self.rate_limiter.async_acquire()
+        with metrics.phase('upstream'):
+            try:
+                resp = await self.session.request(method, url, **kwargs)
+            except httpx.HTTPError:
+                metrics.record_upstream(self.site, 'error', 0)
+                raise
+        metrics.record_upstream(self.site, resp.status_code, len(resp.content))
+        return resp
+
+    async def check_login(self):
+        """
+        验证是否登录成功,登录失败时会重定向到登录页面
+        :return:
+        """
+        shelf_url = self.url('shelf')
+        resp = await self._request('GET', shelf_url)
+        if str(resp.url) == shelf_url:
+            self.is_login = True
+        else:
+            raise ValueError('无法登录有毒小说网!')
+
+    async def get_shelf(self):
+        resp = await self._request('GET', self.url('shelf'))
+        return self.parse_shelf(resp.text)
+
+    async def get_wallet(self, fresh=False):
+        """
+        获取钱包信息, 与同步爬虫共用按账号缓存的钱包
+        :param fresh: 为True时请求原网站并更新缓存
+        """
+        key = self.get_wallet_key()
+
+        async def fetch():
+            resp = await self._request('GET', self.url('wallet'))
+            return self.parse_wallet(resp.text)
+        if fresh:
+            data = await fetch()
+            await sync_to_async(self.page_cache.set)('wallet', key, data)
+            return data
+        return await self.page_cache.aget_or_fetch('wallet', key, fetch)
+
+    async def get_rank(self, rank_type, data_type, page):
+        url, page = self.get_rank_url(rank_type, data_type, page)
+        key = self.page_cache.make_key('rank', self.site, url)
+
+        async def fetch():
+            resp = await self._request('GET', url)
+            data = self.parse_rank(resp.text, page)
+            await sync_to_async(search_index.add_books)(self.site, data['books'])
+            return data
+        return await self.flights.do(key, lambda: self.page_cache.aget_or_fetch('rank', key, fetch))
+
+    async def search_book(self, keyword, page=1):
+        url = self.url('search', keyword, page)
+        key = self.page_cache.make_key('search', self.site, keyword, page)
+
+        async def fetch():
+            resp = await self._request('GET', url)
+            data = self.parse_search(resp.text, page)
+            await sync_to_async(search_index.add_books)(self.site, data['books'])
+            return data
+        return await self.flights.do(key, lambda: self.page_cache.aget_or_fetch('search', key, fetch))
+
+    async def get_book(self, book_id):
+        url = self.url('book', book_id)
+
+        async def fetch():
+            resp = await self._request('GET', url)
+            return self.parse_book(resp.text)
+        book_data = await self.flights.do(f'book:{self.site}:{self.shelf.id}:{book_id}', fetch)
+        self.chapter_lock.update(book_data['chapter_lock'])
+        return book_data
+
+    async def favo_book(self, book_id):
+        data = {
+            'BookID': book_id
+        }
+        resp = await self._request('POST', self.url('add_book'), data=data)
+        return resp.json()
+
+    async def buy_chapter(self, book_id, chapter_id):
+        data = {
+            'BookID': book_id,
+            'ChapterID': chapter_id,
+            'isSingleWsCount': 0,
+            'isAllWsCount': 0,
+            'isMethod': 1,
+            'isAuto': 0
+        }
+        resp = await self._request('POST', self.url('buy_chapter'), data=data)
+        # 订阅后余额变化, 清除同步接口缓存的钱包
+        await sync_to_async(self.page_cache.delete)(self.get_wallet_key())
+        data = resp.json()
+        self.mark_bought(chapter_id, data)
+        return data
+
+    async def get_post_data(self, url):
+        resp = await self._request('GET', url)
+        return self.parse_post_data(resp.text)
+
+    async def get_chapter(self, chapter_id, read_ahead=0, start=None, end=None):
+        """
+        获取对应章节的章节数据, 与同步爬虫共用章节存储
+        :param chapter_id: 章节id
+        :param read_ahead: 预读的章节数, 返回后在后台获取之后的read_ahead章
+        :param start: 只返回paragraph_index从start开始的段落
+        :param end: 只返回paragraph_index到end为止的段落
+        :return: 章节数据
+        """
+        return (await self.get_packed_chapter(chapter_id, read_ahead)).to_data(start, end)
+
+    async def get_packed_chapter(self, chapter_id, read_ahead=0):
+        """
+        与get_chapter相同, 返回紧凑格式的章节
+        :return: PackedChapter
+        """
+        chapter_id = str(chapter_id)
+        data = self.get_prefetched(chapter_id)
+        if data is None:
+            data = await self.load_chapter(chapter_id)
+        next_btn = data.btns.get('next_btn')
+        task = getattr(self, 'prefetch_task', None)
+        if read_ahead > 0 and next_btn and (task is None or task.done()):
+            self.prefetch_task = asyncio.get_running_loop().create_task(self.prefetch(next_btn, read_ahead))
+        return data
+
+    async def load_chapter(self, chapter_id):
+        can_read = self.can_read(chapter_id)
+        if can_read:
+            # 章节存储可能使用数据库缓存, 需要放到线程中执行
+            data = await sync_to_async(self.chapter_store.get)(chapter_id)
+            if data:
+                return data
+            key = f'chapter:{self.site}:{chapter_id}'
+        else:
+            key = f'chapter:{self.site}:{chapter_id}:{self.shelf.id}'
+        return await self.flights.do(key, lambda: self.fetch_chapter(chapter_id, can_read))
+
+    async def fetch_chapter(self, chapter_id, can_read):
+        post_data_url = self.url('read_chapter', chapter_id)
+        json_url = self.url('chapter_json', chapter_id)
+        btns, post_data = await self.get_post_data(post_data_url)
+        # referer只加在这次请求上, 不修改会话的请求头
+        resp = await self._request('POST', json_url, data=post_data, headers={'referer': post_data_url})
+        data = self.parse_chapter_data(resp.json()['data'])
+        data['btns'] = btns
+        data = PackedChapter.pack(data)
+        if can_read and data.has_content():
+            await sync_to_async(self.chapter_store.set)(chapter_id, data)
+        return data
+
+    async def prefetch(self, chapter_id, count):
+        for _ in range(min(count, CHAPTER_READ_AHEAD_MAX)):
+            data = self.get_prefetched(chapter_id) or await self.load_chapter(chapter_id)
+            if not data.has_content():
+                break
+            self.put_prefetched(chapter_id, data)
+            chapter_id = data.btns.get('next_btn')
+            if not chapter_id:
+                break
+
+    async def get_line_comment(self, chapter_id, count, index):
+        count = int(count)
+        data = {
+            'page': 1,
+            'count': count,
+            'chapter_id': chapter_id,
+            'paragraph_index': index
+        }
+        # 间贴缓存是进程内缓存, 可以直接在事件循环中读写
+        resp = self.get_cached_line_comment(chapter_id, count, index)
+        if resp is None:
+            key = self.make_line_comment_key(chapter_id, index)
+
+            async def fetch():
+                return (await self._request('POST', self.url('line_comment'), data=data)).json()['data']
+            resp = await self.flights.do(f'{key}:{count}', fetch)
+            self.line_comments.set(key, (count, resp), LINE_COMMENT_CACHE_TIMEOUT)
+        return self.parse_line_comment(data, resp)
+
+    async def get_line_comments(self, chapter_id, indexes, count=10):
+        chapter_id = str(chapter_id)
+        count = int(count)
+        chapter = self.get_prefetched(chapter_id)
+        if chapter is None and self.can_read(chapter_id):
+            chapter = await sync_to_async(self.chapter_store.get)(chapter_id)
+        result = {}
+        missing = []
+        for index in indexes:
+            if chapter is not None and chapter.tsukkomi_count(index) == 0:
+                result[index] = self.parse_line_comment(
+                    {'page': 1, 'count': count, 'chapter_id': chapter_id, 'paragraph_index': index}, {'data': []})
+            else:
+                missing.append(index)
+        # 限制同时请求的段落数, 与同步爬虫一致
+        semaphore = asyncio.Semaphore(LINE_COMMENT_MAX_WORKERS)
+
+        async def fetch(index):
+            async with semaphore:
+                return await self.get_line_comment(chapter_id, count, index)
+        for index, data in zip(missing, await asyncio.gather(*(fetch(index) for index in missing))):
+            result[index] = data
+        return result
+
+    async def send_line_comment(self, book_id, chapter_id, index, line_content, comment):
+        data = {
+            'BookID': book_id,
+            'ChapterID': chapter_id,
+            'paragraph_index': index,
+            'chapter_content': line_content,
+            'tsukkomi_content': comment
+        }
+        resp = await self._request('POST', self.url('line_comment_send'), data=data)
+        self.line_comments.delete(self.make_line_comment_key(chapter_id, index))
+        return resp.json()
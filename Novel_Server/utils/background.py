@@ -0,0 +1,45 @@
+#!/user/bin/env python
+# 每天都要有好心情
+# 后台任务模块
+# 在进程内的线程池中执行不需要等待结果的任务, 例如章节预读
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+
+from Novel_Server.utils.spiders_setting import BACKGROUND_WORKERS
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS, thread_name_prefix='background')
+_running = set()
+_running_lock = threading.Lock()
+
+
+def run_in_background(key, func, *args, **kwargs):
+    """
+    在后台线程中执行func, 相同key的任务还在执行时不会重复提交
+    :param key: 任务标识
+    :param func: 要执行的函数
+    :return: 是否提交了任务
+    """
+    with _running_lock:
+        if key in _running:
+            return False
+        _running.add(key)
+
+    def run():
+        # 线程池中的线程不会触发请求开始/结束信号, 需要自己清理失效的数据库连接
+        close_old_connections()
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            logger.exception('后台任务 %s 执行失败', key)
+        finally:
+            close_old_connections()
+            with _running_lock:
+                _running.discard(key)
+
+    _executor.submit(run)
+    return True
@@ -0,0 +1,136 @@
+#!/user/bin/env python
+# 每天都要有好心情
+# 章节内容存储模块
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+
+from Novel_Server.utils.compression import DictionaryMissing
+from Novel_Server.utils.paragraphs import PackedChapter
+from Novel_Server.utils.search_index import search_index
+from Novel_Server.utils.spiders_setting import CHAPTER_STORE_TIMEOUT, CHAPTER_STORE_TAIL_TIMEOUT, \
+    CHAPTER_STORE_LOCAL_MAX_ENTRIES
+
+
+class LocalChapterCache(object):
+    """
+    进程内的章节缓存, 直接保存PackedChapter对象, 读取时不需要反序列化与解压
+    超过max_entries时淘汰最久未读取的章节
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # 按最近读取时间排序, 最久未读取的在最前面, {键: (过期时间, 章节)}
+        self._items = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if item[0] <= time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return item[1]
+
+    def set(self, key, data, timeout):
+        with self._lock:
+            self._items[key] = (time.monotonic() + timeout, data)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+# 进程内所有网站的章节存储共用
+local_chapters = LocalChapterCache(CHAPTER_STORE_LOCAL_MAX_ENTRIES)
+
+
+class ChapterStore(object):
+    """
+    章节内容存储, 以(网站, 章节id)为键保存解码后的章节数据(紧凑格式, 见paragraphs.PackedChapter).
+    章节发布后内容基本不会变化, 所以所有书架共用同一份数据.
+    分为两层:
+    local: 进程内的LRU缓存(LocalChapterCache), 保存章节对象
+    shared: 所有进程共享的持久化缓存(settings.CACHES['chapters']),超出容量时淘汰最久未读取的章节
+            写入时章节文本使用训练的字典压缩(PackedChapter.to_state), 使用的字典不存在时当作没有保存
+    """
+
+    def __init__(self, site, shared_alias='chapters', local=local_chapters):
+        self.site = site
+        self.shared_alias = shared_alias
+        self.local = local
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def make_key(self, chapter_id):
+        return f'chapter:{self.site}:{chapter_id}'
+
+    @staticmethod
+    def get_timeout(data):
+        """
+        没有下一章的章节只短暂保存, 以便作者更新后能拿到新的下一章按钮
+        :param data: 章节数据
+        :return: 保存时间
+        """
+        btns = data.get('btns') or {}
+        return CHAPTER_STORE_TIMEOUT if btns.get('next_btn') else CHAPTER_STORE_TAIL_TIMEOUT
+
+    def get(self, chapter_id):
+        """
+        获取章节数据,先查进程内缓存,再查共享缓存
+        :param chapter_id: 章节id
+        :return: PackedChapter, 没有时返回None
+        """
+        key = self.make_key(chapter_id)
+        data = self.local.get(key)
+        if data is not None:
+            return data
+        try:
+            data = self.shared.get(key)
+            if data is not None:
+                data = PackedChapter.load(data)
+        except DictionaryMissing:
+            self.delete(chapter_id)
+            return None
+        if data is not None:
+            timeout = self.get_timeout(data)
+            self.local.set(key, data, timeout)
+            # 读取时续期, 使共享缓存中长时间没人读取的章节先过期淘汰
+            self.shared.touch(key, timeout)
+        return data
+
+    def set(self, chapter_id, data):
+        """
+        保存章节数据
+        :param chapter_id: 章节id
+        :param data: 解码后的章节数据, dict或PackedChapter
+        :return:
+        """
+        data = PackedChapter.pack(data)
+        key = self.make_key(chapter_id)
+        timeout = self.get_timeout(data)
+        self.local.set(key, data, timeout)
+        self.shared.set(key, data.to_state(compressed=True), timeout)
+        search_index.add_chapter(self.site, chapter_id, data)
+
+    def delete(self, chapter_id):
+        key = self.make_key(chapter_id)
+        self.local.delete(key)
+        self.shared.delete(key)
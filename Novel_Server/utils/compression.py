@@ -0,0 +1,166 @@
+#!/user/bin/env python
+# 每天都要有好心情
+# 章节内容压缩模块
+# 章节段落是短小且重复的中文, 单独压缩时效果很差, 所以使用从已保存的章节中训练的字典(zlib的zdict)压缩
+# 字典保存在数据库中(UserApp.models.CompressionDictionary), 每次训练生成新的版本,
+# 压缩时使用最新版本, 压缩后的数据记录字典版本, 旧版本的字典需要一直保留以便解压旧数据
+import logging
+import threading
+import time
+import zlib
+from collections import Counter
+
+from django.db import DatabaseError
+
+from Novel_Server.utils.spiders_setting import CHAPTER_COMPRESS_LEVEL, CHAPTER_COMPRESS_MIN_SIZE, \
+    CHAPTER_DICT_SIZE, CHAPTER_DICT_RELOAD_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# 不使用字典时的版本号
+NO_DICTIONARY = 0
+# 训练字典时统计的片段长度(字数)
+_NGRAM_LENGTHS = (2, 4, 8, 16)
+# 统计的片段过多时, 丢弃只出现过一次的片段
+_MAX_NGRAMS = 2000000
+
+
+class DictionaryMissing(Exception):
+    """
+    数据使用的字典版本不存在, 无法解压
+    """
+
+
+def train_dictionary(samples, size=CHAPTER_DICT_SIZE):
+    """
+    从样本文本中训练压缩字典
+    统计在多个样本中出现的片段, 按 出现的样本数 * 字节数 选取, 价值越高的片段越靠近字典末尾(deflate的回溯距离越短)
+    :param samples: 文本列表
+    :param size: 字典的最大字节数, zlib最多使用32KB
+    :return: 字典(bytes)
+    """
+    counter = Counter()
+    for text in samples:
+        counter.update({text[i:i + n] for n in _NGRAM_LENGTHS for i in range(len(text) - n + 1)})
+        if len(counter) > _MAX_NGRAMS:
+            counter = Counter({key: count for key, count in counter.items() if count > 1})
+    candidates = sorted(((count - 1) * len(key.encode()), key) for key, count in counter.items() if count > 1)
+    chosen, total = [], 0
+    for score, key in reversed(candidates):
+        data = key.encode()
+        if total + len(data) > size:
+            continue
+        # 已经选取的片段中包含时不再重复保存
+        if any(key in other for other in chosen):
+            continue
+        chosen.append(key)
+        total += len(data)
+        if total >= size - _NGRAM_LENGTHS[0] * 3:
+            break
+    return ''.join(reversed(chosen)).encode()
+
+
+def compress(data, zdict=None, level=CHAPTER_COMPRESS_LEVEL):
+    # 使用raw deflate, 不保存zlib头与校验值
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, 9, zlib.Z_DEFAULT_STRATEGY, zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, 9)
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress(data, zdict=None):
+    if zdict:
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict)
+    else:
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    return decompressor.decompress(data) + decompressor.flush()
+
+
+class DictionaryRegistry(object):
+    """
+    进程内的压缩字典, 字典不会修改, 加载后一直保存
+    最新版本每隔 CHAPTER_DICT_RELOAD_INTERVAL 秒从数据库检查一次, 其他进程训练的新字典会在这之后开始使用
+    """
+
+    def __init__(self, reload_interval=CHAPTER_DICT_RELOAD_INTERVAL):
+        self.reload_interval = reload_interval
+        self.dictionaries = {NO_DICTIONARY: None}
+        self.latest = NO_DICTIONARY
+        self.checked_at = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        从数据库加载还没有加载的字典
+        :return:
+        """
+        from UserApp.models import CompressionDictionary
+        try:
+            rows = list(CompressionDictionary.objects.exclude(version__in=list(self.dictionaries))
+                        .values_list('version', 'data'))
+        except DatabaseError:
+            logger.exception('加载压缩字典失败')
+            return
+        with self.lock:
+            for version, data in rows:
+                self.dictionaries[version] = bytes(data)
+            self.latest = max(self.dictionaries)
+            self.checked_at = time.monotonic()
+
+    def add(self, version, data):
+        with self.lock:
+            self.dictionaries[version] = bytes(data)
+            self.latest = max(self.dictionaries)
+
+    def active(self):
+        """
+        获取压缩时使用的字典
+        :return: (版本, 字典)
+        """
+        if self.checked_at is None or time.monotonic() - self.checked_at > self.reload_interval:
+            self.load()
+        version = self.latest
+        return version, self.dictionaries[version]
+
+    def get(self, version):
+        """
+        获取对应版本的字典, 没有加载过时从数据库加载
+        :param version: 版本
+        :return: 字典
+        """
+        try:
+            return self.dictionaries[version]
+        except KeyError:
+            self.load()
+        try:
+            return self.dictionaries[version]
+        except KeyError:
+            raise DictionaryMissing(f'压缩字典版本{version}不存在')
+
+
+registry = DictionaryRegistry()
+
+
+def compress_text(text):
+    """
+    压缩章节文本, 过短的文本不压缩
+    :param text: 文本
+    :return: (字典版本, 压缩后的数据), 没有压缩时版本为None, 数据为原文本
+    """
+    if len(text) < CHAPTER_COMPRESS_MIN_SIZE:
+        return None, text
+    version, zdict = registry.active()
+    return version, compress(text.encode(), zdict)
+
+
+def decompress_text(version, data):
+    """
+    解压compress_text压缩的文本
+    :param version: 字典版本, None表示没有压缩
+    :param data: 数据
+    :return: 文本
+    """
+    if version is None:
+        return data
+    return decompress(data, registry.get(version)).decode()
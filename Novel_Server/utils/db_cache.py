@@ -0,0 +1,31 @@
+#!/user/bin/env python
+# 每天都要有好心情
+# 数据库缓存模块
+# Django的DatabaseCache超出容量时按缓存键的顺序(ORDER BY cache_key)淘汰, 与数据是否经常读取无关
+from django.core.cache.backends.db import DatabaseCache
+from django.db import connections
+
+
+class ExpiryCullingDatabaseCache(DatabaseCache):
+    """
+    超出容量时按过期时间淘汰的数据库缓存: 先删除已过期的数据, 仍然超出容量时删除最早过期的 1/CULL_FREQUENCY
+    读取时通过touch续期(见ChapterStore.get), 保存时间相同的数据中过期时间越早表示越久没有读取
+    淘汰时按expires排序, 使用createcachetable创建的expires索引, 需要数据库支持 LIMIT ... OFFSET (MySQL, SQLite)
+    """
+
+    def _cull(self, db, cursor, now):
+        if self._cull_frequency == 0:
+            self.clear()
+            return
+        connection = connections[db]
+        table = connection.ops.quote_name(self._table)
+        cursor.execute('DELETE FROM %s WHERE expires < %%s' % table,
+                       [connection.ops.adapt_datetimefield_value(now)])
+        cursor.execute('SELECT COUNT(*) FROM %s' % table)
+        num = cursor.fetchone()[0]
+        if num > self._max_entries:
+            cull_num = num // self._cull_frequency
+            cursor.execute('SELECT expires FROM %s ORDER BY expires LIMIT 1 OFFSET %%s' % table, [cull_num])
+            row = cursor.fetchone()
+            if row:
+                cursor.execute('DELETE FROM %s WHERE expires < %%s' % table, [row[0]])
@@ -0,0 +1,83 @@
+#!/user/bin/env python
+# 每天都要有好心情
+# ETag与条件请求模块
+# 接口返回数据时带上ETag, 客户端再次请求时通过If-None-Match带回, 数据没有变化时返回304, 不返回数据
+# ETag由数据的版本(只在内容变化时增加的版本号, 内容摘要)计算, 判断是否变化时不需要序列化数据或请求原网站
+# 返回的数据中有不影响使用的时间字段(如快照的更新时间)时使用弱ETag
+import hashlib
+import json
+
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+
+# 压缩后的响应在ETag后加上的后缀(见http_compression.py), 比较时去掉
+COMPRESSION_SUFFIXES = ('-gzip', '-br')
+
+
+def make_etag(*parts):
+    """
+    计算强ETag
+    :param parts: 可以序列化为JSON的数据, 其他类型(如datetime)转为字符串
+    :return: 带引号的ETag
+    """
+    data = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(',', ':'), default=str)
+    return '"' + hashlib.blake2b(data.encode('utf-8'), digest_size=16).hexdigest() + '"'
+
+
+def make_weak_etag(*parts):
+    """
+    计算弱ETag, 数据的主要内容相同时不变, 用于带有时间等次要字段的数据
+    """
+    return 'W/' + make_etag(*parts)
+
+
+def normalize(etag):
+    """
+    去掉弱ETag的W/前缀与压缩后缀
+    """
+    if etag.startswith('W/'):
+        etag = etag[2:]
+    for suffix in COMPRESSION_SUFFIXES:
+        if etag.endswith(suffix + '"'):
+            return etag[:-len(suffix) - 1] + '"'
+    return etag
+
+
+def match(request, etag):
+    """
+    判断请求的If-None-Match是否包含etag
+    :param request: 请求
+    :param etag: 当前数据的ETag
+    :return: 匹配的客户端ETag, 不匹配时返回None
+    """
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return None
+    if header.strip() == '*':
+        return etag
+    # If-None-Match使用弱比较
+    etag = normalize(etag)
+    for client_etag in parse_etags(header):
+        if normalize(client_etag) == etag:
+            return client_etag
+    return None
+
+
+def not_modified(etag):
+    """
+    304响应, ETag与客户端保存的一致(包括压缩后缀)
+    """
+    response = HttpResponseNotModified()
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def set_etag(response, etag):
+    """
+    为响应设置ETag, 客户端每次使用前都需要验证
+    """
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -0,0 +1,215 @@
+#!/user/bin/env python
+# 每天都要有好心情
+# 书籍导出模块
+# 按目录顺序获取书架可以阅读的章节, 边获取边生成TXT或EPUB文件, 不在内存中保存整本书
+import logging
+import uuid
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from html import escape
+
+from django.db import close_old_connections
+
+from Novel_Server.utils.spiders_setting import EXPORT_MAX_WORKERS
+
+EXPORT_FORMATS = {
+    'txt': ('text/plain; charset=utf-8', 'txt'),
+    'epub': ('application/epub+zip', 'epub'),
+}
+
+# 获取失败的章节在文件中的内容
+FAILED_CONTENT = '(该章节获取失败, 请稍后重新导出)'
+
+logger = logging.getLogger(__name__)
+
+
+def readable_chapters(book_data):
+    """
+    按目录顺序返回可以阅读(免费或已解锁)的章节
+    :param book_data: get_book格式的书籍数据
+    :return: [(卷名, 章节)]
+    """
+    return [(volume['volume_name'], chapter)
+            for volume in book_data['book_volume_list']
+            for chapter in volume['chapter_list']
+            if chapter['is_lock'] in (-1, 0)]
+
+
+def iter_chapters(spider, chapters, workers=EXPORT_MAX_WORKERS):
+    """
+    使用workers个线程获取章节, 按顺序返回
+    最多同时保存workers * 2个章节, 已在章节存储或预读缓冲区中的章节不会请求原网站
+    单个章节获取失败时返回只有一行提示的章节, 不影响其他章节与文件的完整性
+    :param spider: 爬虫
+    :param chapters: readable_chapters的返回值
+    :param workers: 线程数
+    :return: 生成器, (卷名, 章节, 章节数据)
+    """
+    def load(chapter_id):
+        close_old_connections()
+        try:
+            return spider.get_chapter(chapter_id)
+        except Exception:
+            # 此时响应已经开始发送, 不能再返回错误, 只能在文件中标记
+            logger.exception('导出章节 %s 失败', chapter_id)
+            return {'content': [{'index': 1, 'content': FAILED_CONTENT}]}
+        finally:
+            close_old_connections()
+
+    chapters = iter(chapters)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='book_export') as executor:
+        try:
+            for volume_name, chapter in chapters:
+                pending.append((volume_name, chapter, executor.submit(load, chapter['chapter_id'])))
+                if len(pending) >= workers * 2:
+                    volume_name, chapter, future = pending.popleft()
+                    yield volume_name, chapter, future.result()
+            while pending:
+                volume_name, chapter, future = pending.popleft()
+                yield volume_name, chapter, future.result()
+        finally:
+            # 客户端断开时不再获取剩下的章节
+            for _, _, future in pending:
+                future.cancel()
+
+
+def export_txt(book_data, chapters):
+    """
+    生成TXT文件
+    :param book_data: 书籍数据
+    :param chapters: iter_chapters的返回值
+    :return: 生成器, 文件内容
+    """
+    yield f"{book_data['book_title']}\n作者: {book_data['book_author']}\n\n".encode('utf-8')
+    current_volume = None
+    for volume_name, chapter, data in chapters:
+        lines = []
+        if volume_name != current_volume:
+            current_volume = volume_name
+            lines.append(f'\n{volume_name}\n')
+        lines.append(f"\n{data.get('title') or chapter['chapter_title']}\n\n")
+        lines.extend(f"　　{line['content']}\n" for line in data.get('content', ()))
+        yield ''.join(lines).encode('utf-8')
+
+
+class StreamBuffer:
+    """
+    只能写入的文件对象, zipfile写入的数据在每个文件写完后取出
+    没有tell与seek, zipfile会按不可寻址的流写入
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def read_all(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+_CONTAINER = '''<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>'''
+
+_CHAPTER = '''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="zh-CN">
+<head><title>{title}</title></head>
+<body>
+{volume}<h2>{title}</h2>
+{content}
+</body>
+</html>'''
+
+_NAV = '''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" xml:lang="zh-CN">
+<head><title>目录</title></head>
+<body>
+<nav epub:type="toc"><h1>目录</h1><ol>
+{items}
+</ol></nav>
+</body>
+</html>'''
+
+_OPF = '''<?xml version="1.0" encoding="UTF-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="book-id" xml:lang="zh-CN">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:identifier id="book-id">urn:uuid:{uuid}</dc:identifier>
+    <dc:title>{title}</dc:title>
+    <dc:creator>{author}</dc:creator>
+    <dc:language>zh-CN</dc:language>
+  </metadata>
+  <manifest>
+    <item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>
+{manifest}
+  </manifest>
+  <spine>
+{spine}
+  </spine>
+</package>'''
+
+
+def export_epub(book_data, chapters):
+    """
+    生成EPUB3文件, 每章一个xhtml, 目录与清单在所有章节写完后写入
+    :param book_data: 书籍数据
+    :param chapters: iter_chapters的返回值
+    :return: 生成器, 文件内容
+    """
+    buffer = StreamBuffer()
+    book = zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED)
+    # mimetype必须是第一个文件且不压缩
+    book.writestr('mimetype', 'application/epub+zip', compress_type=zipfile.ZIP_STORED)
+    book.writestr('META-INF/container.xml', _CONTAINER)
+    yield buffer.read_all()
+    written = []
+    current_volume = None
+    for volume_name, chapter, data in chapters:
+        title = escape(data.get('title') or chapter['chapter_title'])
+        volume = ''
+        if volume_name != current_volume:
+            current_volume = volume_name
+            volume = f'<h1>{escape(volume_name)}</h1>\n'
+        content = '\n'.join(f"<p>{escape(line['content'])}</p>" for line in data.get('content', ()))
+        name = f'chapter_{len(written)}.xhtml'
+        book.writestr(f'OEBPS/{name}', _CHAPTER.format(title=title, volume=volume, content=content))
+        written.append((name, title))
+        yield buffer.read_all()
+    book.writestr('OEBPS/nav.xhtml', _NAV.format(
+        items='\n'.join(f'<li><a href="{name}">{title}</a></li>' for name, title in written)))
+    book.writestr('OEBPS/content.opf', _OPF.format(
+        uuid=uuid.uuid4(),
+        title=escape(book_data['book_title']),
+        author=escape(book_data['book_author']),
+        manifest='\n'.join(f'    <item id="c{i}" href="{name}" media-type="application/xhtml+xml"/>'
+                           for i, (name, _) in enumerate(written)),
+        spine='\n'.join(f'    <itemref idref="c{i}"/>' for i in range(len(written)))))
+    book.close()
+    yield buffer.read_all()
+
+
+def export_book(spider, book_data, export_format):
+    """
+    导出书籍
+    :param spider: 已登录的爬虫
+    :param book_data: get_book格式的书籍数据
+    :param export_format: txt或epub
+    :return: 生成器, 文件内容
+    """
+    chapters = iter_chapters(spider, readable_chapters(book_data))
+    if export_format == 'epub':
+        return export_epub(book_data, chapters)
+    return export_txt(book_data, chapters)
@@ -0,0 +1,231 @@
+#!/user/bin/env python
+# 每天都要有好心情
+# 页面解析模块
+# 使用预先编译的lxml XPath提取数据, 代替BeautifulSoup的整页解析与逐层find
+# 各网站的页面结构用下面的节点声明(见 sites/ 下的网站配置), 加载网站配置时编译为提取函数,
+# 解析页面时只执行编译好的XPath, 不再处理选择器
+from lxml import etree
+
+# 没有默认值, 找不到节点时抛出ValueError
+REQUIRED = object()
+
+
+def has_class(name):
+    """
+    生成匹配class的XPath条件, 与BeautifulSoup的class_参数一致(class中包含该类名即可)
+    :param name: 类名
+    :return: XPath条件
+    """
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+def compile_xpath(path):
+    return etree.XPath(path, smart_strings=False)
+
+
+def parse_html(html):
+    """
+    解析页面, 返回根节点
+    :param html: 页面文本
+    :return: 根节点
+    """
+    root = etree.HTML(html, parser=_parser)
+    if root is None:
+        raise ValueError('页面解析失败!')
+    return root
+
+
+def first(xpath, node):
+    """
+    返回XPath匹配的第一个结果, 没有时抛出ValueError
+    """
+    result = xpath(node)
+    if not result:
+        raise ValueError('页面解析失败!')
+    return result[0]
+
+
+def text(node):
+    """
+    与BeautifulSoup的get_text().strip()一致
+    """
+    return ''.join(node.itertext()).strip()
+
+
+def last_part(url):
+    return url.split('/')[-1]
+
+
+_parser = etree.HTMLParser(remove_comments=True)
+
+
+def _selector(xpath, default=REQUIRED):
+    """
+    编译选取单个节点的函数, xpath为None时返回当前节点
+    找不到节点时, 没有默认值抛出ValueError, 否则返回None
+    """
+    if xpath is None:
+        return lambda node: node
+    path = compile_xpath(xpath)
+    if default is REQUIRED:
+        return lambda node: first(path, node)
+
+    def select(node):
+        result = path(node)
+        return result[0] if result else None
+    return select
+
+
+class Node(object):
+    """
+    页面结构的声明, compile() 返回 func(节点) -> 数据
+    """
+
+    def compile(self):
+        raise NotImplementedError
+
+
+class Value(Node):
+    """
+    对选取的节点调用func
+    :param func: func(节点) -> 数据
+    :param xpath: 相对于当前节点的XPath, 取第一个结果, 为None时使用当前节点
+    :param default: 找不到节点时的默认值, 不传时抛出ValueError
+    """
+
+    def __init__(self, func, xpath=None, default=REQUIRED):
+        self.func = func
+        self.xpath = xpath
+        self.default = default
+
+    def compile(self):
+        select = _selector(self.xpath, self.default)
+        func, default = self.func, self.default
+
+        def extract(node):
+            element = select(node)
+            return default if element is None else func(element)
+        return extract
+
+
+class Text(Value):
+    """
+    节点的文本, 可以用transform转换
+    """
+
+    def __init__(self, xpath=None, transform=None, default=REQUIRED):
+        super().__init__((lambda element: transform(text(element))) if transform else text, xpath, default)
+
+
+class Attr(Value):
+    """
+    节点的属性, 可以用transform转换
+    """
+
+    def __init__(self, xpath, name, transform=None, default=REQUIRED):
+        super().__init__((lambda element: transform(element.get(name))) if transform else
+                         (lambda element: element.get(name)), xpath, default)
+
+
+class Html(Value):
+    """
+    节点的html
+    """
+
+    def __init__(self, xpath=None, default=REQUIRED):
+        super().__init__(lambda element: etree.tostring(element, encoding='unicode', method='html', with_tail=False),
+                         xpath, default)
+
+
+class Each(Node):
+    """
+    对XPath匹配的每个节点提取item, 返回列表
+    :param xpath: 相对于当前节点(有scope时为scope节点)的XPath
+    :param item: 每个节点的结构
+    :param scope: 先选取的节点, 找不到时抛出ValueError
+    """
+
+    def __init__(self, xpath, item, scope=None):
+        self.xpath = xpath
+        self.item = item
+        self.scope = scope
+
+    def compile(self):
+        select = _selector(self.scope)
+        path = compile_xpath(self.xpath)
+        item = self.item.compile()
+        return lambda node: [item(element) for element in path(select(node))]
+
+
+class Group(object):
+    """
+    在Record中先选取一个节点, 再从该节点提取多个字段, 字段直接合并到Record中
+    同一个节点下的多个字段不需要重复查找该节点
+    """
+
+    def __init__(self, scope, fields):
+        self.scope = scope
+        self.fields = fields
+
+
+class Record(Node):
+    """
+    按字段提取, 返回dict, 字段顺序与声明顺序一致
+    :param fields: {字段名: 节点}, 值为Group时其中的字段合并到结果中(键名不使用)
+    :param scope: 先选取的节点, 找不到时抛出ValueError
+    """
+
+    def __init__(self, fields, scope=None):
+        self.fields = fields
+        self.scope = scope
+
+    def compile(self):
+        select = _selector(self.scope)
+        steps = []
+        for name, field in self.fields.items():
+            if isinstance(field, Group):
+                steps.append((None, Record(field.fields, field.scope).compile()))
+            else:
+                steps.append((name, field.compile()))
+
+        def extract(node):
+            node = select(node)
+            data = {}
+            for name, step in steps:
+                if name is None:
+                    data.update(step(node))
+                else:
+                    data[name] = step(node)
+            return data
+        return extract
+
+
+class Zip(Node):
+    """
+    把多个列表按位置合并为dict的列表, 用于名称与内容是并列节点的结构(如卷名与章节列表)
+    :param fields: {字段名: 返回列表的节点}
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def compile(self):
+        names = list(self.fields)
+        steps = [field.compile() for field in self.fields.values()]
+        return lambda node: [dict(zip(names, values)) for values in zip(*(step(node) for step in steps))]
+
+
+class Page(object):
+    """
+    一个页面的解析函数
+    :param node: 页面的结构, 从根节点开始提取
+    :param post: post(数据, 页面文本, *参数), 整理提取的数据, 返回最终结果
+    """
+
+    def __init__(self, node, post=None):
+        self.extract = node.compile()
+        self.post = post
+
+    def __call__(self, html, *args):
+        data = self.extract(parse_html(html))
+        return self.post(data, html, *args) if self.post else data
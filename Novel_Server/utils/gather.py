@@ -0,0 +1,188 @@
+#!/user/bin/env python
+# 每天都要有好心情
+# 多书架并发查询模块
+# 同时向用户的所有书架发送请求, 每个书架单独返回状态, 一个书架失败或超时不影响其他书架
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+from Novel_Server.utils.metrics import bind_context
+from Novel_Server.utils.spiders_setting import GATHER_MAX_WORKERS, GATHER_SHELF_TIMEOUT
+
+# 书架状态
+STATUS_OK = 2000
+STATUS_ERROR = 2002
+STATUS_TIMEOUT = 2003
+STATUS_UNSUPPORTED = 2004
+
+logger = logging.getLogger(__name__)
+_executor = ThreadPoolExecutor(max_workers=GATHER_MAX_WORKERS, thread_name_prefix='shelf_gather')
+
+
+def make_result(shelf, key, status, msg, data=None):
+    return {
+        'shelf_id': shelf.id,
+        'shelf_title': shelf.shelf_title,
+        'status': status,
+        'msg': msg,
+        key: data
+    }
+
+
+def error_result(shelf, key, error):
+    """
+    书架查询出错时的结果, 网络错误, 解析错误等都只影响这一个书架
+    :param error: 异常, ValueError的信息直接返回给用户, 其他异常记录日志
+    """
+    if isinstance(error, ValueError):
+        return make_result(shelf, key, STATUS_ERROR, str(error))
+    logger.exception('书架 %s 查询失败', shelf.id, exc_info=error)
+    return make_result(shelf, key, STATUS_ERROR, '请求原网站失败')
+
+
+def run_shelf(shelf, func, key):
+    """
+    查询单个书架
+    :param shelf: 书架
+    :param func: func(spider), 返回该书架的数据
+    :param key: 数据在结果中的键名
+    :return: 该书架的结果
+    """
+    try:
+        spider = shelf.spider
+        if not spider:
+            return make_result(shelf, key, STATUS_UNSUPPORTED, '暂不支持该网站')
+        return make_result(shelf, key, STATUS_OK, 'ok', func(spider))
+    except Exception as e:
+        return error_result(shelf, key, e)
+
+
+def run_shelf_in_thread(shelf, func, key, deadline):
+    # 在线程池中排队超过等待时间的书架已经返回了超时状态, 不再执行, 把线程留给之后的请求
+    if time.monotonic() >= deadline:
+        return make_result(shelf, key, STATUS_TIMEOUT, '请求超时')
+    # 线程池中的线程不会触发请求开始/结束信号, 需要自己清理失效的数据库连接
+    close_old_connections()
+    try:
+        return run_shelf(shelf, func, key)
+    finally:
+        close_old_connections()
+
+
+def gather_shelves(shelf_set, func, key, timeout=GATHER_SHELF_TIMEOUT):
+    """
+    并发查询多个书架, 总耗时取决于最慢的书架而不是所有书架耗时之和
+    :param shelf_set: 书架列表
+    :param func: func(spider), 返回该书架的数据
+    :param key: 数据在结果中的键名
+    :param timeout: 每个书架的最长等待时间(秒)
+    :return: {书架id: 结果}, 结果中的status为该书架的状态
+    """
+    shelf_set = list(shelf_set)
+    # 只有一个书架时同样在线程池中查询, 超时后直接返回
+    deadline = time.monotonic() + timeout
+    futures = {shelf.id: _executor.submit(bind_context(run_shelf_in_thread), shelf, func, key, deadline)
+               for shelf in shelf_set}
+    wait(futures.values(), timeout=max(deadline - time.monotonic(), 0))
+    data = {}
+    for shelf in shelf_set:
+        future = futures[shelf.id]
+        if future.done():
+            data[shelf.id] = future.result()
+        else:
+            # 还没开始执行的任务直接取消, 已经在执行的任务结果会被丢弃,
+            # 每次请求原网站都有超时时间(SPIDER_TIMEOUT), 不会一直占用线程
+            future.cancel()
+            data[shelf.id] = make_result(shelf, key, STATUS_TIMEOUT, '请求超时')
+    return data
+
+
+async def async_gather_shelves(shelf_set, get_spider, func, key, timeout=GATHER_SHELF_TIMEOUT):
+    """
+    gather_shelves的异步版本
+    :param shelf_set: 书架列表
+    :param get_spider: 协程函数, get_spider(shelf)返回登录后的异步爬虫
+    :param func: 协程函数, func(spider)返回该书架的数据
+    :param key: 数据在结果中的键名
+    :param timeout: 每个书架的最长等待时间(秒)
+    :return: {书架id: 结果}
+    """
+    async def run(shelf):
+        try:
+            spider = await get_spider(shelf)
+            if not spider:
+                return make_result(shelf, key, STATUS_UNSUPPORTED, '暂不支持该网站')
+            return make_result(shelf, key, STATUS_OK, 'ok', await func(spider))
+        except Exception as e:
+            return error_result(shelf, key, e)
+
+    async def run_with_timeout(shelf):
+        try:
+            return await asyncio.wait_for(run(shelf), timeout)
+        except asyncio.TimeoutError:
+            return make_result(shelf, key, STATUS_TIMEOUT, '请求超时')
+
+    shelf_set = list(shelf_set)
+    results = await asyncio.gather(*[run_with_timeout(shelf) for shelf in shelf_set])
+    return {shelf.id: result for shelf, result in zip(shelf_set, results)}
+
+
+def local_or_gather(shelf_set, local, func, key):
+    """
+    先按网站查询本地数据, 同一网站的书架共用结果, 没有本地数据的书架再通过gather_shelves查询原网站
+    :param shelf_set: 书架
+    :param local: local(web_url), 返回本地数据, 没有时返回None
+    :param func: func(spider), 返回该书架的数据
+    :param key: 数据在结果中的键名
+    :return: 与gather_shelves相同
+    """
+    data, remote, sites = {}, [], {}
+    for shelf in shelf_set:
+        if shelf.web_url not in sites:
+            sites[shelf.web_url] = local(shelf.web_url)
+        if sites[shelf.web_url] is None:
+            remote.append(shelf)
+        else:
+            data[shelf.id] = make_result(shelf, key, STATUS_OK, 'ok', sites[shelf.web_url])
+    if remote:
+        data.update(gather_shelves(remote, func, key))
+    return data
+
+
+async def async_local_or_gather(shelf_set, local, get_spider, func, key):
+    """
+    local_or_gather的异步版本, local在线程中执行
+    :param shelf_set: 书架
+    :param local: local(web_url), 返回本地数据, 没有时返回None
+    :param get_spider: 协程函数, get_spider(shelf)返回登录后的异步爬虫
+    :param func: 协程函数, func(spider)返回该书架的数据
+    :param key: 数据在结果中的键名
+    :return: 与gather_shelves相同
+    """
+    data, remote, sites = {}, [], {}
+    for shelf in shelf_set:
+        if shelf.web_url not in sites:
+            sites[shelf.web_url] = await sync_to_async(local)(shelf.web_url)
+        if sites[shelf.web_url] is None:
+            remote.append(shelf)
+        else:
+            data[shelf.id] = make_result(shelf, key, STATUS_OK, 'ok', sites[shelf.web_url])
+    if remote:
+        data.update(await async_gather_shelves(remote, get_spider, func, key))
+    return data
+
+
+def summary_status(data):
+    """
+    根据各书架的结果得到整体状态, 所有书架都失败时返回第一个失败的信息
+    :param data: gather_shelves的结果
+    :return: 状态码, 失败信息
+    """
+    failed = [result for result in data.values() if result['status'] in (STATUS_ERROR, STATUS_TIMEOUT)]
+    if failed and len(failed) == len(data):
+        return STATUS_ERROR, failed[0]['msg']
+    return STATUS_OK, None
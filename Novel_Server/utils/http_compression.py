@@ -0,0 +1,57 @@
+#!/user/bin/env python
+# 每天都要有好心情
+# 响应压缩模块
+# 书籍详情(完整目录)与章节内容的响应较大, 客户端支持时压缩后返回
+# 安装了brotli且客户端支持br时使用brotli, 否则使用gzip
+import re
+
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+from Novel_Server.utils import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+_accepts_br = re.compile(r'\bbr\b')
+_accepts_gzip = re.compile(r'\bgzip\b')
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    压缩大于 settings.RESPONSE_COMPRESS_MIN_SIZE 字节的响应, 压缩耗时记为compress阶段
+    流式响应(书籍导出)交给GZipMiddleware处理
+    """
+
+    def process_response(self, request, response):
+        if response.streaming:
+            return super().process_response(request, response)
+        if response.has_header('Content-Encoding') or len(response.content) < settings.RESPONSE_COMPRESS_MIN_SIZE:
+            return response
+        patch_vary_headers(response, ('Accept-Encoding', ))
+        accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if brotli is not None and _accepts_br.search(accept_encoding):
+            encoding = 'br'
+            with metrics.phase('compress'):
+                content = brotli.compress(response.content, quality=settings.RESPONSE_BROTLI_QUALITY)
+        elif _accepts_gzip.search(accept_encoding):
+            encoding = 'gzip'
+            with metrics.phase('compress'):
+                content = compress_string(response.content)
+        else:
+            return response
+        # 压缩后没有变小时返回原数据
+        if len(content) >= len(response.content):
+            return response
+        response.content = content
+        response['Content-Length'] = str(len(content))
+        # 压缩后的内容不再逐字节相同, 强ETag加上压缩方式的后缀, 比较时去掉(见etags.py)
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = f'{etag[:-1]}-{encoding}"'
+        response['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,114 @@
+#!/user/bin/env python
+# 每天都要有好心情
+# 后台任务执行模块
+# 任务保存在数据库中(UserApp.models.CrawlJob), 由 python manage.py crawl_worker 启动的进程执行
+import logging
+import socket
+import os
+import threading
+import time
+
+from django.db import close_old_connections
+
+from UserApp.models import CrawlJob
+from Novel_Server.utils.spiders_setting import JOB_POLL_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+
+
+def register(kind):
+    """
+    注册任务处理函数, 处理函数接收任务参数的dict
+    处理函数抛出ValueError时任务直接失败, 抛出其他异常时会重试
+    :param kind: 任务类型
+    """
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def run_job(job):
+    """
+    执行任务, 并根据结果删除任务或者记录失败
+    :param job: 任务
+    """
+    handler = _handlers.get(job.kind)
+    if handler is None:
+        job.fail(f'未知的任务类型: {job.kind}', retry=False)
+        return
+    try:
+        handler(job.payload_data)
+    except ValueError as e:
+        job.fail(str(e), retry=False)
+    except Exception as e:
+        logger.exception('任务 %s 执行失败', job)
+        job.fail(repr(e))
+    else:
+        job.finish()
+
+
+class Worker:
+    """
+    从任务队列中取出任务执行, 每个线程同时执行一个任务
+    """
+
+    def __init__(self, concurrency=1, poll_interval=JOB_POLL_INTERVAL):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        self.stopped = threading.Event()
+
+    def run_once(self):
+        """
+        执行任务直到没有可以执行的任务
+        :return: 执行的任务数
+        """
+        count = 0
+        while not self.stopped.is_set():
+            close_old_connections()
+            job = CrawlJob.claim(f'{self.name}:{threading.current_thread().name}')
+            if job is None:
+                break
+            run_job(job)
+            count += 1
+        return count
+
+    def loop(self, once=False):
+        while not self.stopped.is_set():
+            try:
+                if not self.run_once():
+                    if once:
+                        break
+                    self.stopped.wait(self.poll_interval)
+            except Exception:
+                # 数据库暂时不可用等情况, 等待后继续
+                logger.exception('获取任务失败')
+                self.stopped.wait(self.poll_interval)
+        close_old_connections()
+
+    def run(self, once=False):
+        """
+        启动线程执行任务
+        :param once: 为True时执行完当前可以执行的任务后退出
+        """
+        CrawlJob.release_stale()
+        threads = [threading.Thread(target=self.loop, args=(once, ), name=f'worker-{i}', daemon=True)
+                   for i in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=self.poll_interval)
+                if not once:
+                    CrawlJob.release_stale()
+        except KeyboardInterrupt:
+            self.stop()
+            for thread in threads:
+                thread.join()
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,317 @@
+#!/user/bin/env python
+# 每天都要有好心情
+# 请求计时与监控指标模块
+# 把一次请求分为几个阶段(auth: token认证, db: 数据库查询, throttle: 等待限速, upstream: 请求原网站,
+# parse: 解析页面, render: 返回数据序列化), 每个阶段的耗时写入响应头 Server-Timing,
+# 同时累计到进程内的监控指标, 通过 /metrics 以Prometheus文本格式输出
+# 指标保存在每个进程中, 多进程部署时需要分别采集每个进程
+import asyncio
+import contextvars
+import hmac
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from asgiref.sync import markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+
+from Novel_Server.utils import transport
+
+# 延迟的分桶(秒)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# 每个请求的数据库查询数的分桶
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric(object):
+    """
+    监控指标的基类, 按标签值分别保存
+    """
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def key(self, labels):
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        return [f'{self.name}{_format_labels(self.label_names, key)} {value}' for key, value in items]
+
+
+class Gauge(Metric):
+    """
+    读取时通过func获取当前值, func返回 {标签值元组: 值}
+    """
+    type = 'gauge'
+
+    def __init__(self, name, documentation, func, labels=()):
+        super().__init__(name, documentation, labels)
+        self.func = func
+
+    def samples(self):
+        return [f'{self.name}{_format_labels(self.label_names, key)} {value}'
+                for key, value in sorted(self.func().items())]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            data = self.values.get(key)
+            if data is None:
+                # 每个分桶的数量, 总和, 总数
+                data = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[0][i] += 1
+                    break
+            data[1] += value
+            data[2] += 1
+
+    def samples(self):
+        with self.lock:
+            items = sorted((key, (list(data[0]), data[1], data[2])) for key, data in self.values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                lines.append(f'{self.name}_bucket{_format_labels(self.label_names, key, [("le", bound)])} '
+                             f'{cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(self.label_names, key, [("le", "+Inf")])} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(self.label_names, key)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(self.label_names, key)} {count}')
+        return lines
+
+
+REGISTRY = []
+
+REQUEST_SECONDS = Histogram('novel_request_duration_seconds', '接口的处理时间', ('view', 'method'))
+REQUESTS = Counter('novel_requests_total', '接口的请求数', ('view', 'method', 'status'))
+PHASE_SECONDS = Histogram('novel_phase_duration_seconds', '各阶段每次执行的耗时', ('phase', ))
+DB_QUERIES = Counter('novel_db_queries_total', '数据库查询数', ('alias', ))
+REQUEST_DB_QUERIES = Histogram('novel_request_db_queries', '每个请求的数据库查询数', ('view', ),
+                               buckets=QUERY_COUNT_BUCKETS)
+UPSTREAM_REQUESTS = Counter('novel_upstream_requests_total', '发往原网站的请求数', ('site', 'status'))
+UPSTREAM_BYTES = Counter('novel_upstream_response_bytes_total', '原网站返回的数据量(字节)', ('site', ))
+POOL_STATS = Gauge('novel_spider_pool', '爬虫共享连接池的累计计数(见transport.PoolStats)',
+                   lambda: {(key, ): value for key, value in transport.stats.snapshot().items()}, ('stat', ))
+
+
+class RequestTiming(object):
+    """
+    一次请求中各阶段的累计耗时与次数
+    线程池中并发执行的阶段(如同时查询多个书架)会分别累计, 所以各阶段之和可能超过总耗时
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self.lock:
+            total, count = self.phases.get(name, (0.0, 0))
+            self.phases[name] = (total + seconds, count + 1)
+
+    def count(self, name):
+        return self.phases.get(name, (0.0, 0))[1]
+
+    def header(self, total):
+        with self.lock:
+            phases = sorted(self.phases.items())
+        items = [f'{name};dur={seconds * 1000:.1f};desc="{count}"' for name, (seconds, count) in phases]
+        items.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(items)
+
+
+_current = contextvars.ContextVar('request_timing', default=None)
+
+
+def record(name, seconds):
+    """
+    记录一个阶段的耗时
+    :param name: 阶段名称
+    :param seconds: 耗时(秒)
+    """
+    PHASE_SECONDS.observe(seconds, phase=name)
+    timing = _current.get()
+    if timing is not None:
+        timing.add(name, seconds)
+
+
+@contextmanager
+def phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def timed(name):
+    """
+    把函数的执行时间记为一个阶段
+    :param name: 阶段名称
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind_context(func):
+    """
+    线程池中的线程不会继承当前请求的计时, 提交任务前用该函数包装
+    每次调用使用当前上下文的一份副本, 可以同时在多个线程中执行
+    """
+    context = contextvars.copy_context()
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+    return wrapper
+
+
+def record_upstream(site, status, size):
+    UPSTREAM_REQUESTS.inc(site=site, status=status)
+    UPSTREAM_BYTES.inc(size, site=site)
+
+
+def _execute_wrapper(execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record('db', time.perf_counter() - start)
+        DB_QUERIES.inc(alias=context['connection'].alias)
+
+
+def install_db_wrapper(sender, connection, **kwargs):
+    # 每个新建的数据库连接(包括线程池中的连接与数据库缓存的查询)都记录查询耗时
+    if _execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute_wrapper)
+
+
+connection_created.connect(install_db_wrapper)
+
+
+def get_view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return getattr(match.func, 'view_class', match.func).__name__
+
+
+class ServerTimingMiddleware(object):
+    """
+    记录每个请求各阶段的耗时, 写入响应头 Server-Timing 与监控指标
+    同时支持同步与异步接口
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        timing, token, start = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timing, start)
+
+    async def __acall__(self, request):
+        timing, token, start = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timing, start)
+
+    @staticmethod
+    def start():
+        timing = RequestTiming()
+        return timing, _current.set(timing), time.perf_counter()
+
+    @staticmethod
+    def finish(request, response, timing, start):
+        total = time.perf_counter() - start
+        view = get_view_name(request)
+        response['Server-Timing'] = timing.header(total)
+        REQUEST_SECONDS.observe(total, view=view, method=request.method)
+        REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+        REQUEST_DB_QUERIES.observe(timing.count('db'), view=view)
+        return response
+
+    def process_template_response(self, request, response):
+        # rest_framework的Response在这之后渲染(序列化为JSON), 渲染完成后记录耗时
+        start = time.perf_counter()
+        response.add_post_render_callback(lambda r: record('render', time.perf_counter() - start))
+        return response
+
+
+def render_metrics():
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+def metrics_view(request):
+    """
+    Prometheus文本格式的监控指标, 需要在请求头中带上 settings.METRICS_TOKEN: Authorization: Bearer <令牌>
+    """
+    token = settings.METRICS_TOKEN
+    scheme, _, credentials = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if not token or scheme.lower() != 'bearer' or not hmac.compare_digest(credentials.strip(), token):
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,109 @@
+#!/user/bin/env python
+# 每天都要有好心情
+# 页面数据缓存模块
+# 排行榜, 搜索结果等与用户无关的数据由所有用户共享, 在有效期内整个集群只请求一次原网站
+import asyncio
+import hashlib
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+
+from Novel_Server.utils.spiders_setting import PAGE_CACHE_TIMEOUTS, PAGE_CACHE_LOCK_TIMEOUT
+
+# 等待其他进程获取数据时的轮询间隔(秒)
+POLL_INTERVAL = 0.2
+
+
+class PageCache(object):
+    """
+    页面数据缓存, 存放在所有进程共享的缓存中(settings.CACHES['pages'])
+    缓存未命中时通过缓存中的锁保证只有一个进程请求原网站, 其他进程等待结果
+    """
+
+    def __init__(self, alias='pages'):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def make_key(endpoint, site, *args):
+        """
+        生成缓存键, 参数中可能有中文与空格, 使用摘要
+        :param endpoint: 接口名, 对应PAGE_CACHE_TIMEOUTS中的键
+        :param site: 网站
+        :param args: 接口参数
+        :return: 缓存键
+        """
+        digest = hashlib.sha1('\n'.join(str(arg) for arg in args).encode('utf-8')).hexdigest()
+        return f'page:{endpoint}:{site}:{digest}'
+
+    def set(self, endpoint, key, data):
+        """
+        直接更新缓存的数据, 用于后台任务预先获取
+        """
+        self.cache.set(key, data, PAGE_CACHE_TIMEOUTS[endpoint])
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+    def get_or_fetch(self, endpoint, key, fetch):
+        """
+        获取缓存的数据, 未命中时调用fetch获取并缓存
+        :param endpoint: 接口名, 决定缓存时间
+        :param key: 缓存键
+        :param fetch: 无参数的函数, 请求原网站获取数据
+        :return: 数据
+        """
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+        lock_key = key + ':lock'
+        owner = self.cache.add(lock_key, 1, PAGE_CACHE_LOCK_TIMEOUT)
+        if not owner:
+            # 其他进程正在获取, 等待其结果
+            deadline = time.monotonic() + PAGE_CACHE_LOCK_TIMEOUT
+            while time.monotonic() < deadline:
+                time.sleep(POLL_INTERVAL)
+                data = self.cache.get(key)
+                if data is not None:
+                    return data
+                if self.cache.get(lock_key) is None:
+                    break
+        try:
+            data = fetch()
+            self.cache.set(key, data, PAGE_CACHE_TIMEOUTS[endpoint])
+        finally:
+            if owner:
+                self.cache.delete(lock_key)
+        return data
+
+    async def aget_or_fetch(self, endpoint, key, fetch):
+        """
+        get_or_fetch的异步版本
+        :param fetch: 协程函数, 请求原网站获取数据
+        """
+        cache_get = sync_to_async(self.cache.get)
+        data = await cache_get(key)
+        if data is not None:
+            return data
+        lock_key = key + ':lock'
+        owner = await sync_to_async(self.cache.add)(lock_key, 1, PAGE_CACHE_LOCK_TIMEOUT)
+        if not owner:
+            deadline = time.monotonic() + PAGE_CACHE_LOCK_TIMEOUT
+            while time.monotonic() < deadline:
+                await asyncio.sleep(POLL_INTERVAL)
+                data = await cache_get(key)
+                if data is not None:
+                    return data
+                if await cache_get(lock_key) is None:
+                    break
+        try:
+            data = await fetch()
+            await sync_to_async(self.cache.set)(key, data, PAGE_CACHE_TIMEOUTS[endpoint])
+        finally:
+            if owner:
+                await sync_to_async(self.cache.delete)(lock_key)
+        return data
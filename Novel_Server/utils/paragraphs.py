@@ -0,0 +1,179 @@
+#!/user/bin/env python
+# 每天都要有好心情
+# 章节段落的紧凑存储
+# 章节的所有段落拼接成一个字符串, 另外保存每段的起始位置, 段落索引与间贴数,
+# 读取部分段落时只生成需要的段落, 不需要展开整个章节
+# 保存到共享的章节存储时文本使用训练的字典压缩(见compression.py, chapter_store.py)
+import hashlib
+import json
+from array import array
+from bisect import bisect_left, bisect_right
+
+from Novel_Server.utils.compression import compress_text, decompress_text
+
+
+class PackedChapter(object):
+    """
+    紧凑存储的章节数据
+    meta: 除content以外的章节数据(chapter_id, book_id, title, FontCount, btns)
+    text: 所有段落拼接成的字符串, 第i段为 text[offsets[i]:offsets[i + 1]]
+    indexes: 每段的paragraph_index
+    tsukkomi: 每段的间贴数
+    """
+    __slots__ = ('meta', 'text', 'offsets', 'indexes', 'tsukkomi', 'has_content_key')
+
+    def __init__(self, meta, text='', offsets=None, indexes=None, tsukkomi=None, has_content_key=True):
+        self.meta = meta
+        self.text = text
+        self.offsets = offsets if offsets is not None else array('I', [0])
+        self.indexes = indexes if indexes is not None else array('i')
+        self.tsukkomi = tsukkomi if tsukkomi is not None else array('I')
+        self.has_content_key = has_content_key
+
+    @classmethod
+    def pack(cls, data):
+        """
+        把parse_chapter_data格式的章节数据转换为紧凑格式
+        :param data: 章节数据
+        :return: PackedChapter, 已经是紧凑格式时直接返回
+        """
+        if isinstance(data, cls):
+            return data
+        meta = {key: value for key, value in data.items() if key != 'content'}
+        # 原网站返回的段落不一定按段落索引递增, 排序后locate与tsukkomi_count才能二分查找
+        content = sorted(data.get('content') or (), key=lambda line: int(line['index']))
+        offsets = array('I', [0])
+        parts = []
+        position = 0
+        for line in content:
+            parts.append(line['content'])
+            position += len(line['content'])
+            offsets.append(position)
+        return cls(meta, ''.join(parts), offsets,
+                   array('i', (int(line['index']) for line in content)),
+                   array('I', (line['tsukkomi'] for line in content)),
+                   'content' in data)
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def to_state(self, compressed=False):
+        """
+        转换为可以保存的数据, 数组按字节保存, 读取时直接复制, 不需要逐个还原
+        :param compressed: 为True时文本使用训练的字典压缩并记录字典版本, 只在写入共享存储时使用
+        :return: tuple
+        """
+        version, text = compress_text(self.text) if compressed else (None, self.text)
+        return (self.meta, text, self.offsets.tobytes(), self.indexes.tobytes(),
+                self.tsukkomi.tobytes(), self.has_content_key, version)
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        从to_state的返回值还原, 使用的字典不存在时抛出DictionaryMissing
+        """
+        chapter = cls.__new__(cls)
+        chapter.__setstate__(state)
+        return chapter
+
+    @classmethod
+    def load(cls, data):
+        """
+        还原章节存储中的数据
+        :param data: to_state的返回值, 或者之前保存的PackedChapter与dict格式
+        :return: PackedChapter
+        """
+        if isinstance(data, tuple):
+            return cls.from_state(data)
+        return cls.pack(data)
+
+    def __getstate__(self):
+        # pickle时不压缩, 只有写入共享存储时压缩(to_state)
+        return self.to_state()
+
+    def __setstate__(self, state):
+        if len(state) == 6:
+            # 兼容没有压缩的旧格式
+            state += (None, )
+        self.meta, text, offsets, indexes, tsukkomi, self.has_content_key, version = state
+        self.text = decompress_text(version, text)
+        self.offsets = array('I')
+        self.offsets.frombytes(offsets)
+        self.indexes = array('i')
+        self.indexes.frombytes(indexes)
+        self.tsukkomi = array('I')
+        self.tsukkomi.frombytes(tsukkomi)
+
+    def digest(self):
+        """
+        章节数据的摘要, 章节内容, 间贴数或上下章按钮变化时改变, 用于计算ETag, 不需要转换为章节数据
+        """
+        h = hashlib.blake2b(digest_size=16)
+        h.update(json.dumps(self.meta, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8'))
+        h.update(self.text.encode('utf-8'))
+        for values in (self.offsets, self.indexes, self.tsukkomi):
+            h.update(values.tobytes())
+        h.update(b'1' if self.has_content_key else b'0')
+        return h.hexdigest()
+
+    def get(self, key, default=None):
+        if key == 'content':
+            return self.paragraphs() if self.has_content_key else default
+        return self.meta.get(key, default)
+
+    @property
+    def btns(self):
+        return self.meta.get('btns') or {}
+
+    def has_content(self):
+        return len(self) > 0
+
+    def tsukkomi_count(self, index):
+        """
+        获取段落的间贴数
+        :param index: paragraph_index
+        :return: 间贴数, 没有该段落时返回None
+        """
+        position = bisect_left(self.indexes, index)
+        if position < len(self) and self.indexes[position] == index:
+            return self.tsukkomi[position]
+        return None
+
+    def locate(self, start=None, end=None):
+        """
+        查找paragraph_index在[start, end]之间的段落位置, 段落按paragraph_index升序保存
+        :return: 第一段与最后一段之后的位置
+        """
+        lo = 0 if start is None else bisect_left(self.indexes, start)
+        hi = len(self) if end is None else bisect_right(self.indexes, end)
+        return lo, max(lo, hi)
+
+    def paragraphs(self, start=None, end=None):
+        """
+        获取paragraph_index在[start, end]之间的段落, 不传时返回所有段落
+        :return: parse_chapter_data格式的段落列表
+        """
+        lo, hi = self.locate(start, end)
+        text, offsets, indexes, tsukkomi = self.text, self.offsets, self.indexes, self.tsukkomi
+        return [{
+            'index': indexes[i],
+            'content': text[offsets[i]:offsets[i + 1]],
+            'tsukkomi': tsukkomi[i]
+        } for i in range(lo, hi)]
+
+    def to_data(self, start=None, end=None):
+        """
+        转换为parse_chapter_data格式的章节数据
+        传入start或end时只包含该范围的段落, 并返回章节的总段数
+        :param start: 第一段的paragraph_index
+        :param end: 最后一段的paragraph_index
+        :return: 章节数据
+        """
+        data = dict(self.meta)
+        if self.has_content_key:
+            data['content'] = self.paragraphs(start, end)
+        if start is not None or end is not None:
+            data['paragraph_count'] = len(self)
+            data['start'] = start
+            data['end'] = end
+        return data
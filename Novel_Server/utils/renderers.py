@@ -0,0 +1,86 @@
+#!/user/bin/env python
+# 每天都要有好心情
+# 接口返回数据的序列化模块
+# 安装了orjson时JSON使用orjson序列化(结果与rest_framework的JSONRenderer一致),
+# 安装了msgpack时客户端可以通过 Accept: application/msgpack 获取MessagePack格式的数据
+# 都没有安装时与原来的JSONRenderer相同
+from django.http import HttpResponse
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+_encoder = JSONEncoder()
+
+
+def default(obj):
+    """
+    orjson与msgpack不支持的类型(datetime, Decimal, 查询集等)使用rest_framework的转换, 保证结果与JSONRenderer一致
+    """
+    return _encoder.default(obj)
+
+
+def dumps_json(data):
+    """
+    序列化为JSON
+    :return: utf-8编码的bytes
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=default,
+                            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+    return JSONRenderer().render(data)
+
+
+def dumps_msgpack(data):
+    if msgpack is None:
+        raise ValueError('没有安装msgpack!')
+    return msgpack.packb(data, default=default, use_bin_type=True, datetime=False)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    使用orjson的JSONRenderer, 需要缩进(浏览器中查看)时仍使用JSONRenderer
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if orjson is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps_json(data)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    MessagePack格式, 只在安装了msgpack时加入 DEFAULT_RENDERER_CLASSES
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return dumps_msgpack(data)
+
+
+def render_response(request, data, status=200):
+    """
+    不经过rest_framework的异步接口按Accept选择序列化方式
+    :param request: 请求
+    :param data: 返回的数据
+    :param status: 状态码
+    :return: HttpResponse
+    """
+    if msgpack is not None and MessagePackRenderer.media_type in request.META.get('HTTP_ACCEPT', ''):
+        return HttpResponse(dumps_msgpack(data), status=status, content_type=MessagePackRenderer.media_type)
+    return HttpResponse(dumps_json(data), status=status, content_type='application/json')
@@ -0,0 +1,267 @@
+#!/user/bin/env python
+# 每天都要有好心情
+# 本地全文搜索模块
+# 使用SQLite FTS5保存爬虫获取过的书籍(书名, 作者, 标签, 简介), 可选保存章节内容
+# 中文按两个字一组(bigram)切分后建立索引, 搜索时同样切分, 不依赖分词库
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+
+from django.conf import settings
+
+from Novel_Server.utils.spiders_setting import SEARCH_INDEX_PAGE_SIZE, SEARCH_INDEX_CHAPTERS
+
+logger = logging.getLogger(__name__)
+
+_token_re = re.compile(r'[0-9a-z]+|[㐀-䶿一-鿿豈-﫿]+')
+_tag_re = re.compile(r'<[^>]+>')
+_cjk_re = re.compile(r'[㐀-䶿一-鿿豈-﫿]')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS books (
+    id INTEGER PRIMARY KEY,
+    site TEXT NOT NULL,
+    book_id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    UNIQUE (site, book_id)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS book_fts USING fts5(title, author, labels, disc);
+CREATE TABLE IF NOT EXISTS chapters (
+    id INTEGER PRIMARY KEY,
+    site TEXT NOT NULL,
+    chapter_id TEXT NOT NULL,
+    book_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    UNIQUE (site, chapter_id)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS chapter_fts USING fts5(title, content);
+'''
+
+# 书名, 作者, 标签, 简介的权重
+_BOOK_RANK = 'bm25(book_fts, 10.0, 5.0, 2.0, 1.0)'
+
+
+def tokenize(text):
+    """
+    切分建立索引的文本, 英文与数字按单词, 中文按相邻两个字, 每段中文的最后一个字单独保留
+    这样单个字的搜索可以通过前缀匹配找到
+    :param text: 文本
+    :return: 空格分隔的词
+    """
+    tokens = []
+    for run in _token_re.findall(text.lower()):
+        if _cjk_re.match(run):
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+            tokens.append(run[-1])
+        else:
+            tokens.append(run)
+    return ' '.join(tokens)
+
+
+def make_query(keyword):
+    """
+    把搜索关键词转换为FTS5查询, 所有词都需要出现
+    :param keyword: 关键词
+    :return: 查询语句, 关键词中没有可以搜索的内容时返回None
+    """
+    phrases = []
+    for run in _token_re.findall(keyword.lower()):
+        if _cjk_re.match(run) and len(run) > 1:
+            # 连续的两字组合成短语, 要求在原文中相邻
+            phrases.append('"' + ' '.join(run[i:i + 2] for i in range(len(run) - 1)) + '"')
+        else:
+            phrases.append(f'"{run}"*')
+    return ' '.join(phrases) or None
+
+
+def parse_page(page):
+    """
+    页数, 不合法时为第一页
+    :param page: 请求中的页数
+    :return: 不小于1的整数
+    """
+    try:
+        return max(int(page), 1)
+    except (TypeError, ValueError):
+        return 1
+
+
+class SearchIndex(object):
+    """
+    本地搜索索引, 每个线程使用自己的数据库连接
+    数据库不支持FTS5或无法打开时不可用, 所有方法直接返回, 搜索交给原网站
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.available = True
+
+    @property
+    def conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None and self.available:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('PRAGMA synchronous=NORMAL')
+                conn.executescript(_SCHEMA)
+            except (sqlite3.Error, OSError):
+                logger.exception('无法打开本地搜索索引 %s', self.path)
+                self.available = False
+                return None
+            self.local.conn = conn
+        return conn
+
+    def add_books(self, site, books):
+        """
+        保存书籍, 已有的书籍只更新有值的字段
+        :param site: 网站
+        :param books: [{'book_id', 'book_title', 'book_author', 'book_cover', 'book_favo', 'book_popalrity',
+                        'book_label', 'book_disc'}], 可以只包含部分字段
+        """
+        conn = self.conn
+        if conn is None:
+            return
+        try:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                for book in books:
+                    self._add_book(conn, site, book)
+        except sqlite3.Error:
+            logger.exception('保存书籍到本地搜索索引失败')
+
+    @staticmethod
+    def _add_book(conn, site, book):
+        book_id = str(book['book_id'])
+        row = conn.execute('SELECT id, data FROM books WHERE site = ? AND book_id = ?', (site, book_id)).fetchone()
+        data = json.loads(row[1]) if row else {}
+        data.update({key: value for key, value in book.items() if value not in (None, '', [])})
+        data['book_id'] = book_id
+        if row:
+            rowid = row[0]
+            conn.execute('UPDATE books SET data = ? WHERE id = ?', (json.dumps(data, ensure_ascii=False), rowid))
+            conn.execute('DELETE FROM book_fts WHERE rowid = ?', (rowid, ))
+        else:
+            rowid = conn.execute('INSERT INTO books (site, book_id, data) VALUES (?, ?, ?)',
+                                 (site, book_id, json.dumps(data, ensure_ascii=False))).lastrowid
+        conn.execute('INSERT INTO book_fts (rowid, title, author, labels, disc) VALUES (?, ?, ?, ?, ?)', (
+            rowid,
+            tokenize(data.get('book_title', '')),
+            tokenize(data.get('book_author', '')),
+            tokenize(' '.join(data.get('book_label', []))),
+            tokenize(_tag_re.sub(' ', data.get('book_disc', ''))),
+        ))
+
+    def search(self, site, keyword, page=1):
+        """
+        在本地索引中搜索书籍
+        :param site: 网站
+        :param keyword: 关键词
+        :param page: 页数
+        :return: 与search_book格式相同的搜索结果, 没有结果或索引不可用时返回None
+        """
+        conn = self.conn
+        query = make_query(keyword)
+        if conn is None or query is None:
+            return None
+        page = parse_page(page)
+        try:
+            total = conn.execute(
+                'SELECT count(*) FROM book_fts JOIN books ON books.id = book_fts.rowid '
+                'WHERE book_fts MATCH ? AND books.site = ?', (query, site)).fetchone()[0]
+            if not total:
+                return None
+            rows = conn.execute(
+                f'SELECT books.data FROM book_fts JOIN books ON books.id = book_fts.rowid '
+                f'WHERE book_fts MATCH ? AND books.site = ? ORDER BY {_BOOK_RANK} LIMIT ? OFFSET ?',
+                (query, site, SEARCH_INDEX_PAGE_SIZE, (page - 1) * SEARCH_INDEX_PAGE_SIZE)).fetchall()
+        except sqlite3.Error:
+            logger.exception('本地搜索失败')
+            return None
+        books = []
+        for row in rows:
+            data = json.loads(row[0])
+            books.append({
+                'book_id': data['book_id'],
+                'book_title': data.get('book_title'),
+                'book_cover': data.get('book_cover'),
+                'book_author': data.get('book_author'),
+                'book_favo': data.get('book_favo'),
+                'book_popalrity': data.get('book_popalrity'),
+            })
+        return {
+            'pages': math.ceil(total / SEARCH_INDEX_PAGE_SIZE),
+            'page': page,
+            'total': len(books),
+            'books': books,
+            'source': 'local',
+        }
+
+    def add_chapter(self, site, chapter_id, data):
+        """
+        保存章节内容, 只有开启 SEARCH_INDEX_CHAPTERS 时保存
+        :param site: 网站
+        :param chapter_id: 章节id
+        :param data: PackedChapter
+        """
+        if not SEARCH_INDEX_CHAPTERS:
+            return
+        conn = self.conn
+        if conn is None:
+            return
+        title = data.get('title') or ''
+        try:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                row = conn.execute('SELECT id FROM chapters WHERE site = ? AND chapter_id = ?',
+                                   (site, str(chapter_id))).fetchone()
+                if row:
+                    rowid = row[0]
+                    conn.execute('DELETE FROM chapter_fts WHERE rowid = ?', (rowid, ))
+                else:
+                    rowid = conn.execute('INSERT INTO chapters (site, chapter_id, book_id, title) VALUES (?, ?, ?, ?)',
+                                         (site, str(chapter_id), str(data.get('book_id', '')), title)).lastrowid
+                conn.execute('INSERT INTO chapter_fts (rowid, title, content) VALUES (?, ?, ?)',
+                             (rowid, tokenize(title), tokenize(data.text)))
+        except sqlite3.Error:
+            logger.exception('保存章节到本地搜索索引失败')
+
+    def search_chapters(self, site, keyword, page=1):
+        """
+        在已保存的章节内容中搜索
+        :return: {'pages', 'page', 'total', 'chapters': [{'chapter_id', 'book_id', 'chapter_title'}]}
+        """
+        conn = self.conn
+        query = make_query(keyword)
+        if conn is None or query is None:
+            return None
+        page = parse_page(page)
+        try:
+            total = conn.execute(
+                'SELECT count(*) FROM chapter_fts JOIN chapters ON chapters.id = chapter_fts.rowid '
+                'WHERE chapter_fts MATCH ? AND chapters.site = ?', (query, site)).fetchone()[0]
+            rows = conn.execute(
+                'SELECT chapters.chapter_id, chapters.book_id, chapters.title FROM chapter_fts '
+                'JOIN chapters ON chapters.id = chapter_fts.rowid WHERE chapter_fts MATCH ? AND chapters.site = ? '
+                'ORDER BY bm25(chapter_fts, 5.0, 1.0) LIMIT ? OFFSET ?',
+                (query, site, SEARCH_INDEX_PAGE_SIZE, (page - 1) * SEARCH_INDEX_PAGE_SIZE)).fetchall()
+        except sqlite3.Error:
+            logger.exception('本地章节搜索失败')
+            return None
+        return {
+            'pages': math.ceil(total / SEARCH_INDEX_PAGE_SIZE),
+            'page': page,
+            'total': len(rows),
+            'chapters': [{'chapter_id': chapter_id, 'book_id': book_id, 'chapter_title': title}
+                         for chapter_id, book_id, title in rows],
+            'source': 'local',
+        }
+
+
+search_index = SearchIndex(settings.SEARCH_INDEX_PATH)
@@ -0,0 +1,102 @@
+#!/user/bin/env python
+# 每天都要有好心情
+# 网站配置模块
+# 每个网站一个模块, 模块中的SPEC声明网站的爬虫类, 请求地址与各页面的结构,
+# 页面结构在模块加载时编译为提取函数(见extractors.py), 网站模块在第一次使用时才加载
+import threading
+
+from django.utils.module_loading import import_module, import_string
+
+from Novel_Server.utils.extractors import Page
+from Novel_Server.utils.spiders_setting import SITES
+
+
+class SiteSpec(object):
+    """
+    一个网站的配置
+    :param site: 网站地址, 与书架的web_url一致
+    :param name: 网站名称
+    :param spider: 同步爬虫类的路径
+    :param async_spider: 异步爬虫类的路径
+    :param urls: {名称: 请求地址}
+    :param pages: {页面名称: Page}
+    """
+
+    def __init__(self, site, name, spider, async_spider, urls, pages):
+        self.site = site
+        self.name = name
+        self.spider = spider
+        self.async_spider = async_spider
+        self.urls = dict(urls)
+        self.pages = dict(pages)
+        for page in self.pages.values():
+            if not isinstance(page, Page):
+                raise TypeError(f'{name}的页面配置必须是Page')
+
+    def url(self, name, *args):
+        return self.urls[name].format(*args)
+
+    def extract(self, page, html, *args):
+        """
+        解析页面
+        :param page: 页面名称
+        :param html: 页面文本
+        :param args: 传给页面post函数的参数
+        """
+        return self.pages[page](html, *args)
+
+    def __repr__(self):
+        return f'<SiteSpec {self.name} {self.site}>'
+
+
+class SiteRegistry(object):
+    """
+    按网站地址加载网站配置, 每个网站的模块只加载一次
+    :param modules: {网站地址: 网站模块路径}
+    """
+
+    def __init__(self, modules):
+        self.modules = modules
+        self._specs = {}
+        self._classes = {}
+        self._lock = threading.Lock()
+
+    def get(self, site):
+        """
+        获取网站配置
+        :param site: 网站地址
+        :return: SiteSpec, 不支持的网站抛出KeyError
+        """
+        spec = self._specs.get(site)
+        if spec is None:
+            module = self.modules[site]
+            with self._lock:
+                spec = self._specs.get(site)
+                if spec is None:
+                    spec = self._specs[site] = import_module(module).SPEC
+        return spec
+
+    def get_spider_class(self, site, asynchronous=False):
+        """
+        获取网站的爬虫类
+        :param site: 网站地址
+        :param asynchronous: 是否获取异步爬虫类
+        :return: 爬虫类, 不支持的网站抛出KeyError
+        """
+        key = (site, asynchronous)
+        cls = self._classes.get(key)
+        if cls is None:
+            spec = self.get(site)
+            path = spec.async_spider if asynchronous else spec.spider
+            if not path:
+                raise KeyError(site)
+            cls = self._classes[key] = import_string(path)
+        return cls
+
+    def __contains__(self, site):
+        return site in self.modules
+
+
+registry = SiteRegistry(SITES)
+get_site = registry.get
+get_spider_class = registry.get_spider_class
@@ -0,0 +1,195 @@
+#!/user/bin/env python
+# 每天都要有好心情
+# 有毒小说网的网站配置
+import re
+
+from Novel_Server.utils.extractors import has_class, last_part, Page, Text, Attr, Html, Value, Each, Group, \
+    Record, Zip
+from Novel_Server.utils.sites import SiteSpec
+from Novel_Server.utils.spiders_setting import YOUDU_BASE_URL
+
+_caonima_re = re.compile(r'MemberSingleChapter.+?;')
+_void_href = 'javascript:void(0);'
+
+
+def extract_caonima(html):
+    """
+    获取章节页面里最后一个MemberSingleChapter调用中的caonima字符串
+    从页面末尾开始查找, 不需要扫描整个页面
+    """
+    start = html.rfind('MemberSingleChapter')
+    match = _caonima_re.match(html, start) if start != -1 else None
+    if match is None:
+        matches = _caonima_re.findall(html)
+        if not matches:
+            raise ValueError('页面解析失败!')
+        return matches[-1].split('"')[-2]
+    return match.group().split('"')[-2]
+
+
+def chapter_status(chapter):
+    status = chapter.get('class', '').split()
+    if status:
+        # 未解锁为1, 已解锁为0
+        return 1 if status[0] == 'lock_fill' else 0
+    # 免费章节
+    return -1
+
+
+def btn_id(href):
+    return last_part(href) if href != _void_href else None
+
+
+# 书籍的链接, 书籍id与标题都在第一个a标签中
+_book_link = Group('(.//a)[1]', {
+    'book_id': Attr(None, 'href', last_part),
+    'book_title': Attr(None, 'title'),
+})
+
+
+def post_shelf(books, html):
+    return {book['title']: book for book in books}
+
+
+def post_rank(books, html, page):
+    return {
+        'total': len(books),
+        'page': page,
+        'books': books
+    }
+
+
+def post_search(data, html, page):
+    return {
+        'pages': data['pages'],
+        'page': page,
+        'total': len(data['books']),
+        'books': data['books']
+    }
+
+
+def post_book(data, html):
+    data['chapter_lock'] = {chapter['chapter_id']: chapter['is_lock']
+                            for volume in data['book_volume_list'] for chapter in volume['chapter_list']}
+    return data
+
+
+def post_chapter(btns, html):
+    return btns, {
+        'sign': 'a3NvcnQoJHBhcmEpOw==',
+        'caonima': extract_caonima(html)
+    }
+
+
+SPEC = SiteSpec(
+    site='https://www.youdubook.com/',
+    name='有毒小说网',
+    spider='Novel_Server.utils.spiders.Spider_YouDu',
+    async_spider='Novel_Server.utils.async_spiders.AsyncSpider_YouDu',
+    # 请求地址, 性能测试时YOUDU_BASE_URL指向本地的模拟服务器
+    urls={
+        # 个人书架
+        'shelf': YOUDU_BASE_URL + '/user/favobook',
+        # 个人钱包
+        'wallet': YOUDU_BASE_URL + '/user/prepaidrecords',
+        # 书籍详情
+        'book': YOUDU_BASE_URL + '/book_detail/{}',
+        # 章节阅读页面, 获取caonima
+        'read_chapter': YOUDU_BASE_URL + '/readchapter/{}',
+        # 章节JSON数据
+        'chapter_json': YOUDU_BASE_URL + '/booklibrary/membersinglechapter/chapter_id/{}',
+        # 获取间贴
+        'line_comment': YOUDU_BASE_URL + '/booklibrary/tsukkomilist',
+        # 发送间贴
+        'line_comment_send': YOUDU_BASE_URL + '/booklibrary/tsukkomiadd',
+        # 订阅章节
+        'buy_chapter': YOUDU_BASE_URL + '/booklibrary/subscribebookaction',
+        # 排行榜: 榜单, 周期, 页数
+        'rank': YOUDU_BASE_URL + '/ranking/ranklist/tag/{}/type/{}?page={}',
+        # 搜索: 关键词, 页数
+        'search': YOUDU_BASE_URL + '/booklibrary/index/str/0_0_0_0_0_0_0_{}?page={}',
+        # 收藏与取消收藏小说
+        'add_book': YOUDU_BASE_URL + '/booklibrary/actionfavo',
+    },
+    pages={
+        # 书架页面, {书名: 书籍}
+        'shelf': Page(Each('.//li', Record({
+            'link': Group('(.//a)[1]', {
+                'id': Attr(None, 'href', last_part),
+                'title': Attr(None, 'title'),
+            }),
+            'cover': Attr('(.//img)[1]', 'data-original'),
+            'last_chapter': Group(f"((.//div[{has_class('updateChapter')}])[1]//a)[1]", {
+                'last_chapter': Text(),
+                'last_chapter_id': Attr(None, 'href', last_part),
+            }),
+        }), scope=f"(//div[{has_class('favoList')}])[1]"), post_shelf),
+        # 钱包页面
+        'wallet': Page(Record({
+            're_ticket': Text('((.//li)[1]//em)[1]'),
+            'mon_ticket': Text('((.//li)[2]//em)[1]'),
+            'san': Text('((.//li)[3]//em)[1]'),
+            'temp_san': Text('((.//li)[4]//em)[1]'),
+        }, scope=f"(//div[{has_class('Top')}])[1]")),
+        # 排行榜页面, 参数: 页数
+        'rank': Page(Each('.//li', Record({
+            'link': _book_link,
+            'book_cover': Attr('(.//img)[1]', 'data-original'),
+            'book_author': Text(f"(.//div[{has_class('nicheng')}])[1]"),
+            'book_favo': Text(f"(.//div[{has_class('shoucang')}])[1]"),
+            'book_popalrity': Text(f"(.//div[{has_class('renqi')}])[1]"),
+        }), scope=f"(//div[{has_class('piclist')}])[1]"), post_rank),
+        # 搜索结果页面, 参数: 页数
+        'search': Page(Record({
+            # 没有分页时为0
+            'pages': Text(f"((//div[{has_class('pageInfo')}])[1]//em)[last() - 2]", int, default=0),
+            # 最后一个li是分页, 网页中还有<li class='clear'>..</li>的标签, 都需要过滤掉
+            'books': Each('(.//li)[position() < last()][not(@class)]', Record({
+                'link': _book_link,
+                'book_cover': Attr(f"(.//img[{has_class('img1')}])[1]", 'data-original'),
+                'book_author': Text(f"(.//dd[{has_class('nickname')}])[1]"),
+                'book_favo': Text(f"(.//dd[{has_class('favo')}])[1]"),
+                'book_popalrity': Text(f"(.//dd[{has_class('hit')}])[1]"),
+            }), scope=f"(//div[{has_class('BooklibraryList')}])[1]"),
+        }), post_search),
+        # 书籍详情页面
+        'book': Page(Record({
+            'title': Group(f"(//div[{has_class('title')}])[1]", {
+                'book_title': Text('(.//span)[1]'),
+                'book_author': Text('(.//em)[1]'),
+            }),
+            'book_label': Each('.//li', Text(), scope=f"(//div[{has_class('label')}])[1]"),
+            'font': Group(f"(//div[{has_class('Font')}])[1]", {
+                'book_fonts': Text('(.//span)[1]'),
+                'book_click': Text('(.//span)[2]'),
+                'book_favo': Text('(.//span)[3]'),
+            }),
+            'book_reward': Record({
+                'book_monTicket': Text('(.//li)[1]'),
+                'book_reTicket': Text('(.//li)[2]'),
+                'book_money': Text('(.//li)[3]'),
+                'book_fuck': Text('(.//li)[4]'),
+            }, scope=f"(//ul[{has_class('Reward')}])[1]"),
+            'book_cover': Attr(f"((//div[{has_class('pic')}])[1]//img)[1]", 'data-original'),
+            'book_disc': Html(f"(//div[{has_class('synopsisCon')}])[1]"),
+            # 书籍卷名与每卷包含的章节列表
+            'book_volume_list': Zip({
+                'volume_name': Each(f"//div[{has_class('volume_name')}]", Text()),
+                'chapter_list': Each(f"//div[{has_class('chapter_list')}]", Each('.//li', Record({
+                    'link': Group('(.//a)[1]', {
+                        'chapter_title': Text(),
+                        'chapter_id': Attr(None, 'href', last_part),
+                    }),
+                    'is_lock': Value(chapter_status),
+                }))),
+            }),
+        }), post_book),
+        # 章节阅读页面, 返回上下章按钮与post数据
+        'post_data': Page(Record({
+            # 上一章
+            'prev_btn': Attr('(.//a)[1]', 'href', btn_id),
+            # 下一章
+            'next_btn': Attr('(.//a)[last()]', 'href', btn_id),
+        }, scope=f"(//div[{has_class('chapterBtn')}])[1]"), post_chapter),
+    },
+)
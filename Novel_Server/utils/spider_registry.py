@@ -0,0 +1,113 @@
+#!/user/bin/env python
+# 每天都要有好心情
+# 爬虫实例与登录会话管理模块
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+
+from Novel_Server.utils.spiders_setting import SPIDER_SESSION_TIMEOUT
+
+
+class SpiderRegistry(object):
+    """
+    按书架id保存爬虫实例
+    实例数量超过max_size, 或者空闲时间超过idle_timeout时, 最久未使用的实例会被淘汰并关闭会话
+    """
+
+    def __init__(self, max_size, idle_timeout):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        # 按最近使用时间排序, 最久未使用的在最前面, {书架id: [爬虫, 最近使用时间]}
+        self._items = OrderedDict()
+
+    def get_or_create(self, key, factory):
+        """
+        获取爬虫实例, 不存在时使用factory创建
+        :param key: 书架id
+        :param factory: 无参数的函数, 返回新的爬虫实例
+        :return: 爬虫实例
+        """
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                item = self._items[key] = [factory(), now]
+            else:
+                item[1] = now
+                self._items.move_to_end(key)
+            while self._items:
+                _, (spider, last_used) = next(iter(self._items.items()))
+                if len(self._items) <= self.max_size and now - last_used <= self.idle_timeout:
+                    break
+                self._items.popitem(last=False)
+                evicted.append(spider)
+        # 在锁外关闭会话, 避免阻塞其他线程
+        for spider in evicted:
+            spider.close()
+        return item[0]
+
+    def pop(self, key):
+        with self._lock:
+            item = self._items.pop(key, None)
+        if item:
+            item[0].close()
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+
+class SessionStore(object):
+    """
+    已验证登录的会话存储, 保存登录状态与cookie
+    存放在同一台机器的所有进程共享的缓存中(settings.CACHES['spider_sessions']),
+    新启动的进程可以直接使用, 不需要再请求原网站验证登录
+    """
+
+    def __init__(self, alias='spider_sessions', timeout=SPIDER_SESSION_TIMEOUT):
+        self.alias = alias
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def make_key(site, shelf):
+        return f'spider_session:{site}:{shelf.id}'
+
+    @staticmethod
+    def get_digest(shelf):
+        """
+        账号密码的摘要, 修改账号密码后保存的会话自动失效
+        """
+        return hashlib.sha256(f'{shelf.account}\n{shelf.password}'.encode('utf-8')).hexdigest()
+
+    def get(self, site, shelf):
+        """
+        获取保存的会话cookie
+        :param site: 网站
+        :param shelf: 书架
+        :return: cookie的dict, 没有或已失效时返回None
+        """
+        data = self.cache.get(self.make_key(site, shelf))
+        if not data or data['digest'] != self.get_digest(shelf):
+            return None
+        return data['cookies']
+
+    def set(self, site, shelf, cookies):
+        self.cache.set(self.make_key(site, shelf), {
+            'digest': self.get_digest(shelf),
+            'cookies': dict(cookies),
+            'verified_at': time.time(),
+        }, self.timeout)
+
+    def delete(self, site, shelf):
+        self.cache.delete(self.make_key(site, shelf))
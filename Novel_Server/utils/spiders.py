@@ -2,14 +2,25 @@
 # 每天都要有好心情
 # 信息获取模块
 import base64
-import re
 import threading
+import time
 import requests
 import urllib3
-from bs4 import BeautifulSoup
 from abc import ABCMeta, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import caches
 
 from Novel_Server.utils.spiders_setting import *
+from Novel_Server.utils.sites import get_site
+from Novel_Server.utils.chapter_store import ChapterStore
+from Novel_Server.utils.paragraphs import PackedChapter
+from Novel_Server.utils.search_index import search_index
+from Novel_Server.utils.page_cache import PageCache
+from Novel_Server.utils.spider_registry import SpiderRegistry, SessionStore
+from Novel_Server.utils.background import run_in_background
+from Novel_Server.utils.throttle import SingleFlight, get_rate_limiter
+from Novel_Server.utils import metrics, transport
 
 
 class Spider(metaclass=ABCMeta):
@@ -32,9 +43,10 @@ class Spider(metaclass=ABCMeta):
         pass
 
     @abstractmethod
-    def get_wallet(self):
+    def get_wallet(self, fresh=False):
         """
         获取钱包信息
+        :param fresh: 为True时不使用缓存
         :return: 钱包信息
         """
         pass
@@ -121,36 +133,131 @@ class Spider(metaclass=ABCMeta):
 
 
 class Spider_YouDu(Spider):
-    _instance_lock = threading.Lock()
-    _instance = {}
+    # 按书架id保存的爬虫实例, 数量与空闲时间有上限
+    _instance = SpiderRegistry(SPIDER_REGISTRY_MAX_SIZE, SPIDER_REGISTRY_IDLE_TIMEOUT)
+    # 同一台机器上所有进程共享的登录会话
+    session_store = SessionStore()
+    # 网站地址, 与Shelf.web_url对应
+    site = 'https://www.youdubook.com/'
+    # 所有书架共用的章节存储
+    chapter_store = ChapterStore(site)
+    # 所有用户共用的页面数据缓存
+    page_cache = PageCache()
+    # 进程内同时进行的相同请求只请求一次原网站
+    flights = SingleFlight()
+    # 进程内所有书架共用的限速
+    rate_limiter = get_rate_limiter(site)
 
     def __new__(cls, shelf):
-        if shelf.id not in cls._instance:
-            with cls._instance_lock:
-                if shelf.id not in cls._instance:
-                    cls._instance[shelf.id] = super(Spider_YouDu, cls).__new__(cls)
-                    # 用于发送请求的会话
-                    cls._instance[shelf.id].session = None
-                    # 书架
-                    cls._instance[shelf.id].shelf = shelf
-                    # 登录状态
-                    cls._instance[shelf.id].is_login = False
-        return cls._instance[shelf.id]
+        spider = cls._instance.get_or_create(shelf.id, lambda: cls.create(shelf))
+        spider.update_shelf(shelf)
+        return spider
+
+    @classmethod
+    def create(cls, shelf):
+        spider = super(Spider_YouDu, cls).__new__(cls)
+        # 用于发送请求的会话
+        spider.session = None
+        # 书架
+        spider.shelf = shelf
+        # 登录状态
+        spider.is_login = False
+        # 章节的解锁状态, 来自get_book, {章节id: is_lock}
+        spider.chapter_lock = {}
+        # 预读的章节, {章节id: (过期时间, 章节数据)}
+        spider.prefetched = {}
+        spider.prefetch_lock = threading.Lock()
+        # 同一个书架的多个线程同时发现未登录时, 只有一个线程进行登录
+        spider.login_lock = threading.Lock()
+        return spider
+
+    @classmethod
+    def get_spec(cls):
+        """
+        网站配置, 第一次使用时加载网站模块
+        :return: SiteSpec
+        """
+        return get_site(cls.site)
+
+    def url(self, name, *args):
+        return self.get_spec().url(name, *args)
+
+    def update_shelf(self, shelf):
+        """
+        使用最新的书架对象, 账号或密码修改后需要重新登录
+        :param shelf: 书架
+        :return:
+        """
+        if (shelf.account, shelf.password) != (self.shelf.account, self.shelf.password):
+            self.is_login = False
+        self.shelf = shelf
+
+    def close(self):
+        """
+        关闭会话, 爬虫实例被淘汰时调用
+        :return:
+        """
+        if self.session is not None:
+            self.session.close()
+        self.is_login = False
+
+    def make_headers(self):
+        """
+        该书架的请求头, 复制YOUDU_HEADERS模板并填入账号密码
+        :return: 新的请求头dict
+        """
+        headers = dict(YOUDU_HEADERS)
+        headers['cookie'] = YOUDU_HEADERS['cookie'].format(self.shelf.account, self.shelf.password)
+        return headers
 
     def login(self):
         """
         有毒小说网只通过cookie来验证用户登录,所以只需要设置cookie即可
+        其他进程已经验证过的会话会直接使用, 不再请求原网站
         :return:
         """
-        urllib3.disable_warnings()
-        self.session = requests.session()
-        # 设置cookies直接模拟登录
-        headers = YOUDU_HEADERS
-        headers['cookie'] = headers['cookie'].format(self.shelf.account, self.shelf.password)
-        self.session.headers = headers
-        # 取消SSL认证
-        self.session.verify = False
-        self.check_login()
+        with self.login_lock:
+            # 等待锁的过程中其他线程已经登录
+            if self.is_login:
+                return
+            urllib3.disable_warnings()
+            old_session = self.session
+            # 每个书架的会话只保存cookie与请求头, 连接池所有书架共用
+            self.session = transport.mount(requests.session())
+            # 设置cookies直接模拟登录
+            self.session.headers = self.make_headers()
+            # 取消SSL认证
+            self.session.verify = False
+            # 其他线程可能还在使用旧的会话发送请求, 关闭会话不会关闭共享的连接池
+            if old_session is not None:
+                old_session.close()
+            cookies = self.session_store.get(self.site, self.shelf)
+            if cookies is not None:
+                self.session.cookies.update(cookies)
+                self.is_login = True
+                return
+            self.check_login()
+            self.session_store.set(self.site, self.shelf, self.session.cookies)
+
+    def _request(self, method, url, **kwargs):
+        """
+        发送请求, 所有发往原网站的请求都经过这里, 按网站限速, 没有指定超时时间时使用SPIDER_TIMEOUT
+        :param method: 请求方法
+        :param url: 网址
+        :return: 响应
+        """
+        if self.rate_limiter is not None:
+            with metrics.phase('throttle'):
+                self.rate_limiter.acquire()
+        kwargs.setdefault('timeout', SPIDER_TIMEOUT)
+        with metrics.phase('upstream'):
+            try:
+                resp = self.session.request(method, url, **kwargs)
+            except requests.RequestException:
+                metrics.record_upstream(self.site, 'error', 0)
+                raise
+        metrics.record_upstream(self.site, resp.status_code, len(resp.content))
+        return resp
 
     def check_login(self):
         """
@@ -158,8 +265,9 @@ class Spider_YouDu(Spider):
         否则会重定向到登录页面,所以只需要判断响应的url是否与个人中心网址相等即可
         :return:
         """
-        resp = self.session.get(YOUDU_SHELF_URL)
-        if resp.url == YOUDU_SHELF_URL:
+        shelf_url = self.url('shelf')
+        resp = self._request('GET', shelf_url)
+        if resp.url == shelf_url:
             self.is_login = True
         else:
             raise ValueError('无法登录有毒小说网!')
@@ -169,38 +277,49 @@ class Spider_YouDu(Spider):
         获取该账号的书架收藏书籍
         :return:
         """
-        resp = self.session.get(YOUDU_SHELF_URL)
-        soup = BeautifulSoup(resp.text, 'lxml')
-        book_list = soup.find('div', class_='favoList').findAll('li')
-        books = {}
-
-        for book in book_list:
-            title = book.find('a')['title']
-            last_chapter = book.find('div', class_='updateChapter').find('a')
-            books[title] = {
-                'id': book.find('a')['href'].split('/')[-1],
-                'title': title,
-                'cover': book.find('img')['data-original'],
-                'last_chapter': last_chapter.get_text().strip(),
-                'last_chapter_id': last_chapter['href'].split('/')[-1]
-            }
-        return books
-
-    def get_wallet(self):
+        resp = self._request('GET', self.url('shelf'))
+        return self.parse_shelf(resp.text)
+
+    @classmethod
+    @metrics.timed('parse')
+    def parse_shelf(cls, html):
+        """
+        解析书架页面
+        :param html: 书架页面
+        :return: 书架中的书籍
+        """
+        return cls.get_spec().extract('shelf', html)
+
+    def get_wallet(self, fresh=False):
         """
         获取有毒小说网登录用户的钱包信息
+        按账号短暂缓存, 由后台任务预先获取, 订阅章节后清除
+        :param fresh: 为True时请求原网站并更新缓存
         :return: 用户的钱包信息
         """
-        resp = self.session.get(YOUDU_WALLET_URL)
-        soup = BeautifulSoup(resp.text, 'lxml')
-        my_wallet = soup.find('div', class_='Top').findAll('li')
+        key = self.get_wallet_key()
+
+        def fetch():
+            resp = self._request('GET', self.url('wallet'))
+            return self.parse_wallet(resp.text)
+        if fresh:
+            data = fetch()
+            self.page_cache.set('wallet', key, data)
+            return data
+        return self.page_cache.get_or_fetch('wallet', key, fetch)
 
-        my_wallet_data = dict()
-        my_wallet_data['re_ticket'] = my_wallet[0].find('em').get_text()
-        my_wallet_data['mon_ticket'] = my_wallet[1].find('em').get_text()
-        my_wallet_data['san'] = my_wallet[2].find('em').get_text()
-        my_wallet_data['temp_san'] = my_wallet[3].find('em').get_text()
-        return my_wallet_data
+    def get_wallet_key(self):
+        return self.page_cache.make_key('wallet', self.site, self.shelf.account)
+
+    @classmethod
+    @metrics.timed('parse')
+    def parse_wallet(cls, html):
+        """
+        解析钱包页面
+        :param html: 钱包页面
+        :return: 钱包信息
+        """
+        return cls.get_spec().extract('wallet', html)
 
     def get_rank(self, rank_type, data_type, page):
         """
@@ -211,28 +330,38 @@ class Spider_YouDu(Spider):
         :param page: 页数
         :return:
         """
+        url, page = self.get_rank_url(rank_type, data_type, page)
+        key = self.page_cache.make_key('rank', self.site, url)
+
+        def fetch():
+            resp = self._request('GET', url)
+            data = self.parse_rank(resp.text, page)
+            search_index.add_books(self.site, data['books'])
+            return data
+        # 排行榜与用户无关, 所有用户共用缓存
+        return self.flights.do(key, lambda: self.page_cache.get_or_fetch('rank', key, fetch))
+
+    @classmethod
+    def get_rank_url(cls, rank_type, data_type, page):
+        """
+        填充排行榜参数的默认值
+        :return: 排行榜网址, 页数
+        """
         rank_type = rank_type if rank_type else 'Favo'
         data_type = data_type if data_type else 'Week'
         page = page if page else 1
-        url = YOUDU_RANK_URL.format(rank_type, data_type, page)
-        resp = self.session.get(url)
-        soup = BeautifulSoup(resp.text, 'lxml')
-        book_list = soup.find('div', class_='piclist').findAll('li')
-        data = {
-            'total': len(book_list),
-            'page': page,
-            'books': []
-        }
-        for book in book_list:
-            data['books'].append({
-                'book_id': book.find('a')['href'].split('/')[-1],
-                'book_title': book.find('a')['title'],
-                'book_cover': book.find('img')['data-original'],
-                'book_author': book.find('div', class_='nicheng').get_text().strip(),
-                'book_favo': book.find('div', class_='shoucang').get_text().strip(),
-                'book_popalrity': book.find('div', class_='renqi').get_text().strip()
-            })
-        return data
+        return cls.get_spec().url('rank', rank_type, data_type, page), page
+
+    @classmethod
+    @metrics.timed('parse')
+    def parse_rank(cls, html, page):
+        """
+        解析排行榜页面
+        :param html: 排行榜页面
+        :param page: 页数
+        :return: 排行榜数据
+        """
+        return cls.get_spec().extract('rank', html, page)
 
     def search_book(self, keyword, page=1):
         """
@@ -241,32 +370,28 @@ class Spider_YouDu(Spider):
         :param page: 页数
         :return:
         """
-        url = YOUDU_SEARCH_URL.format(keyword, page)
-        resp = self.session.get(url)
-        soup = BeautifulSoup(resp.text, 'lxml')
-        book_list = soup.find('div', class_='BooklibraryList').findAll('li')[:-1]
-        book_page = soup.find('div', class_='pageInfo').findAll('em')
-        pages = int(book_page[-3].get_text()) if book_page else 0
-        data = {
-            'pages': pages,
-            'page': page,
-            'total': 0,
-            'books': []
-        }
-        for book in book_list:
-            # 因为网页中有<li class='clear'>..</li>的标签,所以需要过滤掉这部分
-            if 'class' in book.attrs:
-                continue
-            data['books'].append({
-                'book_id': book.find('a')['href'].split('/')[-1],
-                'book_title': book.find('a')['title'],
-                'book_cover': book.find('img', class_='img1')['data-original'],
-                'book_author': book.find('dd', class_='nickname').get_text().strip(),
-                'book_favo': book.find('dd', class_='favo').get_text().strip(),
-                'book_popalrity': book.find('dd', class_='hit').get_text().strip()
-            })
-        data['total'] = len(data['books'])
-        return data
+        url = self.url('search', keyword, page)
+        key = self.page_cache.make_key('search', self.site, keyword, page)
+
+        def fetch():
+            resp = self._request('GET', url)
+            data = self.parse_search(resp.text, page)
+            # 搜索到的书籍加入本地搜索索引
+            search_index.add_books(self.site, data['books'])
+            return data
+        # 搜索结果与用户无关, 所有用户共用缓存
+        return self.flights.do(key, lambda: self.page_cache.get_or_fetch('search', key, fetch))
+
+    @classmethod
+    @metrics.timed('parse')
+    def parse_search(cls, html, page):
+        """
+        解析搜索结果页面
+        :param html: 搜索结果页面
+        :param page: 页数
+        :return: 搜索结果
+        """
+        return cls.get_spec().extract('search', html, page)
 
     def get_book(self, book_id):
         """
@@ -275,64 +400,26 @@ class Spider_YouDu(Spider):
         :param book_id: 书籍的id
         :return: 书籍信息的dict
         """
-        url = YOUDU_BOOK_URL.format(book_id)
-        resp = self.session.get(url)
-        soup = BeautifulSoup(resp.text, 'lxml')
-
-        title_author = soup.find('div', class_='title')
-        book_labels = soup.find('div', class_='label').findAll('li')
-        book_fonts = soup.find('div', class_='Font').findAll('span')
-        book_Reward = soup.find('ul', class_='Reward').findAll('li')
-        book_data = {
-            'book_title': title_author.find('span').get_text().strip(),
-            'book_author': title_author.find('em').get_text().strip(),
-            'book_label': [label.get_text().strip() for label in book_labels],
-            'book_fonts': book_fonts[0].get_text().strip(),
-            'book_click': book_fonts[1].get_text().strip(),
-            'book_favo': book_fonts[2].get_text().strip(),
-            'book_reward': {
-                'book_monTicket': book_Reward[0].get_text().strip(),
-                'book_reTicket': book_Reward[1].get_text().strip(),
-                'book_money': book_Reward[2].get_text().strip(),
-                'book_fuck': book_Reward[3].get_text().strip()
-            },
-            'book_cover': soup.find('div', class_='pic').find('img')['data-original'],
-            'book_disc': soup.find('div', class_='synopsisCon').prettify(),
-            'book_volume_list': [],
-            'chapter_lock': {},
-        }
-        # 书籍卷名
-        book_volume_list = soup.findAll('div', class_='volume_name')
-        book_chapter_list = soup.findAll('div', class_='chapter_list')
-        for volume in book_volume_list:
-            book_data['book_volume_list'].append({
-                'volume_name': volume.get_text().strip(),
-                'chapter_list': []
-            })
-        # 每卷包含的章节列表
-        for idx, volume in enumerate(book_data['book_volume_list']):
-            chapter_list = book_chapter_list[idx].findAll('li')
-            for chapter in chapter_list:
-                status = chapter.attrs.get('class', None)
-                if status:
-                    # 未解锁
-                    if status[0] == 'lock_fill':
-                        is_lock = 1
-                    # 已解锁
-                    else:
-                        is_lock = 0
-                # 免费章节
-                else:
-                    is_lock = -1
-                chapter_id = chapter.find('a')['href'].split('/')[-1]
-                volume['chapter_list'].append({
-                    'chapter_title': chapter.find('a').get_text().strip(),
-                    'chapter_id': chapter_id,
-                    'is_lock': is_lock
-                })
-                book_data['chapter_lock'][chapter_id] = is_lock
+        url = self.url('book', book_id)
+
+        def fetch():
+            resp = self._request('GET', url)
+            return self.parse_book(resp.text)
+        # 书籍详情中包含账号的解锁状态, 只合并同一个书架的请求
+        book_data = self.flights.do(f'book:{self.site}:{self.shelf.id}:{book_id}', fetch)
+        self.chapter_lock.update(book_data['chapter_lock'])
         return book_data
 
+    @classmethod
+    @metrics.timed('parse')
+    def parse_book(cls, html):
+        """
+        解析书籍详情页面
+        :param html: 书籍详情页面
+        :return: 书籍信息的dict
+        """
+        return cls.get_spec().extract('book', html)
+
     def favo_book(self, book_id):
         """
         当书籍未收藏时,发送该请求会收藏书籍
@@ -343,7 +430,7 @@ class Spider_YouDu(Spider):
         data = {
             'BookID': book_id
         }
-        resp = self.session.post(YOUDU_ADD_BOOK_URL, data)
+        resp = self._request('POST', self.url('add_book'), data=data)
         return resp.json()
 
     def buy_chapter(self, book_id, chapter_id):
@@ -361,8 +448,22 @@ class Spider_YouDu(Spider):
             'isMethod': 1,
             'isAuto': 0
         }
-        resp = self.session.post(YOUDU_BUY_CHAPTER_URL, data=data)
-        return resp.json()
+        resp = self._request('POST', self.url('buy_chapter'), data=data)
+        # 订阅后余额变化
+        self.page_cache.delete(self.get_wallet_key())
+        data = resp.json()
+        self.mark_bought(chapter_id, data)
+        return data
+
+    def mark_bought(self, chapter_id, data):
+        """
+        订阅成功(原网站返回的code为1)后该书架可以阅读这一章, 之后从章节存储读取
+        :param chapter_id: 章节id
+        :param data: 原网站返回的数据
+        :return:
+        """
+        if isinstance(data, dict) and data.get('code') == 1:
+            self.chapter_lock[str(chapter_id)] = 0
 
     def get_post_data(self, url):
         """
@@ -370,24 +471,21 @@ class Spider_YouDu(Spider):
         :param url: 章节阅读页面
         :return: post数据
         """
-        resp = self.session.get(url)
-        soup = BeautifulSoup(resp.text, 'lxml')
-        btn_list = soup.find('div', class_='chapterBtn').findAll('a')
-        # 上一章
-        prev_btn = btn_list[0]['href'].split('/')[-1] if btn_list[0]['href'] != "javascript:void(0);" else None
-        # 下一章
-        next_btn = btn_list[-1]['href'].split('/')[-1] if btn_list[-1]['href'] != "javascript:void(0);" else None
-        btns = {
-            'prev_btn': prev_btn,
-            'next_btn': next_btn
-        }
-        data = {
-            'sign': 'a3NvcnQoJHBhcmEpOw==',
-            'caonima': re.findall(r'MemberSingleChapter.+?;', resp.text)[-1].split('"')[-2]
-        }
-        return btns, data
+        resp = self._request('GET', url)
+        return self.parse_post_data(resp.text)
+
+    @classmethod
+    @metrics.timed('parse')
+    def parse_post_data(cls, html):
+        """
+        解析章节阅读页面中的上下章按钮与caonima字符串
+        :param html: 章节阅读页面
+        :return: 上下章按钮, post数据
+        """
+        return cls.get_spec().extract('post_data', html)
 
     @staticmethod
+    @metrics.timed('parse')
     def parse_chapter_data(resp):
         """
         根据传入的章节json数据,对章节内容进行base64解码.
@@ -411,43 +509,204 @@ class Spider_YouDu(Spider):
             })
         return data
 
-    def get_chapter(self, chapter_id):
+    def can_read(self, chapter_id):
+        """
+        判断该书架是否可以阅读对应章节, 只有免费章节和已解锁章节可以阅读
+        解锁状态未知时(还没有获取过书籍详情)返回False, 接口中先通过ChapterLock.load_spider读取保存的解锁状态
+        :param chapter_id: 章节id
+        :return:
+        """
+        return self.chapter_lock.get(str(chapter_id)) in (-1, 0)
+
+    def get_chapter(self, chapter_id, read_ahead=0, start=None, end=None):
         """
         获取对应章节的章节数据
+        优先使用预读的章节, 其次是章节存储, 都没有时才请求原网站
         :param chapter_id: 章节id
+        :param read_ahead: 预读的章节数, 返回后在后台获取之后的read_ahead章
+        :param start: 只返回paragraph_index从start开始的段落
+        :param end: 只返回paragraph_index到end为止的段落
         :return: 章节数据
         """
+        return self.get_packed_chapter(chapter_id, read_ahead).to_data(start, end)
+
+    def get_packed_chapter(self, chapter_id, read_ahead=0):
+        """
+        与get_chapter相同, 返回紧凑格式的章节, 可以先判断章节是否变化(PackedChapter.digest)再转换
+        :return: PackedChapter
+        """
+        chapter_id = str(chapter_id)
+        data = self.get_prefetched(chapter_id)
+        if data is None:
+            data = self.load_chapter(chapter_id)
+        next_btn = data.btns.get('next_btn')
+        if read_ahead > 0 and next_btn:
+            run_in_background(f'prefetch:{self.site}:{self.shelf.id}', self.prefetch, next_btn, read_ahead)
+        return data
+
+    def load_chapter(self, chapter_id):
+        """
+        从章节存储或原网站获取章节数据
+        该书架可以阅读的章节会先从章节存储中读取, 命中时不需要请求原网站
+        :param chapter_id: 章节id
+        :return: PackedChapter
+        """
+        can_read = self.can_read(chapter_id)
+        if can_read:
+            data = self.chapter_store.get(chapter_id)
+            if data:
+                return data
+            # 可以阅读的章节内容对所有书架相同, 合并所有书架的请求
+            key = f'chapter:{self.site}:{chapter_id}'
+        else:
+            key = f'chapter:{self.site}:{chapter_id}:{self.shelf.id}'
+        return self.flights.do(key, lambda: self.fetch_chapter(chapter_id, can_read))
+
+    def fetch_chapter(self, chapter_id, can_read):
+        """
+        从原网站获取章节数据
+        :param chapter_id: 章节id
+        :param can_read: 该书架是否可以阅读该章节, 可以阅读时保存到章节存储
+        :return: PackedChapter
+        """
         # 获取发送请求必要的数据的地址
-        post_data_url = YOUDU_READ_CHAPTER_URL.format(chapter_id)
+        post_data_url = self.url('read_chapter', chapter_id)
         # 发送请求的地址
-        json_url = YOUDU_CHAPTER_JSON_URL.format(chapter_id)
+        json_url = self.url('chapter_json', chapter_id)
         # 发送post请求需要的数据
         post_data = self.get_post_data(post_data_url)
-        # 加上referer来反 反爬
-        self.session.headers.update({
-            'referer': post_data_url
-        })
-        resp = self.session.post(json_url, data=post_data[1])
+        # 加上referer来反 反爬, 只加在这次请求上, 避免影响同时进行的预读
+        resp = self._request('POST', json_url, data=post_data[1], headers={'referer': post_data_url})
         # 进行数据解密
         data = self.parse_chapter_data(resp.json()['data'])
         data['btns'] = post_data[0]
+        data = PackedChapter.pack(data)
+        # 只保存确认有阅读权限的章节, 避免把未订阅时返回的内容共享给其他书架
+        if can_read and data.has_content():
+            self.chapter_store.set(chapter_id, data)
         return data
 
+    def get_prefetched(self, chapter_id):
+        """
+        获取预读的章节, 已过期的返回None
+        """
+        with self.prefetch_lock:
+            item = self.prefetched.get(chapter_id)
+        if item and item[0] > time.monotonic():
+            return item[1]
+        return None
+
+    def prefetch(self, chapter_id, count):
+        """
+        在后台预读从chapter_id开始的count个章节, 保存到该书架的预读缓冲区
+        遇到没有内容(未订阅)的章节或最后一章时停止
+        :param chapter_id: 第一个要预读的章节id
+        :param count: 预读的章节数
+        :return:
+        """
+        for _ in range(min(count, CHAPTER_READ_AHEAD_MAX)):
+            data = self.get_prefetched(chapter_id) or self.load_chapter(chapter_id)
+            if not data.has_content():
+                break
+            self.put_prefetched(chapter_id, data)
+            chapter_id = data.btns.get('next_btn')
+            if not chapter_id:
+                break
+
+    def put_prefetched(self, chapter_id, data):
+        """
+        保存预读的章节, 同时清理已过期的章节
+        """
+        now = time.monotonic()
+        with self.prefetch_lock:
+            for key in [key for key, item in self.prefetched.items() if item[0] <= now]:
+                del self.prefetched[key]
+            self.prefetched[chapter_id] = (now + CHAPTER_PREFETCH_TIMEOUT, data)
+
+    @property
+    def line_comments(self):
+        return caches['line_comments']
+
+    def make_line_comment_key(self, chapter_id, index):
+        return f'line_comment:{self.site}:{chapter_id}:{index}'
+
+    def get_cached_line_comment(self, chapter_id, count, index):
+        """
+        从缓存获取间贴数据, 缓存时获取的数量不少于count, 或者已经是全部间贴时可以使用
+        :return: 间贴的Json数据, 没有时返回None
+        """
+        cached = self.line_comments.get(self.make_line_comment_key(chapter_id, index))
+        if cached is None:
+            return None
+        cached_count, resp = cached
+        if cached_count >= count or len(resp['data']) < cached_count:
+            return dict(resp, data=resp['data'][:count])
+        return None
+
     def get_line_comment(self, chapter_id, count, index):
         """
-        获取间贴数据
+        获取间贴数据, 间贴与用户无关, 短时间内所有书架共用缓存
         :param chapter_id: 章节信息
         :param count: 要获取的数量
         :param index: 行所在的索引
         :return:
         """
+        count = int(count)
         data = {
             'page': 1,
             'count': count,
             'chapter_id': chapter_id,
             'paragraph_index': index
         }
-        resp = self.session.post(YOUDU_LINE_COMMENT_URL, data=data).json()['data']
+        resp = self.get_cached_line_comment(chapter_id, count, index)
+        if resp is None:
+            key = self.make_line_comment_key(chapter_id, index)
+
+            def fetch():
+                return self._request('POST', self.url('line_comment'), data=data).json()['data']
+            resp = self.flights.do(f'{key}:{count}', fetch)
+            self.line_comments.set(key, (count, resp), LINE_COMMENT_CACHE_TIMEOUT)
+        return self.parse_line_comment(data, resp)
+
+    def get_line_comments(self, chapter_id, indexes, count=10):
+        """
+        批量获取一个章节多个段落的间贴
+        已知间贴数为0的段落(章节在预读缓冲区或章节存储中)不请求原网站, 其他段落并发获取
+        :param chapter_id: 章节id
+        :param indexes: 段落索引(paragraph_index)列表
+        :param count: 每段要获取的数量
+        :return: {段落索引: 间贴数据}
+        """
+        chapter_id = str(chapter_id)
+        count = int(count)
+        chapter = self.get_prefetched(chapter_id)
+        if chapter is None and self.can_read(chapter_id):
+            chapter = self.chapter_store.get(chapter_id)
+        result = {}
+        missing = []
+        for index in indexes:
+            if chapter is not None and chapter.tsukkomi_count(index) == 0:
+                result[index] = self.parse_line_comment(
+                    {'page': 1, 'count': count, 'chapter_id': chapter_id, 'paragraph_index': index}, {'data': []})
+            else:
+                missing.append(index)
+        if len(missing) == 1:
+            result[missing[0]] = self.get_line_comment(chapter_id, count, missing[0])
+        elif missing:
+            with ThreadPoolExecutor(max_workers=min(len(missing), LINE_COMMENT_MAX_WORKERS)) as executor:
+                for index, data in zip(missing, executor.map(
+                        metrics.bind_context(lambda i: self.get_line_comment(chapter_id, count, i)), missing)):
+                    result[index] = data
+        return result
+
+    @staticmethod
+    def parse_line_comment(data, resp):
+        """
+        整理间贴数据
+        :param data: 请求间贴时发送的数据
+        :param resp: 间贴的Json数据
+        :return: 间贴数据
+        """
         data['comments'] = []
         data['count'] = len(resp['data'])
         for comment in resp['data']:
@@ -476,5 +735,7 @@ class Spider_YouDu(Spider):
             'chapter_content': line_content,
             'tsukkomi_content': comment
         }
-        resp = self.session.post(url=YOUDU_LINE_COMMENT_SEND_URL, data=data)
+        resp = self._request('POST', self.url('line_comment_send'), data=data)
+        # 发送后该段落缓存的间贴已经过时
+        self.line_comments.delete(self.make_line_comment_key(chapter_id, index))
         return resp.json()
@@ -4,38 +4,119 @@
 爬虫工具的配置
 各网站接口设置
 """
+import os
+from types import MappingProxyType
 
-# 网站对应的爬虫类
-SPIDERS = {
-    'https://www.youdubook.com/': 'Spider_YouDu'
+# 网站对应的网站配置模块(见 Novel_Server/utils/sites), 模块中声明了网站的爬虫类, 请求地址与页面结构
+SITES = {
+    'https://www.youdubook.com/': 'Novel_Server.utils.sites.youdu'
 }
 
-# 有毒小说网请求头
-YOUDU_HEADERS = {
+# 网站的请求速度限制, (每秒请求数, 最多连续请求数), 同一进程中所有书架共用, 不在其中的网站不限速
+SPIDER_RATE_LIMITS = {
+    'https://www.youdubook.com/': (5, 10),
+}
+
+# 同步爬虫共享连接池的设置, 所有书架的会话共用: 保存连接池的网站数, 每个网站的最大连接数,
+# 连接用完时是否等待空闲连接, 最长等待时间(秒)
+SPIDER_POOL_CONNECTIONS = 10
+SPIDER_POOL_MAXSIZE = 20
+SPIDER_POOL_BLOCK = True
+SPIDER_POOL_TIMEOUT = 10
+
+# 异步爬虫请求的超时时间(秒)
+ASYNC_SPIDER_TIMEOUT = 15
+# 异步爬虫每个书架会话的最大连接数
+ASYNC_SPIDER_MAX_CONNECTIONS = 10
+
+# 每个进程最多保存的爬虫实例数, 超出时淘汰最久未使用的实例
+SPIDER_REGISTRY_MAX_SIZE = 500
+# 爬虫实例的最长空闲时间(秒), 超过后会被淘汰
+SPIDER_REGISTRY_IDLE_TIMEOUT = 60 * 30
+# 已验证登录的会话在共享存储中的保存时间(秒), 有效期内新进程可以直接使用
+SPIDER_SESSION_TIMEOUT = 60 * 60 * 6
+
+# 与用户无关的页面数据在共享缓存中的保存时间(秒)
+# wallet按账号缓存, 由后台任务(shelf.wallet)预先获取, 订阅章节后清除
+PAGE_CACHE_TIMEOUTS = {
+    'rank': 60 * 10,
+    'search': 60 * 5,
+    'wallet': 60,
+}
+# 缓存未命中时只有一个进程请求原网站, 其他进程最多等待的时间(秒)
+PAGE_CACHE_LOCK_TIMEOUT = 15
+
+# 书籍详情与目录的刷新间隔(秒), 超过后在后台从原网站更新
+BOOK_REFRESH_INTERVAL = 60 * 10
+
+# 书架快照的刷新间隔(秒), 超过后获取书架时在后台更新
+SHELF_REFRESH_INTERVAL = 60 * 5
+
+# 后台任务队列(crawl_worker)中每个网站同时执行的任务数, 不在其中的网站使用 JOB_DEFAULT_CONCURRENCY
+JOB_SITE_CONCURRENCY = {
+    'https://www.youdubook.com/': 2,
+}
+JOB_DEFAULT_CONCURRENCY = 1
+# 任务失败后的最多执行次数, 重试间隔(秒)按次数翻倍
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_DELAY = 30
+# 执行中的任务超过该时间(秒)没有完成时, 认为worker已经退出, 重新放回队列
+JOB_LOCK_TIMEOUT = 60 * 10
+# 队列为空时worker的轮询间隔(秒)
+JOB_POLL_INTERVAL = 1
+# 书籍刷新后新解锁的章节在后台预先保存到章节存储(chapter.warm任务), 每次最多预先获取的章节数
+JOB_CHAPTER_WARM_LIMIT = 20
+
+# 后台任务(章节预读等)使用的线程数
+BACKGROUND_WORKERS = 8
+# 获取章节时最多预读的章节数
+CHAPTER_READ_AHEAD_MAX = 3
+# 预读的章节在书架缓冲区中的保存时间(秒)
+CHAPTER_PREFETCH_TIMEOUT = 60 * 10
+
+# 导出书籍时同时获取的章节数
+EXPORT_MAX_WORKERS = 4
+
+# 同时查询多个书架时使用的线程数
+GATHER_MAX_WORKERS = 16
+# 同时查询多个书架时每个书架的最长等待时间(秒), 超时的书架单独返回超时状态
+GATHER_SHELF_TIMEOUT = 10
+# 同步爬虫每次请求原网站的超时时间(秒), 不超过书架的等待时间, 超时的书架不会一直占用线程池中的线程
+SPIDER_TIMEOUT = GATHER_SHELF_TIMEOUT
+
+# 有毒小说网的请求地址(各接口的地址在sites/youdu.py中), 性能测试时通过环境变量 YOUDU_BASE_URL 指向本地的模拟服务器(benchmarks/fake_youdu.py)
+# 只影响请求的地址, 书架与爬虫仍然使用 https://www.youdubook.com/ 作为网站标识
+YOUDU_BASE_URL = os.environ.get('YOUDU_BASE_URL', 'https://www.youdubook.com').rstrip('/')
+# 有毒小说网请求头模板, 只读, 每个书架的会话使用一份副本(cookie中填入账号密码)
+YOUDU_HEADERS = MappingProxyType({
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/84.0.4147.125 Safari/537.36',
     'cookie': 'saveMemberInfo=%7B%22username%22%3A%22{}%22%2C%22password%22%3A%22{}%22%7D',
-    'origin': 'https://www.youdubook.com',
+    'origin': YOUDU_BASE_URL,
     'x-requested-with': 'XMLHttpRequest'
-}
-# 有毒小说网个人书架网址
-YOUDU_SHELF_URL = 'https://www.youdubook.com/user/favobook'
-# 有毒小说网个人钱包网址
-YOUDU_WALLET_URL = 'https://www.youdubook.com/user/prepaidrecords'
-# 有毒小说网书籍详情网址
-YOUDU_BOOK_URL = 'https://www.youdubook.com/book_detail/{}'
-# 有毒小说网获取caonima所需的URL
-YOUDU_READ_CHAPTER_URL = 'https://www.youdubook.com/readchapter/{}'
-# 有毒小说网获取章节JSON数据的URL
-YOUDU_CHAPTER_JSON_URL = 'https://www.youdubook.com/booklibrary/membersinglechapter/chapter_id/{}'
-# 有毒小说网获取行评论的URL
-YOUDU_LINE_COMMENT_URL = 'https://www.youdubook.com/booklibrary/tsukkomilist'
-# 有毒小说网发送行评论URL
-YOUDU_LINE_COMMENT_SEND_URL = 'https://www.youdubook.com/booklibrary/tsukkomiadd'
-# 有毒小说网订阅章节的URL
-YOUDU_BUY_CHAPTER_URL = 'https://www.youdubook.com/booklibrary/subscribebookaction'
-# 有毒小说网排行榜的URL
-YOUDU_RANK_URL = 'https://www.youdubook.com/ranking/ranklist/tag/{}/type/{}?page={}'
-# 有毒小说网搜索的URL
-YOUDU_SEARCH_URL = 'https://www.youdubook.com/booklibrary/index/str/0_0_0_0_0_0_0_{}?page={}'
-# 有毒小说网收藏与取消收藏小说接口
-YOUDU_ADD_BOOK_URL = 'https://www.youdubook.com/booklibrary/actionfavo'
+})
+
+# 章节存储中章节数据的保存时间(秒), 在有效期内被读取会自动续期
+CHAPTER_STORE_TIMEOUT = 60 * 60 * 24 * 7
+# 最新章节(还没有下一章)的保存时间, 避免下一章按钮一直为空
+CHAPTER_STORE_TAIL_TIMEOUT = 60 * 10
+# 进程内章节缓存最多保存的章节数, 超出时淘汰最久未读取的章节
+CHAPTER_STORE_LOCAL_MAX_ENTRIES = 2000
+# 章节文本的压缩级别(1-9), 以及不压缩的最短文本长度(字数)
+CHAPTER_COMPRESS_LEVEL = 6
+CHAPTER_COMPRESS_MIN_SIZE = 200
+# 训练的压缩字典的最大字节数, zlib最多使用32KB
+CHAPTER_DICT_SIZE = 32 * 1024
+# 检查是否有新的压缩字典的间隔(秒)
+CHAPTER_DICT_RELOAD_INTERVAL = 60 * 10
+
+# 间贴在进程内缓存中的保存时间(秒)
+LINE_COMMENT_CACHE_TIMEOUT = 30
+# 批量获取间贴时同时请求的段落数
+LINE_COMMENT_MAX_WORKERS = 8
+# 批量获取间贴时一次最多的段落数
+LINE_COMMENT_BATCH_MAX = 200
+
+# 本地搜索每页的书籍数
+SEARCH_INDEX_PAGE_SIZE = 20
+# 是否把章节存储中的章节内容也加入本地搜索索引
+SEARCH_INDEX_CHAPTERS = False
@@ -0,0 +1,141 @@
+#!/user/bin/env python
+# 每天都要有好心情
+# 请求合并与限速模块
+# SingleFlight: 同时发起的相同请求只请求一次原网站, 其他调用等待并共用结果
+# TokenBucket: 按网站限制进程内所有书架请求原网站的速度
+import asyncio
+import threading
+import time
+
+from Novel_Server.utils.spiders_setting import SPIDER_RATE_LIMITS
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    合并同一进程中同时进行的相同调用, 用于线程
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        """
+        执行func, 相同key的调用正在执行时等待它的结果
+        :param key: 调用标识
+        :param func: 无参数的函数
+        :return: func的返回值, 出错时所有等待的调用都会抛出同样的异常
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+
+class AsyncSingleFlight:
+    """
+    合并同一事件循环中同时进行的相同调用, 用于协程
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, func):
+        """
+        :param key: 调用标识
+        :param func: 无参数的协程函数
+        :return: func的返回值
+        """
+        loop = asyncio.get_running_loop()
+        call_key = (id(loop), key)
+        task = self._calls.get(call_key)
+        if task is None:
+            # 在单独的任务中执行, 第一个调用被取消(例如超时)时不会取消其他调用等待的结果
+            task = self._calls[call_key] = loop.create_task(func())
+            task.add_done_callback(lambda done: self._finish(call_key, done))
+        # 调用被取消时只停止等待, 任务继续执行
+        return await asyncio.shield(task)
+
+    def _finish(self, call_key, task):
+        if self._calls.get(call_key) is task:
+            del self._calls[call_key]
+        # 所有调用都已取消时没有人获取异常, 在这里获取以免输出未获取异常的日志
+        if not task.cancelled():
+            task.exception()
+
+
+class TokenBucket:
+    """
+    令牌桶, 每秒补充rate个令牌, 最多保存burst个
+    令牌不足时预支令牌并返回需要等待的时间, 等待的请求按先后顺序发出
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        取出一个令牌
+        :return: 需要等待的秒数
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+    async def async_acquire(self):
+        wait = self.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_rate_limiter(site):
+    """
+    获取网站的令牌桶, 同一进程中的同步与异步爬虫共用
+    :param site: 网站地址
+    :return: 令牌桶, 没有设置限速的网站返回None
+    """
+    if site not in SPIDER_RATE_LIMITS:
+        return None
+    with _buckets_lock:
+        if site not in _buckets:
+            _buckets[site] = TokenBucket(*SPIDER_RATE_LIMITS[site])
+        return _buckets[site]
@@ -0,0 +1,92 @@
+#!/user/bin/env python
+# 每天都要有好心情
+# 已验证token缓存模块
+# 缓存token对应的用户数据, 避免每个请求都查询一次用户表
+import hashlib
+import time
+
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+
+class TokenCache(object):
+    """
+    以token的摘要为键缓存用户数据, 缓存在token过期时同时过期
+    每个用户有一个版本号, 修改密码, 停用账号, 删除用户等修改用户数据时更新版本号, 之前缓存的用户数据全部失效
+    存放在所有进程共享的缓存中(settings.CACHES['auth']), 只保存认证与接口需要的字段, 不保存密码
+    """
+    # 缓存的用户字段, 其他字段(密码, 登录时间等)在使用时从数据库读取
+    fields = ('uid', 'username', 'nickname', 'gender', 'email', 'is_active', 'is_superuser')
+
+    def __init__(self, alias='auth'):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def make_key(token):
+        return 'auth:user:' + hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def make_version_key(username):
+        return f'auth:version:{username}'
+
+    def get(self, token, username):
+        """
+        获取缓存的用户
+        没有缓存的字段是延迟加载的字段, 修改密码等需要时才查询数据库, 保存时只更新已加载的字段
+        :param token: token
+        :param username: token中的用户名
+        :return: 用户对象, 未命中或已失效时返回None
+        """
+        from django.contrib.auth import get_user_model
+        key, version_key = self.make_key(token), self.make_version_key(username)
+        data = self.cache.get_many([key, version_key])
+        snapshot, version = data.get(key), data.get(version_key)
+        if snapshot is None or version is None or snapshot['version'] != version:
+            return None
+        User = get_user_model()
+        # from_db要求字段按模型中的顺序排列
+        fields = [field.attname for field in User._meta.concrete_fields if field.attname in snapshot['user']]
+        return User.from_db(DEFAULT_DB_ALIAS, fields, [snapshot['user'][field] for field in fields])
+
+    def get_version(self, username):
+        """
+        获取用户当前的版本号, 需要在查询用户之前获取, 避免缓存查询期间被修改的数据
+        """
+        version_key = self.make_version_key(username)
+        version = self.cache.get(version_key)
+        if version is None:
+            self.cache.add(version_key, time.time_ns(), None)
+            version = self.cache.get(version_key)
+        return version
+
+    def set(self, token, exp, user, version):
+        """
+        缓存用户数据
+        :param token: token
+        :param exp: token的过期时间戳
+        :param user: 用户对象
+        :param version: 查询用户之前获取的版本号
+        :return:
+        """
+        timeout = int(exp - time.time())
+        if timeout <= 0 or version is None:
+            return
+        self.cache.set(self.make_key(token), {
+            'version': version,
+            'user': {field: getattr(user, field) for field in self.fields},
+        }, timeout)
+
+    def invalidate(self, username):
+        """
+        使用户之前缓存的数据全部失效
+        :param username: 用户名
+        :return:
+        """
+        self.cache.set(self.make_version_key(username), time.time_ns(), None)
+
+
+token_cache = TokenCache()
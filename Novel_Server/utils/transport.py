@@ -0,0 +1,128 @@
+#!/user/bin/env python
+# 每天都要有好心情
+# 共享连接池模块
+# 同一进程中所有书架的requests会话挂载同一个HTTPAdapter, 共用到原网站的连接池(keep-alive与TLS连接复用)
+# 每个书架的会话只保存自己的cookie与请求头
+import socket
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from Novel_Server.utils.spiders_setting import SPIDER_POOL_CONNECTIONS, SPIDER_POOL_MAXSIZE, \
+    SPIDER_POOL_BLOCK, SPIDER_POOL_TIMEOUT
+
+
+class PoolStats:
+    """
+    连接池计数, 用于确定连接池大小
+    requests: 从连接池取出连接的次数
+    connects: 新建连接(包括断开后重连)的次数, requests - connects 即复用连接的次数
+    wait_seconds: 等待空闲连接的总时间, max_wait_seconds: 单次最长等待时间
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connects = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record_request(self, wait):
+        with self._lock:
+            self.requests += 1
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+
+    def record_connect(self):
+        with self._lock:
+            self.connects += 1
+
+    def snapshot(self):
+        with self._lock:
+            reused = max(self.requests - self.connects, 0)
+            return {
+                'requests': self.requests,
+                'connects': self.connects,
+                'reused': reused,
+                'reuse_ratio': reused / self.requests if self.requests else 0.0,
+                'wait_seconds': self.wait_seconds,
+                'max_wait_seconds': self.max_wait_seconds,
+            }
+
+
+stats = PoolStats()
+
+
+class InstrumentedHTTPConnection(HTTPConnection):
+    def connect(self):
+        stats.record_connect()
+        return super().connect()
+
+
+class InstrumentedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        stats.record_connect()
+        return super().connect()
+
+
+class InstrumentedPoolMixin:
+    def _get_conn(self, timeout=None):
+        # 连接池已满时最多等待 SPIDER_POOL_TIMEOUT 秒, 不会一直阻塞
+        start = time.perf_counter()
+        conn = super()._get_conn(timeout if timeout is not None else SPIDER_POOL_TIMEOUT)
+        stats.record_request(time.perf_counter() - start)
+        return conn
+
+
+class InstrumentedHTTPConnectionPool(InstrumentedPoolMixin, HTTPConnectionPool):
+    ConnectionCls = InstrumentedHTTPConnection
+
+
+class InstrumentedHTTPSConnectionPool(InstrumentedPoolMixin, HTTPSConnectionPool):
+    ConnectionCls = InstrumentedHTTPSConnection
+
+
+class SharedHTTPAdapter(HTTPAdapter):
+    """
+    所有会话共用的HTTPAdapter
+    每个网站(host)最多保持 SPIDER_POOL_MAXSIZE 个连接, 连接开启TCP keepalive
+    会话关闭时不会关闭共享的连接池, 需要关闭时调用shutdown
+    """
+
+    def __init__(self):
+        super().__init__(pool_connections=SPIDER_POOL_CONNECTIONS, pool_maxsize=SPIDER_POOL_MAXSIZE,
+                         pool_block=SPIDER_POOL_BLOCK)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs.setdefault('socket_options', HTTPConnection.default_socket_options + [
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+        ])
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': InstrumentedHTTPConnectionPool,
+            'https': InstrumentedHTTPSConnectionPool,
+        }
+
+    def close(self):
+        # Session.close()会关闭挂载的adapter, 共享的连接池由其他会话继续使用
+        pass
+
+    def shutdown(self):
+        super().close()
+
+
+shared_adapter = SharedHTTPAdapter()
+
+
+def mount(session):
+    """
+    让会话使用共享连接池
+    :param session: requests会话
+    :return: 会话
+    """
+    session.mount('https://', shared_adapter)
+    session.mount('http://', shared_adapter)
+    return session
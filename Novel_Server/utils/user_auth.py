@@ -3,10 +3,15 @@
 # 用户登录验证模块
 import jwt
 from rest_framework import exceptions
-from rest_framework_jwt.authentication import BaseJSONWebTokenAuthentication, jwt_decode_handler
+from rest_framework_jwt.authentication import BaseJSONWebTokenAuthentication, jwt_decode_handler, \
+    jwt_get_username_from_payload
+
+from Novel_Server.utils.metrics import timed
+from Novel_Server.utils.token_cache import token_cache
 
 
 class TokenAuthentication(BaseJSONWebTokenAuthentication):
+    @timed('auth')
     def authenticate(self, request):
         # 从请求的headers中获取认证信息
         token = request.META.get('HTTP_AUTHORIZATION', None)
@@ -15,8 +20,14 @@ class TokenAuthentication(BaseJSONWebTokenAuthentication):
         try:
             # 解密
             payload = jwt_decode_handler(token)
-            # 获取用户对象
-            user = self.authenticate_credentials(payload)
+            username = jwt_get_username_from_payload(payload)
+            # 已验证过的token直接使用缓存的用户, 不查询数据库
+            user = token_cache.get(token, username)
+            if user is None:
+                version = token_cache.get_version(username)
+                # 获取用户对象
+                user = self.authenticate_credentials(payload)
+                token_cache.set(token, payload.get('exp', 0), user, version)
             # user对象会返回给request
             return user, token
         # jwt解析异常,代表非法用户,如果要当游客处理就返回None
@@ -0,0 +1,428 @@
+#!/user/bin/env python
+# 每天都要有好心情
+# 异步接口, 需要通过asgi运行(见Novel_Server/asgi.py与gunicorn_asgi.conf.py)
+# 包含书架, 钱包, 排行榜, 搜索, 书籍, 章节与间贴接口, 参数与返回值与views.py中对应的同步接口一致:
+# 书架的获取与归属验证使用permissions.get_shelves, 书籍详情与书架快照通过同样的模型方法读取与保存,
+# 书架, 书籍详情与章节同样返回ETag并在匹配时返回304.
+# 与同步接口的区别:
+#   - 书架接口只有get, 绑定与修改书架, 用户信息, 修改密码与书籍导出只有同步接口
+#   - 请求参数合并了查询参数与请求体(见get_params)
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponseNotAllowed
+from django.views import View
+from rest_framework import exceptions
+
+from Novel_Server.utils import etags
+from Novel_Server.utils.gather import async_gather_shelves, async_local_or_gather, summary_status
+from Novel_Server.utils.renderers import render_response
+from Novel_Server.utils.search_index import search_index
+from Novel_Server.utils.sites import get_spider_class
+from Novel_Server.utils.user_auth import TokenAuthentication
+from UserApp.models import ChapterLock, ShelfSnapshot
+from UserApp.permissions import IsOwnerToShelf, get_shelf, get_shelves
+from UserApp.serializers import ShelfSerializer
+from UserApp.views import get_read_ahead, get_paragraph_range, get_paragraph_indexes
+
+
+def get_params(request):
+    """
+    合并查询参数与请求体中的数据, 同步接口的GET请求也会从请求体中读取参数
+    :param request: 请求
+    :return: 参数dict
+    """
+    params = request.GET.dict()
+    if request.content_type == 'application/json':
+        try:
+            body = json.loads(request.body or b'{}')
+        except ValueError:
+            body = {}
+        if isinstance(body, dict):
+            params.update(body)
+    else:
+        params.update(request.POST.dict())
+    return params
+
+
+def find_spider(shelf):
+    """
+    获取书架对应的异步爬虫, 不进行登录
+    :return: 爬虫对象, 网站不支持时返回None
+    """
+    try:
+        return get_spider_class(shelf.web_url, asynchronous=True)(shelf)
+    except KeyError:
+        return None
+
+
+async def get_spider(shelf):
+    """
+    获取书架对应的异步爬虫, 没有登录时进行登录
+    :param shelf: 书架
+    :return: 爬虫对象, 网站不支持时返回None
+    """
+    spider = find_spider(shelf)
+    if spider and not spider.is_login:
+        await spider.login()
+    return spider
+
+
+async def refresh_snapshot(spider):
+    """
+    从原网站获取书架中的书籍并保存为书架快照, 与ShelfSnapshot.refresh相同
+    """
+    return await sync_to_async(ShelfSnapshot.merge)(spider.shelf, await spider.get_shelf())
+
+
+class AsyncAPIView(View):
+    """
+    异步接口的基类, 负责用户认证与参数解析
+    认证成功后 request.user 为当前用户, request.params 为请求参数
+    """
+    authentication = TokenAuthentication()
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # django只会await协程函数形式的视图, 所以这里返回协程函数
+        async def view(request, *args, **kwargs):
+            self = cls(**initkwargs)
+            self.setup(request, *args, **kwargs)
+            return await self.dispatch(request, *args, **kwargs)
+        view.view_class = cls
+        view.view_initkwargs = initkwargs
+        # 与rest_framework的APIView一样使用token认证, 不需要csrf验证
+        view.csrf_exempt = True
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        handler = getattr(self, request.method.lower(), None)
+        if request.method.lower() not in self.http_method_names or handler is None:
+            return HttpResponseNotAllowed(self._allowed_methods())
+        try:
+            request.user, _ = await sync_to_async(self.authentication.authenticate)(request)
+        except exceptions.AuthenticationFailed as e:
+            return self.response({'detail': e.detail}, status=e.status_code)
+        request.params = get_params(request)
+        return await handler(request, *args, **kwargs)
+
+    def response(self, data, status=200):
+        # 与rest_framework的接口一样按Accept返回JSON或MessagePack
+        return render_response(self.request, data, status)
+
+
+class AsyncShelfView(AsyncAPIView):
+    """
+    书架接口
+    get: 获取书架快照, 与ShelfView.get相同, 传入refresh时先从原网站更新快照
+    """
+
+    async def get(self, request):
+        response = {
+            'status': 2000,
+            'msg': None,
+        }
+        shelf_set = await sync_to_async(get_shelves)(request, request.params.get('shelf_id'), ('snapshot', ))
+        if shelf_set:
+            if request.params.get('refresh'):
+                result = await async_gather_shelves(shelf_set, get_spider, refresh_snapshot, 'snapshot')
+                response['status'], response['msg'] = summary_status(result)
+                for shelf in shelf_set:
+                    snapshot = result[shelf.id]['snapshot']
+                    if snapshot is not None:
+                        shelf.snapshot = snapshot
+            etag = etags.make_weak_etag(response['status'], response['msg'], ShelfSerializer.get_etag(shelf_set))
+            client_etag = etags.match(request, etag)
+            if client_etag:
+                await sync_to_async(ShelfSerializer.refresh_stale)(shelf_set)
+                return etags.not_modified(client_etag)
+            response['data'] = await sync_to_async(
+                lambda: ShelfSerializer(shelf_set, many=True, context={'request': request}).data)()
+            response['msg'] = response['msg'] or '获取书架信息成功'
+            return etags.set_etag(self.response(response), etag)
+        response['status'] = 2001
+        response['msg'] = '还没有绑定书架!快去绑定一个吧!'
+        return self.response(response)
+
+
+class AsyncWalletView(AsyncAPIView):
+    """
+    钱包接口
+    get: 获取书架中的代币余额.
+    """
+
+    async def get(self, request):
+        response = {
+            'status': None,
+            'msg': None
+        }
+        shelf_id = request.params.get('shelf_id')
+        shelf_set = await sync_to_async(get_shelves)(request, shelf_id)
+        # 与同步接口的权限验证(IsOwnerToShelfOrAll)一致
+        if shelf_id and not shelf_set:
+            return self.response({'detail': IsOwnerToShelf.message}, status=403)
+        data = await async_gather_shelves(shelf_set, get_spider, lambda spider: spider.get_wallet(), 'wallet')
+        response['status'], response['msg'] = summary_status(data)
+        response['msg'] = response['msg'] or '获取钱包信息成功!'
+        response['data'] = data
+        return self.response(response)
+
+
+class AsyncRankView(AsyncAPIView):
+    """
+    排行榜数据接口
+    get: 获取排行榜信息, 当不传入shelf_id时,默认获取所有书架的排行榜
+    """
+
+    async def get(self, request):
+        response = {
+            'status': None,
+            'msg': None
+        }
+        rank_type = request.params.get('rank_type')
+        data_type = request.params.get('data_type')
+        page = request.params.get('page')
+        shelf_set = await sync_to_async(get_shelves)(request, request.params.get('shelf_id'))
+        data = await async_gather_shelves(shelf_set, get_spider,
+                                          lambda spider: spider.get_rank(rank_type, data_type, page), 'rank')
+        response['status'], response['msg'] = summary_status(data)
+        response['msg'] = response['msg'] or '获取排行榜信息成功!'
+        response['data'] = data
+        return self.response(response)
+
+
+class AsyncSearchView(AsyncAPIView):
+    """
+    搜索接口
+    get: 需要keyword, 可选page, shelf_id, fresh, scope, 与SearchView.get相同
+    """
+
+    async def get(self, request):
+        response = {
+            'status': None,
+            'msg': None
+        }
+        keyword = request.params.get('keyword')
+        page = request.params.get('page', 1)
+        fresh = request.params.get('fresh')
+        if keyword:
+            shelf_set = await sync_to_async(get_shelves)(request, request.params.get('shelf_id'))
+            if request.params.get('scope') == 'chapter':
+                data = await async_local_or_gather(
+                    shelf_set, lambda site: search_index.search_chapters(site, keyword, page) or {
+                        'pages': 0, 'page': page, 'total': 0, 'chapters': [], 'source': 'local'},
+                    get_spider, None, 'rank')
+            else:
+                # 优先使用本地搜索索引, 本地没有结果的书架并发查询原网站
+                data = await async_local_or_gather(
+                    shelf_set, lambda site: None if fresh else search_index.search(site, keyword, page),
+                    get_spider, lambda spider: spider.search_book(keyword, page), 'rank')
+            response['status'], response['msg'] = summary_status(data)
+            response['msg'] = response['msg'] or '搜索成功!'
+            response['data'] = data
+        else:
+            response['status'] = 3001
+            response['msg'] = '请输入关键词!'
+        return self.response(response)
+
+
+class AsyncBookView(AsyncAPIView):
+    """
+    书籍接口
+    get: 获取书籍详情信息,需要 shelf_id, book_id, 优先从数据库读取, 过期时在后台刷新, 与BookView.get相同
+    post: 收藏&取消收藏书籍, 需要shelf_id, book_id
+    """
+
+    async def get(self, request):
+        response = {
+            'status': 4001,
+            'msg': '未找到书籍!'
+        }
+        book_id = request.params.get('book_id')
+        shelf_id = request.params.get('shelf_id')
+        shelf = await sync_to_async(get_shelf)(request, shelf_id) if book_id else None
+        if shelf is not None:
+            try:
+                data = None
+                lock = await sync_to_async(ChapterLock.find)(shelf, str(book_id))
+                if lock is not None:
+                    # 解锁状态交给异步爬虫, 获取章节时判断能否使用章节存储
+                    lock_map = lock.lock_map
+                    spider = find_spider(shelf)
+                    if spider:
+                        spider.chapter_lock.update(lock_map)
+                    client_etag = etags.match(request, lock.etag)
+                    if client_etag:
+                        return etags.not_modified(client_etag)
+                    data = await sync_to_async(lock.book.to_data)(lock_map)
+                else:
+                    # 数据库中还没有时请求原网站, 与同步接口一样保存到数据库
+                    spider = await get_spider(shelf)
+                    if spider:
+                        data = await spider.get_book(book_id)
+                        lock = await sync_to_async(ChapterLock.merge)(shelf, str(book_id), data)
+                if data is not None:
+                    response['status'] = 4000
+                    response['msg'] = '获取书籍信息成功'
+                    response['data'] = data
+                    return etags.set_etag(self.response(response), lock.etag)
+            except ValueError as e:
+                response['status'] = 2001
+                response['msg'] = str(e)
+        return self.response(response)
+
+    async def post(self, request):
+        response = {
+            'status': 4001,
+            'msg': '未找到书籍!'
+        }
+        book_id = request.params.get('book_id')
+        shelf_id = request.params.get('shelf_id')
+        shelf = await sync_to_async(get_shelf)(request, shelf_id) if book_id else None
+        if shelf is not None:
+            try:
+                spider = await get_spider(shelf)
+                if spider:
+                    response = await spider.favo_book(book_id)
+            except ValueError as e:
+                response['status'] = 2001
+                response['msg'] = str(e)
+        return self.response(response)
+
+
+class AsyncChapterView(AsyncAPIView):
+    """
+    章节接口
+    get: 获取章节信息 需要shelf_id, book_id, chapter_id, 可选read_ahead(预读之后的章节数), 可选start, end(段落范围),
+         与ChapterView.get相同
+    post: 订阅章节 需要shelf_id, book_id, chapter_id
+    """
+
+    async def get(self, request):
+        response = {
+            'status': 2001,
+            'msg': None
+        }
+        shelf_id = request.params.get('shelf_id')
+        book_id = request.params.get('book_id')
+        chapter_id = request.params.get('chapter_id')
+        if shelf_id and book_id and chapter_id:
+            shelf = await sync_to_async(get_shelf)(request, shelf_id)
+            try:
+                spider = await get_spider(shelf) if shelf else None
+                if spider:
+                    start, end = get_paragraph_range(request.params)
+                    if str(chapter_id) not in spider.chapter_lock:
+                        await sync_to_async(ChapterLock.load_spider)(shelf, book_id, chapter_id, spider)
+                    chapter = await spider.get_packed_chapter(chapter_id, get_read_ahead(request.params))
+                    # 章节没有变化时返回304, 不需要转换与序列化章节数据
+                    etag = etags.make_etag('chapter', chapter.digest(), start, end)
+                    client_etag = etags.match(request, etag)
+                    if client_etag:
+                        return etags.not_modified(client_etag)
+                    response['status'] = 2000
+                    response['msg'] = '获取章节信息成功'
+                    response['data'] = chapter.to_data(start, end)
+                    return etags.set_etag(self.response(response), etag)
+            except ValueError as e:
+                response['msg'] = str(e)
+        return self.response(response)
+
+    async def post(self, request):
+        response = {
+            'status': 2001,
+            'msg': None
+        }
+        shelf_id = request.params.get('shelf_id')
+        book_id = request.params.get('book_id')
+        chapter_id = request.params.get('chapter_id')
+        if shelf_id and book_id and chapter_id:
+            shelf = await sync_to_async(get_shelf)(request, shelf_id)
+            try:
+                spider = await get_spider(shelf) if shelf else None
+                if spider:
+                    response = await spider.buy_chapter(book_id, chapter_id)
+                    if spider.can_read(chapter_id):
+                        await sync_to_async(ChapterLock.unlock)(shelf, book_id, chapter_id)
+            except ValueError as e:
+                response['msg'] = str(e)
+        return self.response(response)
+
+
+class AsyncLineCommentView(AsyncAPIView):
+    """
+    间贴接口
+    get: 获取间贴, 需要shelf_id, chapter_id, count, index
+    post: 发送间贴, 需要shelf_id, chapter_id, book_id, index, line_content, tsukkomi_content
+    """
+
+    async def get(self, request):
+        response = {
+            'status': 2001,
+            'msg': None
+        }
+        shelf_id = request.params.get('shelf_id')
+        chapter_id = request.params.get('chapter_id')
+        count = request.params.get('count', 10)
+        index = request.params.get('index')
+        if shelf_id and chapter_id and index:
+            shelf = await sync_to_async(get_shelf)(request, shelf_id)
+            try:
+                spider = await get_spider(shelf) if shelf else None
+                if spider:
+                    response['data'] = await spider.get_line_comment(chapter_id, count, index)
+                    response['status'] = 1
+                    response['msg'] = '获取间贴信息成功'
+            except ValueError as e:
+                response['msg'] = str(e)
+        return self.response(response)
+
+    async def post(self, request):
+        response = {
+            'status': 2001,
+            'msg': '数据错误'
+        }
+        shelf_id = request.params.get('shelf_id')
+        book_id = request.params.get('book_id')
+        chapter_id = request.params.get('chapter_id')
+        index = request.params.get('index')
+        line_content = request.params.get('line_content')
+        tsukkomi_content = request.params.get('tsukkomi_content')
+        if all((shelf_id, book_id, chapter_id, index, line_content, tsukkomi_content)):
+            shelf = await sync_to_async(get_shelf)(request, shelf_id)
+            try:
+                spider = await get_spider(shelf) if shelf else None
+                if spider:
+                    response = await spider.send_line_comment(book_id, chapter_id, index,
+                                                              line_content, tsukkomi_content)
+            except ValueError as e:
+                response['msg'] = str(e)
+        return self.response(response)
+
+
+class AsyncLineCommentBatchView(AsyncAPIView):
+    """
+    批量间贴接口
+    get: 获取一个章节多个段落的间贴, 需要shelf_id, chapter_id, indexes, 可选count
+    """
+
+    async def get(self, request):
+        response = {
+            'status': 2001,
+            'msg': None
+        }
+        shelf_id = request.params.get('shelf_id')
+        chapter_id = request.params.get('chapter_id')
+        count = request.params.get('count', 10)
+        indexes = get_paragraph_indexes(request.params)
+        if shelf_id and chapter_id and indexes:
+            shelf = await sync_to_async(get_shelf)(request, shelf_id)
+            try:
+                spider = await get_spider(shelf) if shelf else None
+                if spider:
+                    response['data'] = await spider.get_line_comments(chapter_id, indexes, count)
+                    response['status'] = 1
+                    response['msg'] = '获取间贴信息成功'
+            except ValueError as e:
+                response['msg'] = str(e)
+        return self.response(response)
@@ -0,0 +1,65 @@
+#!/user/bin/env python
+# 每天都要有好心情
+# 后台任务的处理函数, 由crawl_worker加载
+from Novel_Server.utils.jobs import register
+from UserApp.models import Shelf, ShelfSnapshot, ChapterLock, CrawlJob
+
+
+def get_shelf(shelf_id):
+    # 书架已经被删除时不需要再执行任务
+    return Shelf.objects.filter(id=shelf_id).first()
+
+
+@register('shelf.check_login')
+def check_login(payload):
+    """
+    验证新绑定书架的账号能否登录, 登录成功后获取书架快照
+    """
+    shelf = get_shelf(payload['shelf_id'])
+    if shelf and shelf.spider:
+        CrawlJob.enqueue('shelf.refresh', shelf.web_url, {'shelf_id': shelf.id},
+                         priority=CrawlJob.PRIORITY_HIGH, dedup_key=f'shelf.refresh:{shelf.id}')
+        CrawlJob.enqueue('shelf.wallet', shelf.web_url, {'shelf_id': shelf.id},
+                         priority=CrawlJob.PRIORITY_LOW, dedup_key=f'shelf.wallet:{shelf.id}')
+
+
+@register('shelf.refresh')
+def refresh_shelf(payload):
+    shelf = get_shelf(payload['shelf_id'])
+    if shelf:
+        ShelfSnapshot.refresh(shelf)
+
+
+@register('shelf.wallet')
+def refresh_wallet(payload):
+    """
+    预先获取钱包信息, 保存在页面数据缓存中
+    """
+    shelf = get_shelf(payload['shelf_id'])
+    if shelf and shelf.spider:
+        shelf.spider.get_wallet(fresh=True)
+
+
+@register('book.refresh')
+def refresh_book(payload):
+    shelf = get_shelf(payload['shelf_id'])
+    if shelf:
+        ChapterLock.refresh(shelf, payload['book_id'])
+
+
+@register('chapter.warm')
+def warm_chapters(payload):
+    """
+    把书架可以阅读的章节预先保存到章节存储, 已经保存的章节不会请求原网站
+    """
+    shelf = get_shelf(payload['shelf_id'])
+    lock = shelf and ChapterLock.find(shelf, payload['book_id'])
+    if not lock:
+        return
+    lock.update_spider(shelf)
+    spider = shelf.spider
+    if not spider:
+        return
+    for chapter_id in payload['chapter_ids']:
+        if spider.can_read(chapter_id):
+            spider.load_chapter(chapter_id)
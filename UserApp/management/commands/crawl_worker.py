@@ -0,0 +1,22 @@
+#!/user/bin/env python
+# 每天都要有好心情
+from django.core.management.base import BaseCommand
+
+from Novel_Server.utils.jobs import Worker
+from Novel_Server.utils.spiders_setting import JOB_POLL_INTERVAL
+# 注册任务处理函数
+import UserApp.jobs  # noqa: F401
+
+
+class Command(BaseCommand):
+    help = '执行后台任务队列中的爬虫任务'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-c', '--concurrency', type=int, default=4, help='同时执行的任务数')
+        parser.add_argument('--poll', type=float, default=JOB_POLL_INTERVAL, help='队列为空时的轮询间隔(秒)')
+        parser.add_argument('--once', action='store_true', help='执行完当前可以执行的任务后退出')
+
+    def handle(self, *args, **options):
+        worker = Worker(options['concurrency'], options['poll'])
+        self.stdout.write(f'crawl_worker {worker.name} 启动, 并发数 {worker.concurrency}')
+        worker.run(once=options['once'])
@@ -0,0 +1,58 @@
+#!/user/bin/env python
+# 每天都要有好心情
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Novel_Server.utils.chapter_store import ChapterStore
+from Novel_Server.utils.compression import train_dictionary, compress, registry
+from Novel_Server.utils.spiders_setting import CHAPTER_DICT_SIZE
+from UserApp.models import Chapter, CompressionDictionary
+
+
+class Command(BaseCommand):
+    help = '从章节存储中随机选取已保存的章节, 训练新版本的章节压缩字典'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--samples', type=int, default=500, help='训练使用的章节数')
+        parser.add_argument('--size', type=int, default=CHAPTER_DICT_SIZE, help='字典的最大字节数')
+        parser.add_argument('--dry-run', action='store_true', help='只输出压缩效果, 不保存字典')
+
+    def load_samples(self, count):
+        # 目录中的章节不一定都已保存, 多取一些
+        stores, samples = {}, []
+        chapters = Chapter.objects.select_related('book').order_by('?')[:count * 3]
+        for chapter in chapters:
+            site = chapter.book.web_url
+            store = stores.setdefault(site, ChapterStore(site))
+            data = store.get(chapter.chapter_id)
+            if data is not None and data.text:
+                samples.append(data.text)
+                if len(samples) >= count:
+                    break
+        return samples
+
+    def handle(self, *args, **options):
+        samples = self.load_samples(options['samples'])
+        if len(samples) < 10:
+            raise CommandError(f'章节存储中只有{len(samples)}个章节, 样本太少')
+        # 每5个样本留出1个, 用来检查字典对没有见过的章节的效果
+        train = [text for i, text in enumerate(samples) if i % 5]
+        test = [text.encode() for i, text in enumerate(samples) if not i % 5]
+        start = time.perf_counter()
+        zdict = train_dictionary(train, options['size'])
+        self.stdout.write(f'训练样本 {len(train)} 个, 字典 {len(zdict)} 字节, 耗时 {time.perf_counter() - start:.1f}s')
+
+        raw = sum(len(text) for text in test)
+        current_version, current = registry.active()
+        results = [('不压缩', raw), ('无字典', sum(len(compress(text)) for text in test))]
+        if current:
+            results.append((f'当前字典 v{current_version}', sum(len(compress(text, current)) for text in test)))
+        results.append(('新字典', sum(len(compress(text, zdict)) for text in test)))
+        for name, size in results:
+            self.stdout.write(f'{name:<12}{size:>12} 字节 {size / raw:>8.1%}')
+
+        if not options['dry_run']:
+            dictionary = CompressionDictionary.create(zdict, len(train))
+            registry.add(dictionary.version, zdict)
+            self.stdout.write(f'已保存压缩字典 v{dictionary.version}, 其他进程会在下次检查时开始使用')
@@ -0,0 +1,55 @@
+# Generated by Django 3.1.14 on 2026-10-18 20:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import shortuuidfield.fields
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NovelUser',
+            fields=[
+                ('password', models.CharField(max_length=128, verbose_name='password')),
+                ('last_login', models.DateTimeField(blank=True, null=True, verbose_name='last login')),
+                ('is_superuser', models.BooleanField(default=False, help_text='Designates that this user has all permissions without explicitly assigning them.', verbose_name='superuser status')),
+                ('uid', shortuuidfield.fields.ShortUUIDField(blank=True, editable=False, max_length=22, primary_key=True, serialize=False)),
+                ('username', models.CharField(max_length=15, unique=True, verbose_name='用户名')),
+                ('nickname', models.CharField(db_index=True, max_length=20, unique=True, verbose_name='昵称')),
+                ('gender', models.CharField(choices=[('保密', '保密'), ('男', '男'), ('女', '女')], db_index=True, default='保密', max_length=2, verbose_name='性别')),
+                ('email', models.EmailField(max_length=254, verbose_name='邮箱')),
+                ('is_active', models.BooleanField(default=True, verbose_name='激活状态')),
+                ('date_joined', models.DateTimeField(auto_now_add=True)),
+                ('groups', models.ManyToManyField(blank=True, help_text='The groups this user belongs to. A user will get all permissions granted to each of their groups.', related_name='user_set', related_query_name='user', to='auth.Group', verbose_name='groups')),
+                ('user_permissions', models.ManyToManyField(blank=True, help_text='Specific permissions for this user.', related_name='user_set', related_query_name='user', to='auth.Permission', verbose_name='user permissions')),
+            ],
+            options={
+                'verbose_name': '用户',
+                'verbose_name_plural': '用户',
+                'db_table': 'novel_users',
+            },
+        ),
+        migrations.CreateModel(
+            name='Shelf',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account', models.CharField(max_length=40, verbose_name='网站账号')),
+                ('password', models.CharField(max_length=40, verbose_name='网站密码')),
+                ('web_url', models.URLField(choices=[('https://www.qidian.com/', '起点中文网'), ('https://www.youdubook.com/', '有毒小说网'), ('http://www.zongheng.com/', '纵横中文网'), ('https://www.ciweimao.com/', '刺猬猫')], default='https://www.qidian.com/', verbose_name='目标网站')),
+                ('shelf_title', models.CharField(default='我的书架', max_length=40, verbose_name='书架标题')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_shelf', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': '书架',
+                'verbose_name_plural': '书架',
+            },
+        ),
+    ]
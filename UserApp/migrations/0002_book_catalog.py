@@ -0,0 +1,82 @@
+# Generated by Django 3.1.14 on 2026-10-18 20:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('UserApp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Book',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('web_url', models.URLField(choices=[('https://www.qidian.com/', '起点中文网'), ('https://www.youdubook.com/', '有毒小说网'), ('http://www.zongheng.com/', '纵横中文网'), ('https://www.ciweimao.com/', '刺猬猫')], verbose_name='目标网站')),
+                ('book_id', models.CharField(max_length=40, verbose_name='书籍id')),
+                ('title', models.CharField(max_length=100, verbose_name='书名')),
+                ('author', models.CharField(max_length=40, verbose_name='作者')),
+                ('cover', models.URLField(max_length=300, verbose_name='封面')),
+                ('labels', models.TextField(default='[]', verbose_name='标签')),
+                ('fonts', models.CharField(max_length=40, verbose_name='字数')),
+                ('click', models.CharField(max_length=40, verbose_name='点击')),
+                ('favo', models.CharField(max_length=40, verbose_name='收藏')),
+                ('reward', models.TextField(default='{}', verbose_name='打赏信息')),
+                ('disc', models.TextField(verbose_name='简介')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '书籍',
+                'verbose_name_plural': '书籍',
+                'unique_together': {('web_url', 'book_id')},
+            },
+        ),
+        migrations.CreateModel(
+            name='Volume',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField(verbose_name='卷序号')),
+                ('name', models.CharField(max_length=100, verbose_name='卷名')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='volumes', to='UserApp.book')),
+            ],
+            options={
+                'verbose_name': '卷',
+                'verbose_name_plural': '卷',
+                'unique_together': {('book', 'index')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ChapterLock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chapter_lock', models.TextField(default='{}', verbose_name='解锁状态')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chapter_locks', to='UserApp.book')),
+                ('shelf', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chapter_locks', to='UserApp.shelf')),
+            ],
+            options={
+                'verbose_name': '章节解锁状态',
+                'verbose_name_plural': '章节解锁状态',
+                'unique_together': {('shelf', 'book')},
+            },
+        ),
+        migrations.CreateModel(
+            name='Chapter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chapter_id', models.CharField(max_length=40, verbose_name='章节id')),
+                ('title', models.CharField(max_length=200, verbose_name='章节标题')),
+                ('index', models.PositiveIntegerField(verbose_name='卷内序号')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chapters', to='UserApp.book')),
+                ('volume', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chapters', to='UserApp.volume')),
+            ],
+            options={
+                'verbose_name': '章节',
+                'verbose_name_plural': '章节',
+                'unique_together': {('book', 'chapter_id')},
+            },
+        ),
+    ]
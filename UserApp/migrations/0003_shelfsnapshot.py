@@ -0,0 +1,28 @@
+# Generated by Django 3.1.14 on 2026-10-18 20:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('UserApp', '0002_book_catalog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShelfSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('books', models.TextField(default='{}', verbose_name='书籍')),
+                ('version', models.PositiveIntegerField(default=0, verbose_name='版本')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('shelf', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='snapshot', to='UserApp.shelf')),
+            ],
+            options={
+                'verbose_name': '书架快照',
+                'verbose_name_plural': '书架快照',
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 3.1.14 on 2026-10-18 20:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('UserApp', '0003_shelfsnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CrawlJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=40, verbose_name='任务类型')),
+                ('site', models.URLField(db_index=True, verbose_name='目标网站')),
+                ('payload', models.TextField(default='{}', verbose_name='参数')),
+                ('dedup_key', models.CharField(blank=True, max_length=200, null=True, verbose_name='去重标识')),
+                ('pending_key', models.CharField(blank=True, max_length=200, null=True, unique=True, verbose_name='等待中的去重标识')),
+                ('priority', models.SmallIntegerField(default=5, verbose_name='优先级')),
+                ('status', models.CharField(choices=[('pending', '等待中'), ('running', '执行中'), ('failed', '已失败')], default='pending', max_length=10, verbose_name='状态')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='执行次数')),
+                ('max_attempts', models.PositiveSmallIntegerField(default=3, verbose_name='最多执行次数')),
+                ('run_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='执行时间')),
+                ('locked_at', models.DateTimeField(blank=True, null=True, verbose_name='开始执行时间')),
+                ('worker', models.CharField(blank=True, default='', max_length=100, verbose_name='执行者')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='错误信息')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+            ],
+            options={
+                'verbose_name': '后台任务',
+                'verbose_name_plural': '后台任务',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='crawljob',
+            index=models.Index(fields=['status', 'run_at'], name='UserApp_cra_status_8cc277_idx'),
+        ),
+    ]
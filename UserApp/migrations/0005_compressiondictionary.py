@@ -0,0 +1,27 @@
+# Generated by Django 3.1.14 on 2026-10-18 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('UserApp', '0004_crawljob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompressionDictionary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(unique=True, verbose_name='版本')),
+                ('data', models.BinaryField(verbose_name='字典')),
+                ('sample_count', models.PositiveIntegerField(default=0, verbose_name='样本数')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+            ],
+            options={
+                'verbose_name': '压缩字典',
+                'verbose_name_plural': '压缩字典',
+            },
+        ),
+    ]
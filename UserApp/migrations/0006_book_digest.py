@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('UserApp', '0005_compressiondictionary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='digest',
+            field=models.CharField(blank=True, default='', max_length=32, verbose_name='内容摘要'),
+        ),
+    ]
@@ -1,12 +1,38 @@
+import hashlib
+import json
+
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
 from shortuuidfield import ShortUUIDField
-from django.db import models
+import datetime
+from django.db import models, transaction, IntegrityError
+from django.db.models import Count, F, Max
+from django.db.models.functions import Greatest, Least
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from Novel_Server.utils.sites import get_spider_class
+from Novel_Server.utils.spiders_setting import BOOK_REFRESH_INTERVAL, SHELF_REFRESH_INTERVAL, \
+    JOB_SITE_CONCURRENCY, JOB_DEFAULT_CONCURRENCY, JOB_MAX_ATTEMPTS, JOB_RETRY_DELAY, JOB_LOCK_TIMEOUT, \
+    JOB_CHAPTER_WARM_LIMIT
+from Novel_Server.utils.etags import make_etag
+from Novel_Server.utils.token_cache import token_cache
+from Novel_Server.utils.search_index import search_index
 
-from Novel_Server.utils.spiders import Spider_YouDu
-from Novel_Server.utils.spiders_setting import SPIDERS
 
+class NovelUserQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        """
+        批量修改用户时不会调用NovelUser.save, 在这里使修改的用户已缓存的token失效
+        """
+        usernames = list(self.values_list('username', flat=True))
+        rows = super().update(**kwargs)
+        for username in usernames:
+            token_cache.invalidate(username)
+        return rows
 
-class UserManager(BaseUserManager):
+
+class UserManager(BaseUserManager.from_queryset(NovelUserQuerySet)):
     def _create_user(self, username, password, email, nickname, **kwargs):
         if not username:
             raise ValueError('请输入用户名!')
@@ -71,6 +97,12 @@ class NovelUser(AbstractBaseUser, PermissionsMixin):
         self.gender = gender
         self.save()
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # 用户数据(密码, 激活状态等)修改后, 已缓存的token用户数据失效
+        # 批量修改见NovelUserQuerySet.update, 删除见invalidate_deleted_user
+        token_cache.invalidate(self.username)
+
     def __str__(self):
         return self.nickname
 
@@ -80,6 +112,12 @@ class NovelUser(AbstractBaseUser, PermissionsMixin):
         db_table = 'novel_users'
 
 
+@receiver(post_delete, sender=NovelUser)
+def invalidate_deleted_user(sender, instance, **kwargs):
+    # 删除的用户(包括批量删除)已缓存的token失效
+    token_cache.invalidate(instance.username)
+
+
 # 书架
 class Shelf(models.Model):
     URL_QiDian = 'https://www.qidian.com/'
@@ -116,18 +154,28 @@ class Shelf(models.Model):
         # 判断书架标题是否已经存在
         if user.user_shelf.filter(shelf_title=shelf_title):
             raise ValueError('书架标题已存在!')
-        # 这里需要添加账号的登录验证
-        # 这里需要添加账号的登录验证
+        shelf = cls.objects.create(account=account, password=password, web_url=web_url,
+                                   shelf_title=shelf_title, user=user)
+        # 账号的登录验证交给后台任务, 验证成功后会接着获取书架快照
+        CrawlJob.enqueue('shelf.check_login', web_url, {'shelf_id': shelf.id},
+                         priority=CrawlJob.PRIORITY_HIGH, dedup_key=f'shelf.check_login:{shelf.id}')
         # 返回创建的对象
-        return cls.objects.create(account=account, password=password, web_url=web_url,
-                                  shelf_title=shelf_title, user=user)
+        return shelf
 
     @property
     def spider(self):
+        return self.get_spider()
+
+    def get_spider(self, login=True):
+        """
+        获取书架对应的爬虫
+        :param login: 没有登录时是否进行登录
+        :return: 爬虫对象, 不支持的网站返回None
+        """
         try:
-            spider = globals()[SPIDERS[self.web_url]](self)
+            spider = get_spider_class(self.web_url)(self)
             # 判断是否登录
-            if not spider.is_login:
+            if login and not spider.is_login:
                 spider.login()
         except KeyError:
             spider = None
@@ -138,3 +186,590 @@ class Shelf(models.Model):
     class Meta:
         verbose_name = '书架'
         verbose_name_plural = verbose_name
+
+
+# 书籍, 所有用户共用的书籍信息与目录
+class Book(models.Model):
+    web_url = models.URLField(verbose_name='目标网站', choices=Shelf.webs)
+    book_id = models.CharField(verbose_name='书籍id', max_length=40)
+    title = models.CharField(verbose_name='书名', max_length=100)
+    author = models.CharField(verbose_name='作者', max_length=40)
+    cover = models.URLField(verbose_name='封面', max_length=300)
+    labels = models.TextField(verbose_name='标签', default='[]')
+    fonts = models.CharField(verbose_name='字数', max_length=40)
+    click = models.CharField(verbose_name='点击', max_length=40)
+    favo = models.CharField(verbose_name='收藏', max_length=40)
+    reward = models.TextField(verbose_name='打赏信息', default='{}')
+    disc = models.TextField(verbose_name='简介')
+    # 书籍详情与目录的摘要, 只在内容变化时改变, 用于计算ETag与判断是否需要写入目录
+    digest = models.CharField(verbose_name='内容摘要', max_length=32, blank=True, default='')
+    updated_at = models.DateTimeField(verbose_name='更新时间', auto_now=True)
+
+    def __str__(self):
+        return self.title
+
+    @staticmethod
+    def make_digest(book_data):
+        """
+        计算书籍详情与目录的摘要, 不包括书架各自的解锁状态
+        :param book_data: get_book返回的书籍数据
+        :return: 摘要
+        """
+        keys = ('book_title', 'book_author', 'book_cover', 'book_label', 'book_fonts',
+                'book_click', 'book_favo', 'book_reward', 'book_disc')
+        content = [[book_data[key] for key in keys], [
+            [volume['volume_name'], [[chapter['chapter_id'], chapter['chapter_title']]
+                                     for chapter in volume['chapter_list']]]
+            for volume in book_data['book_volume_list']
+        ]]
+        data = json.dumps(content, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        return hashlib.blake2b(data.encode('utf-8'), digest_size=16).hexdigest()
+
+    @classmethod
+    def merge(cls, web_url, book_id, book_data):
+        """
+        保存爬虫获取的书籍详情, 目录只写入新增或修改过的卷与章节
+        :param web_url: 网站
+        :param book_id: 书籍id
+        :param book_data: get_book返回的书籍数据
+        :return: 书籍对象
+        """
+        digest = cls.make_digest(book_data)
+        book = cls.objects.filter(web_url=web_url, book_id=book_id).first()
+        if book is not None and book.digest == digest:
+            # 书籍详情与目录没有变化, 只更新刷新时间
+            book.save(update_fields=['updated_at'])
+            return book
+        with transaction.atomic():
+            book, _ = cls.objects.update_or_create(web_url=web_url, book_id=book_id, defaults={
+                'title': book_data['book_title'],
+                'author': book_data['book_author'],
+                'cover': book_data['book_cover'],
+                'labels': json.dumps(book_data['book_label'], ensure_ascii=False),
+                'fonts': book_data['book_fonts'],
+                'click': book_data['book_click'],
+                'favo': book_data['book_favo'],
+                'reward': json.dumps(book_data['book_reward'], ensure_ascii=False),
+                'disc': book_data['book_disc'],
+                'digest': digest,
+            })
+            volumes = {volume.index: volume for volume in book.volumes.all()}
+            chapters = {chapter.chapter_id: chapter for chapter in book.chapters.all()}
+            new_chapters, changed_chapters = [], []
+            seen = set()
+            for volume_index, volume_data in enumerate(book_data['book_volume_list']):
+                volume = volumes.get(volume_index)
+                if volume is None:
+                    volume = Volume.objects.create(book=book, index=volume_index, name=volume_data['volume_name'])
+                elif volume.name != volume_data['volume_name']:
+                    volume.name = volume_data['volume_name']
+                    volume.save(update_fields=['name'])
+                for index, chapter_data in enumerate(volume_data['chapter_list']):
+                    chapter_id = chapter_data['chapter_id']
+                    seen.add(chapter_id)
+                    chapter = chapters.get(chapter_id)
+                    if chapter is None:
+                        new_chapters.append(Chapter(book=book, volume=volume, chapter_id=chapter_id,
+                                                    title=chapter_data['chapter_title'], index=index))
+                    elif (chapter.volume_id, chapter.title, chapter.index) != \
+                            (volume.id, chapter_data['chapter_title'], index):
+                        chapter.volume = volume
+                        chapter.title = chapter_data['chapter_title']
+                        chapter.index = index
+                        changed_chapters.append(chapter)
+            Chapter.objects.bulk_create(new_chapters)
+            Chapter.objects.bulk_update(changed_chapters, ['volume', 'title', 'index'])
+            # 原网站删除的章节与卷
+            removed = [chapter.id for chapter_id, chapter in chapters.items() if chapter_id not in seen]
+            if removed:
+                Chapter.objects.filter(id__in=removed).delete()
+            book.volumes.filter(index__gte=len(book_data['book_volume_list'])).delete()
+        search_index.add_books(web_url, [{
+            'book_id': book_id,
+            'book_title': book_data['book_title'],
+            'book_author': book_data['book_author'],
+            'book_cover': book_data['book_cover'],
+            'book_favo': book_data['book_favo'],
+            'book_label': book_data['book_label'],
+            'book_disc': book_data['book_disc'],
+        }])
+        return book
+
+    def to_data(self, chapter_lock):
+        """
+        生成与get_book返回值相同格式的书籍数据
+        :param chapter_lock: 书架的章节解锁状态, {章节id: is_lock}, 没有记录的章节视为未解锁
+        :return: 书籍信息的dict
+        """
+        book_data = {
+            'book_title': self.title,
+            'book_author': self.author,
+            'book_label': json.loads(self.labels),
+            'book_fonts': self.fonts,
+            'book_click': self.click,
+            'book_favo': self.favo,
+            'book_reward': json.loads(self.reward),
+            'book_cover': self.cover,
+            'book_disc': self.disc,
+            'book_volume_list': [],
+            'chapter_lock': {},
+        }
+        volumes = {}
+        for volume in self.volumes.order_by('index'):
+            volumes[volume.id] = {
+                'volume_name': volume.name,
+                'chapter_list': []
+            }
+            book_data['book_volume_list'].append(volumes[volume.id])
+        for chapter in self.chapters.order_by('volume__index', 'index'):
+            is_lock = chapter_lock.get(chapter.chapter_id, 1)
+            volumes[chapter.volume_id]['chapter_list'].append({
+                'chapter_title': chapter.title,
+                'chapter_id': chapter.chapter_id,
+                'is_lock': is_lock
+            })
+            book_data['chapter_lock'][chapter.chapter_id] = is_lock
+        return book_data
+
+    class Meta:
+        verbose_name = '书籍'
+        verbose_name_plural = verbose_name
+        unique_together = ('web_url', 'book_id')
+
+
+# 书籍的卷
+class Volume(models.Model):
+    book = models.ForeignKey('Book', on_delete=models.CASCADE, related_name='volumes')
+    index = models.PositiveIntegerField(verbose_name='卷序号')
+    name = models.CharField(verbose_name='卷名', max_length=100)
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        verbose_name = '卷'
+        verbose_name_plural = verbose_name
+        unique_together = ('book', 'index')
+
+
+# 章节目录
+class Chapter(models.Model):
+    book = models.ForeignKey('Book', on_delete=models.CASCADE, related_name='chapters')
+    volume = models.ForeignKey('Volume', on_delete=models.CASCADE, related_name='chapters')
+    chapter_id = models.CharField(verbose_name='章节id', max_length=40)
+    title = models.CharField(verbose_name='章节标题', max_length=200)
+    index = models.PositiveIntegerField(verbose_name='卷内序号')
+
+    def __str__(self):
+        return self.title
+
+    class Meta:
+        verbose_name = '章节'
+        verbose_name_plural = verbose_name
+        unique_together = ('book', 'chapter_id')
+
+
+# 书架中书籍章节的解锁状态, 每个书架单独保存
+class ChapterLock(models.Model):
+    shelf = models.ForeignKey('Shelf', on_delete=models.CASCADE, related_name='chapter_locks')
+    book = models.ForeignKey('Book', on_delete=models.CASCADE, related_name='chapter_locks')
+    chapter_lock = models.TextField(verbose_name='解锁状态', default='{}')
+    updated_at = models.DateTimeField(verbose_name='更新时间', auto_now=True)
+
+    @property
+    def lock_map(self):
+        return json.loads(self.chapter_lock)
+
+    @classmethod
+    def refresh(cls, shelf, book_id):
+        """
+        从原网站获取书籍详情, 更新书籍目录与该书架的解锁状态
+        :param shelf: 书架
+        :param book_id: 书籍id
+        :return: 书籍数据, 不支持的网站返回None
+        """
+        spider = shelf.spider
+        if not spider:
+            return None
+        book_data = spider.get_book(book_id)
+        cls.merge(shelf, book_id, book_data)
+        return book_data
+
+    @classmethod
+    def merge(cls, shelf, book_id, book_data):
+        """
+        保存爬虫获取的书籍详情与该书架的解锁状态, 异步接口获取书籍详情后也通过这里保存
+        :param shelf: 书架
+        :param book_id: 书籍id
+        :param book_data: get_book返回的书籍数据
+        :return: ChapterLock
+        """
+        book = Book.merge(shelf.web_url, book_id, book_data)
+        old = cls.objects.filter(shelf=shelf, book=book).values_list('chapter_lock', flat=True).first()
+        lock, _ = cls.objects.update_or_create(shelf=shelf, book=book, defaults={
+            'chapter_lock': json.dumps(book_data['chapter_lock'])
+        })
+        if old is not None:
+            cls.warm_unlocked(shelf, book_id, json.loads(old), book_data['chapter_lock'])
+        return lock
+
+    @staticmethod
+    def warm_unlocked(shelf, book_id, old_lock, new_lock):
+        """
+        上次保存之后新增的或新解锁的章节, 在后台预先保存到章节存储
+        第一次获取书籍时不预先获取, 避免一次获取整本书
+        """
+        chapter_ids = [chapter_id for chapter_id, is_lock in new_lock.items()
+                       if is_lock in (-1, 0) and old_lock.get(chapter_id) not in (-1, 0)]
+        if chapter_ids:
+            CrawlJob.enqueue('chapter.warm', shelf.web_url, {
+                'shelf_id': shelf.id, 'book_id': book_id, 'chapter_ids': chapter_ids[-JOB_CHAPTER_WARM_LIMIT:]
+            }, priority=CrawlJob.PRIORITY_LOW)
+
+    @classmethod
+    def find(cls, shelf, book_id):
+        """
+        从数据库获取该书架这本书的解锁状态, 数据过期时在后台刷新
+        :param shelf: 书架
+        :param book_id: 书籍id
+        :return: ChapterLock, 数据库中还没有时返回None
+        """
+        lock = cls.objects.select_related('book').filter(
+            shelf=shelf, book__web_url=shelf.web_url, book__book_id=book_id).first()
+        if lock is not None:
+            expired = timezone.now() - datetime.timedelta(seconds=BOOK_REFRESH_INTERVAL)
+            if lock.updated_at < expired or lock.book.updated_at < expired:
+                CrawlJob.enqueue('book.refresh', shelf.web_url, {'shelf_id': shelf.id, 'book_id': book_id},
+                                 dedup_key=f'book.refresh:{shelf.id}:{book_id}')
+        return lock
+
+    @classmethod
+    def load(cls, shelf, book_id):
+        """
+        获取书籍详情, 优先从数据库读取, 数据过期时在后台刷新
+        数据库中还没有该书架的这本书时直接请求原网站
+        :param shelf: 书架
+        :param book_id: 书籍id
+        :return: 书籍数据, 不支持的网站返回None
+        """
+        lock = cls.find(shelf, book_id)
+        if lock is None:
+            return cls.refresh(shelf, book_id)
+        return lock.to_data(shelf)
+
+    @classmethod
+    def load_spider(cls, shelf, book_id, chapter_id, spider):
+        """
+        爬虫中没有章节的解锁状态时(书籍详情由其他进程获取, 进程重启, 爬虫实例被淘汰), 从数据库读取该书架这本书的解锁状态
+        :param spider: 书架的爬虫, 同步或异步爬虫
+        :return:
+        """
+        if str(chapter_id) in spider.chapter_lock:
+            return
+        chapter_lock = cls.objects.filter(shelf=shelf, book__web_url=shelf.web_url, book__book_id=str(book_id)) \
+            .values_list('chapter_lock', flat=True).first()
+        if chapter_lock is not None:
+            spider.chapter_lock.update(json.loads(chapter_lock))
+
+    @classmethod
+    def unlock(cls, shelf, book_id, chapter_id):
+        """
+        订阅章节后更新该书架保存的解锁状态, 不修改更新时间, 不影响后台刷新
+        :return:
+        """
+        with transaction.atomic():
+            lock = cls.objects.select_for_update().filter(
+                shelf=shelf, book__web_url=shelf.web_url, book__book_id=str(book_id)).first()
+            if lock is None:
+                return
+            lock_map = lock.lock_map
+            if lock_map.get(str(chapter_id)) in (-1, 0):
+                return
+            lock_map[str(chapter_id)] = 0
+            cls.objects.filter(pk=lock.pk).update(chapter_lock=json.dumps(lock_map))
+
+    @property
+    def etag(self):
+        """
+        书籍详情的ETag, 由书籍(包括目录)的内容摘要与解锁状态计算, 只在内容变化时改变, 不需要读取目录
+        """
+        return make_etag('book', self.book_id, self.book.digest, self.chapter_lock)
+
+    def update_spider(self, shelf):
+        """
+        把解锁状态交给爬虫, 爬虫根据解锁状态判断能否使用章节存储
+        :return: 解锁状态
+        """
+        lock_map = self.lock_map
+        spider = shelf.get_spider(login=False)
+        if spider:
+            spider.chapter_lock.update(lock_map)
+        return lock_map
+
+    def to_data(self, shelf):
+        return self.book.to_data(self.update_spider(shelf))
+
+    class Meta:
+        verbose_name = '章节解锁状态'
+        verbose_name_plural = verbose_name
+        unique_together = ('shelf', 'book')
+
+
+# 书架快照, 保存书架中的书籍与最新章节, 由后台刷新
+class ShelfSnapshot(models.Model):
+    shelf = models.OneToOneField('Shelf', on_delete=models.CASCADE, related_name='snapshot')
+    books = models.TextField(verbose_name='书籍', default='{}')
+    version = models.PositiveIntegerField(verbose_name='版本', default=0)
+    updated_at = models.DateTimeField(verbose_name='更新时间', auto_now=True)
+
+    @property
+    def book_map(self):
+        return json.loads(self.books)
+
+    @property
+    def is_stale(self):
+        return self.updated_at < timezone.now() - datetime.timedelta(seconds=SHELF_REFRESH_INTERVAL)
+
+    @classmethod
+    def refresh(cls, shelf):
+        """
+        从原网站获取书架中的书籍并保存, 书籍有变化时版本号加一
+        :param shelf: 书架
+        :return: 快照, 不支持的网站返回None
+        """
+        spider = shelf.spider
+        if not spider:
+            return None
+        return cls.merge(shelf, spider.get_shelf())
+
+    @classmethod
+    def merge(cls, shelf, books):
+        """
+        保存爬虫获取的书架中的书籍, 书籍有变化时版本号加一
+        :param shelf: 书架
+        :param books: get_shelf返回的书籍
+        :return: 快照
+        """
+        books = json.dumps(books, ensure_ascii=False, sort_keys=True)
+        snapshot, created = cls.objects.get_or_create(shelf=shelf, defaults={'books': books, 'version': 1})
+        if not created:
+            if snapshot.books != books:
+                snapshot.books = books
+                snapshot.version += 1
+            snapshot.save()
+        shelf.snapshot = snapshot
+        return snapshot
+
+    @classmethod
+    def refresh_in_background(cls, shelf):
+        return CrawlJob.enqueue('shelf.refresh', shelf.web_url, {'shelf_id': shelf.id},
+                                dedup_key=f'shelf.refresh:{shelf.id}')
+
+    class Meta:
+        verbose_name = '书架快照'
+        verbose_name_plural = verbose_name
+
+
+# 后台任务队列, 由 python manage.py crawl_worker 执行
+class CrawlJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    statuses = (
+        (PENDING, '等待中'),
+        (RUNNING, '执行中'),
+        (FAILED, '已失败'),
+    )
+    # 优先级越大越先执行
+    PRIORITY_LOW = 0
+    PRIORITY_NORMAL = 5
+    PRIORITY_HIGH = 10
+
+    kind = models.CharField(verbose_name='任务类型', max_length=40)
+    site = models.URLField(verbose_name='目标网站', db_index=True)
+    payload = models.TextField(verbose_name='参数', default='{}')
+    dedup_key = models.CharField(verbose_name='去重标识', max_length=200, null=True, blank=True)
+    # 等待中的任务的去重标识, 开始执行或失败时清空, 同一个去重标识只能有一个等待中的任务
+    # (MySQL不支持带条件的唯一约束, 所以单独使用一个可以为空的唯一字段)
+    pending_key = models.CharField(verbose_name='等待中的去重标识', max_length=200, null=True, blank=True,
+                                   unique=True)
+    priority = models.SmallIntegerField(verbose_name='优先级', default=PRIORITY_NORMAL)
+    status = models.CharField(verbose_name='状态', max_length=10, choices=statuses, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(verbose_name='执行次数', default=0)
+    max_attempts = models.PositiveSmallIntegerField(verbose_name='最多执行次数', default=JOB_MAX_ATTEMPTS)
+    run_at = models.DateTimeField(verbose_name='执行时间', default=timezone.now)
+    locked_at = models.DateTimeField(verbose_name='开始执行时间', null=True, blank=True)
+    worker = models.CharField(verbose_name='执行者', max_length=100, blank=True, default='')
+    last_error = models.TextField(verbose_name='错误信息', blank=True, default='')
+    created_at = models.DateTimeField(verbose_name='创建时间', auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.kind}({self.id})'
+
+    @property
+    def payload_data(self):
+        return json.loads(self.payload)
+
+    @staticmethod
+    def get_site_concurrency(site):
+        return JOB_SITE_CONCURRENCY.get(site, JOB_DEFAULT_CONCURRENCY)
+
+    @classmethod
+    def enqueue(cls, kind, site, payload=None, priority=PRIORITY_NORMAL, dedup_key=None,
+                max_attempts=JOB_MAX_ATTEMPTS, delay=0):
+        """
+        添加任务, 已有相同dedup_key的任务在等待时不再添加, 而是取两者中更高的优先级与更早的执行时间
+        :param kind: 任务类型, 对应 Novel_Server/utils/jobs.py 中注册的处理函数
+        :param site: 目标网站, 用来限制每个网站同时执行的任务数
+        :param payload: 任务参数
+        :param priority: 优先级
+        :param dedup_key: 去重标识
+        :param max_attempts: 最多执行次数
+        :param delay: 延迟执行的秒数
+        :return: 任务
+        """
+        run_at = timezone.now() + datetime.timedelta(seconds=delay)
+        dedup_key = dedup_key or None
+        if dedup_key:
+            job = cls.merge_pending(dedup_key, priority, run_at)
+            if job:
+                return job
+        try:
+            with transaction.atomic():
+                return cls.objects.create(kind=kind, site=site, payload=json.dumps(payload or {}),
+                                          priority=priority, dedup_key=dedup_key, pending_key=dedup_key,
+                                          max_attempts=max_attempts, run_at=run_at)
+        except IntegrityError:
+            # 其他请求同时添加了相同的任务
+            return cls.merge_pending(dedup_key, priority, run_at)
+
+    @classmethod
+    def merge_pending(cls, dedup_key, priority, run_at):
+        pending = cls.objects.filter(pending_key=dedup_key)
+        if pending.update(priority=Greatest('priority', priority), run_at=Least('run_at', run_at)):
+            return pending.first()
+        return None
+
+    @classmethod
+    def claim(cls, worker):
+        """
+        取出一个可以执行的任务, 已达到并发上限的网站的任务会被跳过
+        :param worker: 执行者名称
+        :return: 任务, 没有可以执行的任务时返回None
+        """
+        now = timezone.now()
+        running = dict(cls.objects.filter(status=cls.RUNNING).order_by()
+                       .values_list('site').annotate(count=Count('id')))
+        full = [site for site, count in running.items() if count >= cls.get_site_concurrency(site)]
+        with transaction.atomic():
+            job = cls.objects.select_for_update(skip_locked=True).filter(
+                status=cls.PENDING, run_at__lte=now).exclude(site__in=full).order_by(
+                '-priority', 'run_at', 'id').first()
+            if job is None:
+                return None
+            # 不支持select_for_update的数据库(sqlite)通过状态条件保证只有一个执行者能取到任务
+            # 开始执行后可以再添加相同的任务
+            claimed = cls.objects.filter(pk=job.pk, status=cls.PENDING).update(
+                status=cls.RUNNING, pending_key=None, worker=worker, locked_at=now, attempts=F('attempts') + 1)
+        if not claimed:
+            return None
+        # 多个执行者同时取到同一网站的任务时可能超过并发上限, 超出时放回队列
+        if cls.objects.filter(site=job.site, status=cls.RUNNING).count() > cls.get_site_concurrency(job.site):
+            job.requeue(attempts=F('attempts') - 1)
+            return None
+        job.refresh_from_db()
+        return job
+
+    def requeue(self, **kwargs):
+        """
+        把执行中的任务放回队列
+        放回之前已经添加了相同的等待中的任务时, 由那个任务执行, 这个任务直接删除
+        :param kwargs: 同时修改的其他字段
+        :return: 是否放回了队列
+        """
+        running = CrawlJob.objects.filter(pk=self.pk, status=self.RUNNING)
+        try:
+            with transaction.atomic():
+                return bool(running.update(status=self.PENDING, pending_key=self.dedup_key,
+                                           locked_at=None, worker='', **kwargs))
+        except IntegrityError:
+            running.delete()
+            return False
+
+    @classmethod
+    def release_stale(cls):
+        """
+        把执行超时的任务放回队列
+        :return: 放回的任务数
+        """
+        expired = timezone.now() - datetime.timedelta(seconds=JOB_LOCK_TIMEOUT)
+        jobs = cls.objects.filter(status=cls.RUNNING, locked_at__lt=expired).only('id', 'status', 'dedup_key')
+        return sum(job.requeue() for job in jobs)
+
+    def finish(self):
+        # 完成的任务直接删除, 只保留失败的任务用于排查
+        self.delete()
+
+    def fail(self, error, retry=True):
+        """
+        任务执行失败, 还有执行次数时延迟重试, 否则标记为失败
+        :param error: 错误信息
+        :param retry: 是否可以重试
+        """
+        self.last_error = error
+        self.locked_at = None
+        if retry and self.attempts < self.max_attempts:
+            self.status = self.PENDING
+            self.pending_key = self.dedup_key
+            self.run_at = timezone.now() + datetime.timedelta(seconds=JOB_RETRY_DELAY * 2 ** (self.attempts - 1))
+        else:
+            self.status = self.FAILED
+            self.pending_key = None
+        try:
+            with transaction.atomic():
+                self.save()
+        except IntegrityError:
+            # 执行期间已经添加了相同的任务, 这次不再重试
+            self.status = self.FAILED
+            self.pending_key = None
+            self.save()
+
+    class Meta:
+        verbose_name = '后台任务'
+        verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=('status', 'run_at')),
+        ]
+
+
+# 章节文本的压缩字典, 由 python manage.py train_chapter_dict 训练生成
+# 已保存的章节记录了压缩时使用的版本, 所以旧版本不能删除
+class CompressionDictionary(models.Model):
+    version = models.PositiveIntegerField(verbose_name='版本', unique=True)
+    data = models.BinaryField(verbose_name='字典')
+    sample_count = models.PositiveIntegerField(verbose_name='样本数', default=0)
+    created_at = models.DateTimeField(verbose_name='创建时间', auto_now_add=True)
+
+    def __str__(self):
+        return f'v{self.version}'
+
+    @classmethod
+    def create(cls, data, sample_count):
+        """
+        保存新训练的字典, 版本号为当前最大版本加一
+        :param data: 字典
+        :param sample_count: 训练使用的样本数
+        :return: 字典对象
+        """
+        while True:
+            version = (cls.objects.aggregate(version=Max('version'))['version'] or 0) + 1
+            try:
+                with transaction.atomic():
+                    return cls.objects.create(version=version, data=data, sample_count=sample_count)
+            except IntegrityError:
+                # 同时训练了其他字典, 使用下一个版本号
+                continue
+
+    class Meta:
+        verbose_name = '压缩字典'
+        verbose_name_plural = verbose_name
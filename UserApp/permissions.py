@@ -4,12 +4,66 @@ from rest_framework import permissions
 from UserApp.models import NovelUser, Shelf
 
 
+def get_shelves(request, shelf_id=None, select_related=()):
+    """
+    获取当前用户的书架, 有shelf_id时只返回该书架, 否则返回用户的所有书架
+    结果保存在请求中, 权限验证与视图共用, 同一个请求中相同的参数只查询一次
+    :param request: 请求
+    :param shelf_id: 书架id
+    :param select_related: 需要一起查询的关联对象, 如书架快照
+    :return: 书架列表, 没有或shelf_id不合法时为空列表
+    """
+    cache = getattr(request, '_shelf_cache', None)
+    if cache is None:
+        cache = request._shelf_cache = {}
+    select_related = tuple(select_related)
+    key = (str(shelf_id) if shelf_id else None, select_related)
+    if key in cache:
+        return cache[key]
+    if key[0] is not None and (None, select_related) in cache:
+        # 已经查询过所有书架时直接从中查找
+        shelves = [shelf for shelf in cache[(None, select_related)] if str(shelf.id) == key[0]]
+    else:
+        # 通过用户的关联管理器查询, 书架的user直接使用request.user, 不需要再查询
+        shelf_set = request.user.user_shelf.all()
+        if select_related:
+            shelf_set = shelf_set.select_related(*select_related)
+        try:
+            shelves = list(shelf_set.filter(id=shelf_id) if shelf_id else shelf_set)
+        except (TypeError, ValueError):
+            shelves = []
+    cache[key] = shelves
+    return shelves
+
+
+def get_shelf(request, shelf_id):
+    """
+    获取当前用户的一个书架
+    :return: 书架, 没有传入shelf_id或不是该用户的书架时返回None
+    """
+    if not shelf_id:
+        return None
+    shelves = get_shelves(request, shelf_id)
+    return shelves[0] if shelves else None
+
+
 class IsOwnerToShelf(permissions.BasePermission):
     message = '没找到对应书架呢'
 
     def has_permission(self, request, view):
         if request.user and request.user.is_authenticated:
             shelf_id = request.data.get('shelf_id', None)
-            if request.user.user_shelf.filter(id=shelf_id):
+            if get_shelf(request, shelf_id) is not None:
                 return True
         return False
+
+
+class IsOwnerToShelfOrAll(IsOwnerToShelf):
+    """
+    没有传入shelf_id时表示用户的所有书架, 只需要登录
+    """
+
+    def has_permission(self, request, view):
+        if request.user and request.user.is_authenticated and not request.data.get('shelf_id', None):
+            return True
+        return super().has_permission(request, view)
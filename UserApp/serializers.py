@@ -2,7 +2,8 @@
 # 每天都要有好心情
 from rest_framework.serializers import ModelSerializer, SerializerMethodField
 
-from UserApp.models import NovelUser, Shelf
+from Novel_Server.utils.etags import make_weak_etag
+from UserApp.models import NovelUser, Shelf, ShelfSnapshot
 
 
 class NovelUserSerializer(ModelSerializer):
@@ -12,19 +13,68 @@ class NovelUserSerializer(ModelSerializer):
 
 
 class ShelfSerializer(ModelSerializer):
+    """
+    书架中的书籍来自书架快照, 不会请求原网站
+    快照不存在或已过期时 stale 为True, 并在后台刷新快照
+    """
     user = NovelUserSerializer(read_only=True)
     books = SerializerMethodField('get_books')
+    version = SerializerMethodField('get_version')
+    updated_at = SerializerMethodField('get_updated_at')
+    stale = SerializerMethodField('get_stale')
 
     class Meta:
         model = Shelf
         fields = ('user', 'id', 'shelf_title', 'web_url', 'books',
-                  'account')
+                  'account', 'version', 'updated_at', 'stale')
 
-    def get_books(self, obj: Shelf):
-        data = None
+    @staticmethod
+    def get_snapshot(obj: Shelf):
         try:
-            if obj.spider:
-                data = obj.spider.get_shelf()
-        except ValueError as e:
-            raise e
-        return data
+            return obj.snapshot
+        except ShelfSnapshot.DoesNotExist:
+            return None
+
+    @classmethod
+    def get_etag(cls, shelf_set):
+        """
+        返回数据的弱ETag, 由用户, 书架与快照的版本计算, 不需要读取快照中的书籍
+        快照的版本只在书籍变化时增加, 快照的更新时间与是否过期(updated_at, stale)不影响ETag
+        """
+        parts = []
+        for obj in shelf_set:
+            snapshot = cls.get_snapshot(obj)
+            user = obj.user
+            parts.append((user.username, user.nickname, user.gender, user.email,
+                          obj.id, obj.shelf_title, obj.web_url, obj.account,
+                          snapshot.version if snapshot else 0))
+        return make_weak_etag('shelf', parts)
+
+    @classmethod
+    def refresh_stale(cls, shelf_set):
+        """
+        没有序列化(返回304)时同样在后台刷新过期的快照
+        """
+        for obj in shelf_set:
+            snapshot = cls.get_snapshot(obj)
+            if snapshot is None or snapshot.is_stale:
+                ShelfSnapshot.refresh_in_background(obj)
+
+    def get_books(self, obj: Shelf):
+        snapshot = self.get_snapshot(obj)
+        return snapshot.book_map if snapshot else None
+
+    def get_version(self, obj: Shelf):
+        snapshot = self.get_snapshot(obj)
+        return snapshot.version if snapshot else 0
+
+    def get_updated_at(self, obj: Shelf):
+        snapshot = self.get_snapshot(obj)
+        return snapshot.updated_at if snapshot else None
+
+    def get_stale(self, obj: Shelf):
+        snapshot = self.get_snapshot(obj)
+        stale = snapshot is None or snapshot.is_stale
+        if stale:
+            ShelfSnapshot.refresh_in_background(obj)
+        return stale
@@ -1,3 +1,818 @@
-from django.test import TestCase
+import asyncio
+import json
+import pickle
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from Novel_Server.utils.chapter_store import ChapterStore, LocalChapterCache
+from Novel_Server.utils.db_cache import ExpiryCullingDatabaseCache
+from Novel_Server.utils.compression import compress, decompress, train_dictionary, compress_text, \
+    decompress_text, DictionaryRegistry, DictionaryMissing
+from Novel_Server.utils import etags
+from Novel_Server.utils.gather import gather_shelves, local_or_gather, run_shelf_in_thread, STATUS_OK, \
+    STATUS_TIMEOUT
+from Novel_Server.utils.async_spiders import AsyncSpider_YouDu
+from Novel_Server.utils.page_cache import PageCache
+from Novel_Server.utils.paragraphs import PackedChapter
+from Novel_Server.utils.spiders import Spider_YouDu
+from Novel_Server.utils.throttle import SingleFlight, AsyncSingleFlight, TokenBucket
+from Novel_Server.utils.token_cache import token_cache
+from Novel_Server.utils.spiders_setting import JOB_RETRY_DELAY, JOB_LOCK_TIMEOUT
+from UserApp.models import NovelUser, CompressionDictionary, Shelf, ShelfSnapshot, ChapterLock, Book, CrawlJob
+
+
+class TokenCacheTests(TestCase):
+    """
+    已验证token缓存: 用户数据修改(NovelUser.save)后之前缓存的用户失效
+    """
+
+    def setUp(self):
+        # 使用进程内缓存, 不写入cache/auth
+        patcher = mock.patch.object(token_cache, 'alias', 'default')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        token_cache.cache.clear()
+        self.user = NovelUser.objects.create_user('reader', 'password', 'reader@example.com', 'reader')
+        self.token = 'token-' + self.user.username
+
+    def cache_user(self):
+        version = token_cache.get_version(self.user.username)
+        token_cache.set(self.token, time.time() + 60, NovelUser.objects.get(pk=self.user.pk), version)
+
+    def test_hit(self):
+        self.cache_user()
+        user = token_cache.get(self.token, self.user.username)
+        self.assertIsNotNone(user)
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertEqual(user.nickname, self.user.nickname)
+
+    def test_save_invalidates(self):
+        self.cache_user()
+        self.user.set_password('new-password')
+        self.user.save()
+        self.assertIsNone(token_cache.get(self.token, self.user.username))
+
+    def test_update_info_invalidates(self):
+        self.cache_user()
+        self.user.update_info({'nickname': 'renamed'})
+        self.assertIsNone(token_cache.get(self.token, self.user.username))
+        # 重新缓存后使用修改后的数据
+        self.cache_user()
+        self.assertEqual(token_cache.get(self.token, self.user.username).nickname, 'renamed')
+
+    def test_save_during_query(self):
+        # 查询用户期间用户被修改, 使用查询前的版本号缓存的数据不会被使用
+        version = token_cache.get_version(self.user.username)
+        user = NovelUser.objects.get(pk=self.user.pk)
+        self.user.is_active = False
+        self.user.save()
+        token_cache.set(self.token, time.time() + 60, user, version)
+        self.assertIsNone(token_cache.get(self.token, self.user.username))
+
+    def test_expired_token_not_cached(self):
+        version = token_cache.get_version(self.user.username)
+        token_cache.set(self.token, time.time() - 1, self.user, version)
+        self.assertIsNone(token_cache.get(self.token, self.user.username))
+
+    def test_password_not_cached(self):
+        self.cache_user()
+        snapshot = token_cache.cache.get(token_cache.make_key(self.token))
+        self.assertEqual(set(snapshot['user']), set(token_cache.fields))
+        self.assertNotIn(self.user.password, str(snapshot))
+        # 没有缓存的字段在使用时从数据库读取, 修改后只保存已加载的字段
+        user = token_cache.get(self.token, self.user.username)
+        with self.assertNumQueries(1):
+            self.assertTrue(user.check_password('password'))
+        user.update_info({'gender': '女'})
+        user = NovelUser.objects.get(pk=self.user.pk)
+        self.assertEqual(user.gender, '女')
+        self.assertTrue(user.check_password('password'))
+
+    def test_queryset_update_invalidates(self):
+        self.cache_user()
+        NovelUser.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertIsNone(token_cache.get(self.token, self.user.username))
+
+    def test_delete_invalidates(self):
+        self.cache_user()
+        NovelUser.objects.filter(pk=self.user.pk).delete()
+        self.assertIsNone(token_cache.get(self.token, self.user.username))
+
+
+class SingleFlightTests(SimpleTestCase):
+    """
+    同时进行的相同调用只执行一次, 结果与异常由所有调用共用
+    """
+
+    def run_concurrently(self, flight, key, func, count=8):
+        results, errors = [], []
+
+        def call():
+            try:
+                results.append(flight.do(key, func))
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        return results, errors
+
+    def test_concurrent_calls_share_result(self):
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def func():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'data'
+        leader = threading.Thread(target=flight.do, args=('key', func))
+        leader.start()
+        started.wait(5)
+        # 第一个调用执行期间发起的调用等待它的结果
+        threading.Timer(0.2, release.set).start()
+        results, errors = self.run_concurrently(flight, 'key', func)
+        leader.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['data'] * 8)
+        self.assertEqual(errors, [])
+
+    def test_error_shared_and_not_cached(self):
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+
+        def fail():
+            started.set()
+            release.wait(5)
+            raise ValueError('无法登录')
+        leader = threading.Thread(target=self.assertRaises, args=(ValueError, flight.do, 'key', fail))
+        leader.start()
+        started.wait(5)
+        threading.Timer(0.2, release.set).start()
+        results, errors = self.run_concurrently(flight, 'key', fail, count=4)
+        leader.join(5)
+        self.assertEqual(results, [])
+        self.assertEqual([str(e) for e in errors], ['无法登录'] * 4)
+        # 调用结束后不保留结果, 下一次调用重新执行
+        self.assertEqual(flight.do('key', lambda: 'retry'), 'retry')
+
+    def test_different_keys(self):
+        flight = SingleFlight()
+        self.assertEqual(flight.do('a', lambda: 1), 1)
+        self.assertEqual(flight.do('b', lambda: 2), 2)
+
+    def test_async(self):
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def func():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 'data'
+
+        async def main():
+            return await asyncio.gather(*(flight.do('key', func) for _ in range(8)))
+        self.assertEqual(asyncio.run(main()), ['data'] * 8)
+        self.assertEqual(len(calls), 1)
+
+    def test_async_cancelled_leader(self):
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def func():
+            calls.append(1)
+            await asyncio.sleep(0.2)
+            return 'data'
+
+        async def run(delay, timeout):
+            await asyncio.sleep(delay)
+            try:
+                return await asyncio.wait_for(flight.do('key', func), timeout)
+            except asyncio.TimeoutError:
+                return 'timeout'
+
+        async def main():
+            return await asyncio.gather(run(0, 0.05), run(0.01, 5))
+        # 第一个调用超时被取消, 等待同一结果的调用仍然拿到结果
+        self.assertEqual(asyncio.run(main()), ['timeout', 'data'])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight._calls, {})
+
+
+class TokenBucketTests(SimpleTestCase):
+    """
+    令牌桶: 令牌用完后预支令牌, 返回按先后顺序递增的等待时间
+    """
+
+    def setUp(self):
+        self.now = 100.0
+        patcher = mock.patch('Novel_Server.utils.throttle.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst(self):
+        bucket = TokenBucket(rate=2, burst=3)
+        self.assertEqual([bucket.reserve() for _ in range(3)], [0, 0, 0])
+        # 令牌用完后每个请求多等待1/rate秒
+        self.assertEqual([bucket.reserve() for _ in range(3)], [0.5, 1.0, 1.5])
+
+    def test_refill(self):
+        bucket = TokenBucket(rate=2, burst=3)
+        for _ in range(3):
+            bucket.reserve()
+        self.now += 1
+        self.assertEqual([bucket.reserve() for _ in range(3)], [0, 0, 0.5])
+
+    def test_refill_capped_at_burst(self):
+        bucket = TokenBucket(rate=2, burst=3)
+        self.now += 60
+        self.assertEqual([bucket.reserve() for _ in range(4)], [0, 0, 0, 0.5])
+
+    def test_acquire_sleeps(self):
+        bucket = TokenBucket(rate=4, burst=1)
+        with mock.patch('Novel_Server.utils.throttle.time.sleep') as sleep:
+            bucket.acquire()
+            sleep.assert_not_called()
+            bucket.acquire()
+            sleep.assert_called_once_with(0.25)
+
+
+def make_chapter(count=5):
+    return {
+        'chapter_id': '1001',
+        'book_id': '10',
+        'title': '第一章',
+        'FontCount': 100,
+        'btns': {'prev_btn': None, 'next_btn': '1002'},
+        'content': [{'index': i * 2 + 1, 'content': f'第{i}段', 'tsukkomi': i} for i in range(count)],
+    }
+
+
+class PackedChapterTests(SimpleTestCase):
+    """
+    章节紧凑格式: 与parse_chapter_data格式互相转换, 按paragraph_index范围读取段落
+    """
+
+    def test_round_trip(self):
+        data = make_chapter()
+        chapter = PackedChapter.pack(data)
+        self.assertEqual(len(chapter), 5)
+        self.assertEqual(chapter.to_data(), data)
+        self.assertIs(PackedChapter.pack(chapter), chapter)
+
+    def test_pickle(self):
+        chapter = PackedChapter.pack(make_chapter())
+        restored = pickle.loads(pickle.dumps(chapter))
+        self.assertEqual(restored.to_data(), chapter.to_data())
+        self.assertEqual(restored.digest(), chapter.digest())
+
+    def test_slice(self):
+        chapter = PackedChapter.pack(make_chapter())
+        data = chapter.to_data(3, 7)
+        # 段落索引为1, 3, 5, 7, 9
+        self.assertEqual([line['index'] for line in data['content']], [3, 5, 7])
+        self.assertEqual(data['content'][0], {'index': 3, 'content': '第1段', 'tsukkomi': 1})
+        self.assertEqual((data['paragraph_count'], data['start'], data['end']), (5, 3, 7))
+        # 范围的端点不需要是已有的段落索引
+        self.assertEqual([line['index'] for line in chapter.paragraphs(4, None)], [5, 7, 9])
+        self.assertEqual([line['index'] for line in chapter.paragraphs(None, 2)], [1])
+        self.assertEqual(chapter.paragraphs(10, 20), [])
+        self.assertEqual(chapter.paragraphs(7, 3), [])
+
+    def test_tsukkomi_count(self):
+        chapter = PackedChapter.pack(make_chapter())
+        self.assertEqual(chapter.tsukkomi_count(5), 2)
+        self.assertIsNone(chapter.tsukkomi_count(4))
+
+    def test_unordered_paragraphs(self):
+        data = make_chapter()
+        shuffled = dict(data, content=[data['content'][i] for i in (3, 0, 4, 2, 1)])
+        chapter = PackedChapter.pack(shuffled)
+        self.assertEqual(chapter.to_data(), data)
+        self.assertEqual([line['index'] for line in chapter.paragraphs(3, 7)], [3, 5, 7])
+        self.assertEqual(chapter.tsukkomi_count(7), 3)
+        self.assertEqual(chapter.digest(), PackedChapter.pack(data).digest())
+
+    def test_without_content(self):
+        data = make_chapter()
+        del data['content']
+        chapter = PackedChapter.pack(data)
+        self.assertFalse(chapter.has_content())
+        self.assertEqual(chapter.to_data(), data)
+        self.assertIsNone(chapter.get('content'))
+
+    def test_digest(self):
+        data = make_chapter()
+        digest = PackedChapter.pack(data).digest()
+        self.assertEqual(PackedChapter.pack(make_chapter()).digest(), digest)
+        data['content'][0]['tsukkomi'] += 1
+        self.assertNotEqual(PackedChapter.pack(data).digest(), digest)
+
+
+def make_text(seed):
+    return ''.join(f'第{seed}章的第{i}段, 少年握紧了手中的长剑, 望向远处的群山。' for i in range(20))
+
+
+class CompressionTests(TestCase):
+    """
+    章节文本压缩: 使用训练的字典压缩与解压, 字典不存在时无法解压
+    """
+
+    def setUp(self):
+        # 每个测试使用新的字典注册表, 不影响其他测试
+        self.registry = DictionaryRegistry()
+        patcher = mock.patch('Novel_Server.utils.compression.registry', self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.zdict = train_dictionary([make_text(i) for i in range(10)])
+
+    def test_trained_dictionary(self):
+        data = make_text(99).encode()
+        compressed = compress(data, self.zdict)
+        self.assertEqual(decompress(compressed, self.zdict), data)
+        self.assertLess(len(compressed), len(compress(data)))
+
+    def test_text_round_trip(self):
+        CompressionDictionary.create(self.zdict, 10)
+        text = make_text(99)
+        version, data = compress_text(text)
+        self.assertEqual(version, 1)
+        self.assertEqual(decompress_text(version, data), text)
+        # 其他进程(新的注册表)从数据库加载字典后可以解压
+        with mock.patch('Novel_Server.utils.compression.registry', DictionaryRegistry()):
+            self.assertEqual(decompress_text(version, data), text)
+
+    def test_short_text_not_compressed(self):
+        self.assertEqual(compress_text('短文本'), (None, '短文本'))
+        self.assertEqual(decompress_text(None, '短文本'), '短文本')
+
+    def test_missing_dictionary(self):
+        self.registry.add(7, self.zdict)
+        version, data = compress_text(make_text(99))
+        with mock.patch('Novel_Server.utils.compression.registry', DictionaryRegistry()):
+            with self.assertRaises(DictionaryMissing):
+                decompress_text(version, data)
+
+    def test_store_with_missing_dictionary(self):
+        # 共享存储中使用了不存在的字典的章节当作没有保存
+        self.registry.add(7, self.zdict)
+        local = LocalChapterCache(10)
+        store = ChapterStore('https://www.youdubook.com/', shared_alias='default', local=local)
+        data = make_chapter()
+        data['content'] = [{'index': 1, 'content': make_text(99), 'tsukkomi': 0}]
+        store.set('1001', data)
+        local.clear()
+        with mock.patch('Novel_Server.utils.compression.registry', DictionaryRegistry()):
+            self.assertIsNone(store.get('1001'))
+        self.assertIsNone(store.shared.get(store.make_key('1001')))
+
+
+class ChapterStoreTests(SimpleTestCase):
+    """
+    章节存储: 进程内缓存保存章节对象, 只有共享存储保存压缩后的数据
+    """
+
+    def setUp(self):
+        self.local = LocalChapterCache(2)
+        self.store = ChapterStore('https://www.youdubook.com/', shared_alias='default', local=self.local)
+        self.store.shared.clear()
+
+    def test_local_holds_objects(self):
+        self.store.set('1001', make_chapter())
+        chapter = self.store.get('1001')
+        self.assertIsInstance(chapter, PackedChapter)
+        self.assertIs(self.store.get('1001'), chapter)
+
+    def test_shared_fallback(self):
+        self.store.set('1001', make_chapter())
+        self.local.clear()
+        self.assertEqual(self.store.get('1001').to_data(), make_chapter())
+        self.assertEqual(len(self.local), 1)
+
+    def test_pickle_does_not_compress(self):
+        with mock.patch('Novel_Server.utils.paragraphs.compress_text') as compress_text_:
+            pickle.dumps(PackedChapter.pack(make_chapter()))
+        compress_text_.assert_not_called()
+
+    def test_local_lru(self):
+        for chapter_id in ('1', '2'):
+            self.local.set(chapter_id, chapter_id, 60)
+        self.local.get('1')
+        self.local.set('3', '3', 60)
+        self.assertIsNone(self.local.get('2'))
+        self.assertEqual((self.local.get('1'), self.local.get('3')), ('1', '3'))
+
+    def test_local_expire(self):
+        self.local.set('1', '1', 0)
+        self.assertIsNone(self.local.get('1'))
+
+
+def make_book(locks=(-1, 0, 1)):
+    chapters = [{'chapter_id': str(100 + i), 'chapter_title': f'第{i + 1}章', 'is_lock': lock}
+                for i, lock in enumerate(locks)]
+    return {
+        'book_title': '测试之书',
+        'book_author': '作者',
+        'book_cover': 'https://img.youdubook.com/cover/10.jpg',
+        'book_label': ['玄幻'],
+        'book_fonts': '1万',
+        'book_click': '100',
+        'book_favo': '10',
+        'book_reward': {},
+        'book_disc': '简介',
+        'book_volume_list': [{'volume_name': '第一卷', 'chapter_list': chapters}],
+        'chapter_lock': {chapter['chapter_id']: chapter['is_lock'] for chapter in chapters},
+    }
+
+
+class LoginTestCase(TestCase):
+    """
+    登录一个有书架的用户, 通过token调用接口
+    """
+
+    def setUp(self):
+        patcher = mock.patch.object(token_cache, 'alias', 'default')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        user = NovelUser.objects.create_user('reader', 'password', 'reader@example.com', 'reader')
+        self.shelf = Shelf.objects.create(user=user, account='account', password='password', web_url=Shelf.URL_YouDu)
+        response = self.client.post('/api/user/login/', {'username': 'reader', 'password': 'password'})
+        self.token = response.json()['token']
+
+    def request(self, method, path, params=None, etag=None):
+        headers = {'HTTP_AUTHORIZATION': self.token}
+        if etag:
+            headers['HTTP_IF_NONE_MATCH'] = etag
+        return self.client.generic(method, path, json.dumps(params or {}), content_type='application/json', **headers)
+
+    def get(self, path, params=None, etag=None):
+        return self.request('GET', path, params, etag)
+
+
+class ETagTests(LoginTestCase):
+    """
+    书架与书籍详情的ETag只在内容变化时改变, If-None-Match匹配时返回304
+    """
+
+    def test_shelf(self):
+        ShelfSnapshot.merge(self.shelf, {'测试之书': {'title': '测试之书'}})
+        response = self.get('/api/shelf/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        self.assertEqual(self.get('/api/shelf/', etag=etag).status_code, 304)
+        # 书籍没有变化时只更新快照的更新时间, ETag不变
+        ShelfSnapshot.merge(self.shelf, {'测试之书': {'title': '测试之书'}})
+        self.assertEqual(self.get('/api/shelf/', etag=etag).status_code, 304)
+        # 快照过期时仍然返回304, 并在后台刷新
+        ShelfSnapshot.objects.filter(shelf=self.shelf).update(updated_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(self.get('/api/shelf/', etag=etag).status_code, 304)
+        ShelfSnapshot.merge(self.shelf, {'另一本书': {'title': '另一本书'}})
+        response = self.get('/api/shelf/', etag=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_book(self):
+        params = {'shelf_id': self.shelf.id, 'book_id': '10'}
+        ChapterLock.merge(self.shelf, '10', make_book())
+        response = self.get('/api/book/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['chapter_lock'], make_book()['chapter_lock'])
+        etag = response['ETag']
+        self.assertEqual(self.get('/api/book/', params, etag).status_code, 304)
+        # 再次刷新得到相同的数据时ETag不变
+        ChapterLock.merge(self.shelf, '10', make_book())
+        self.assertEqual(self.get('/api/book/', params, etag).status_code, 304)
+        # 解锁了新的章节
+        ChapterLock.merge(self.shelf, '10', make_book((-1, 0, 0)))
+        response = self.get('/api/book/', params, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_book_digest(self):
+        book = Book.merge(Shelf.URL_YouDu, '10', make_book())
+        # 不同书架的解锁状态不影响书籍的摘要, 内容没有变化时不重新写入目录
+        with self.assertNumQueries(2):
+            same = Book.merge(Shelf.URL_YouDu, '10', make_book((1, 1, 1)))
+        self.assertEqual(same.digest, book.digest)
+        self.assertGreaterEqual(same.updated_at, book.updated_at)
+        data = make_book()
+        data['book_volume_list'][0]['chapter_list'][0]['chapter_title'] = '新标题'
+        self.assertNotEqual(Book.merge(Shelf.URL_YouDu, '10', data).digest, book.digest)
+        self.assertEqual(Book.objects.get(pk=book.pk).chapters.get(chapter_id='100').title, '新标题')
+
+    def test_match(self):
+        request = mock.Mock(META={'HTTP_IF_NONE_MATCH': 'W/"abc", "def-gzip"'})
+        self.assertEqual(etags.match(request, '"def"'), '"def-gzip"')
+        self.assertEqual(etags.match(request, 'W/"abc"'), 'W/"abc"')
+        self.assertIsNone(etags.match(request, '"xyz"'))
+
+
+class ChapterLockTests(TestCase):
+    """
+    爬虫中没有解锁状态时从数据库读取, 订阅章节后更新保存的解锁状态
+    """
+
+    def setUp(self):
+        user = NovelUser.objects.create_user('reader', 'password', 'reader@example.com', 'reader')
+        self.shelf = Shelf.objects.create(user=user, account='account', password='password', web_url=Shelf.URL_YouDu)
+        ChapterLock.merge(self.shelf, '10', make_book())
+        # 模拟其他进程获取的书籍详情, 当前进程的爬虫还没有解锁状态
+        self.spider = self.shelf.get_spider(login=False)
+        self.spider.chapter_lock.clear()
+        self.addCleanup(self.spider.chapter_lock.clear)
+
+    def test_load_spider(self):
+        self.assertFalse(self.spider.can_read('101'))
+        with self.assertNumQueries(1):
+            ChapterLock.load_spider(self.shelf, '10', '101', self.spider)
+        self.assertTrue(self.spider.can_read('101'))
+        self.assertFalse(self.spider.can_read('102'))
+        # 已有解锁状态时不查询数据库
+        with self.assertNumQueries(0):
+            ChapterLock.load_spider(self.shelf, '10', '102', self.spider)
+
+    def test_load_spider_unknown_book(self):
+        ChapterLock.load_spider(self.shelf, '11', '101', self.spider)
+        self.assertEqual(self.spider.chapter_lock, {})
+
+    def test_buy_chapter(self):
+        ChapterLock.load_spider(self.shelf, '10', '102', self.spider)
+        self.spider.mark_bought('102', {'code': 0, 'msg': '余额不足'})
+        self.assertFalse(self.spider.can_read('102'))
+        self.spider.mark_bought('102', {'code': 1, 'msg': '操作成功'})
+        self.assertTrue(self.spider.can_read('102'))
+        lock = ChapterLock.objects.get(shelf=self.shelf)
+        ChapterLock.unlock(self.shelf, '10', '102')
+        unlocked = ChapterLock.objects.get(shelf=self.shelf)
+        self.assertEqual(unlocked.lock_map, {'100': -1, '101': 0, '102': 0})
+        self.assertNotEqual(unlocked.etag, lock.etag)
+        # 不修改更新时间, 后台仍然按时刷新
+        self.assertEqual(unlocked.updated_at, lock.updated_at)
+
+
+class MetricsTests(SimpleTestCase):
+    """
+    /metrics 只允许带有令牌的请求访问, 不按地址判断
+    """
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_without_token(self):
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+
+class CrawlJobTests(TestCase):
+    """
+    后台任务队列: 等待中的任务去重, 每个网站的并发上限, 失败重试与执行超时
+    """
+    # JOB_DEFAULT_CONCURRENCY为1的网站
+    site = Shelf.URL_QiDian
+
+    def enqueue(self, dedup_key=None, **kwargs):
+        return CrawlJob.enqueue('book.refresh', kwargs.pop('site', self.site), {'book_id': '10'},
+                                dedup_key=dedup_key, **kwargs)
+
+    def test_enqueue_merges_pending(self):
+        first = self.enqueue('book.refresh:1:10', delay=60)
+        second = self.enqueue('book.refresh:1:10', priority=CrawlJob.PRIORITY_HIGH)
+        self.assertEqual(CrawlJob.objects.count(), 1)
+        self.assertEqual(second.pk, first.pk)
+        # 取更高的优先级与更早的执行时间
+        self.assertEqual(second.priority, CrawlJob.PRIORITY_HIGH)
+        self.assertLess(second.run_at, first.run_at)
+        self.enqueue()
+        self.enqueue()
+        self.assertEqual(CrawlJob.objects.count(), 3)
+
+    def test_enqueue_after_claim(self):
+        self.enqueue('key')
+        job = CrawlJob.claim('worker')
+        self.assertIsNone(job.pending_key)
+        # 开始执行后可以再添加相同的任务
+        self.assertNotEqual(self.enqueue('key').pk, job.pk)
+
+    def test_claim_skips_full_site(self):
+        first = self.enqueue(priority=CrawlJob.PRIORITY_HIGH)
+        self.enqueue(priority=CrawlJob.PRIORITY_HIGH)
+        other = self.enqueue(site=Shelf.URL_ZongHeng, priority=CrawlJob.PRIORITY_LOW)
+        self.assertEqual(CrawlJob.claim('worker').pk, first.pk)
+        # 该网站已达到并发上限, 取优先级更低的其他网站的任务
+        self.assertEqual(CrawlJob.claim('worker').pk, other.pk)
+        self.assertIsNone(CrawlJob.claim('worker'))
+
+    def test_claim_over_concurrency_requeues(self):
+        job = self.enqueue('key')
+        # 其他执行者同时取到了同一网站的任务
+        with mock.patch.object(CrawlJob, 'get_site_concurrency', return_value=0):
+            self.assertIsNone(CrawlJob.claim('worker'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.pending_key, job.attempts), (CrawlJob.PENDING, 'key', 0))
+
+    def test_claim_skips_delayed(self):
+        self.enqueue(delay=60)
+        self.assertIsNone(CrawlJob.claim('worker'))
+
+    def test_requeue_with_pending_duplicate(self):
+        self.enqueue('key')
+        job = CrawlJob.claim('worker')
+        pending = self.enqueue('key')
+        # 已经有相同的等待中的任务, 执行中的任务直接删除
+        self.assertFalse(job.requeue())
+        self.assertEqual(list(CrawlJob.objects.values_list('pk', flat=True)), [pending.pk])
+
+    def test_fail_retries_with_backoff(self):
+        self.enqueue('key', max_attempts=2)
+        job = CrawlJob.claim('worker')
+        before = timezone.now()
+        job.fail('网络错误')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.pending_key, job.attempts), (CrawlJob.PENDING, 'key', 1))
+        self.assertGreaterEqual(job.run_at, before + timedelta(seconds=JOB_RETRY_DELAY))
+        self.assertIsNone(CrawlJob.claim('worker'))
+        CrawlJob.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        job = CrawlJob.claim('worker')
+        self.assertEqual(job.attempts, 2)
+        # 达到最多执行次数后不再重试
+        job.fail('网络错误')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.pending_key, job.last_error), (CrawlJob.FAILED, None, '网络错误'))
+        self.assertIsNone(CrawlJob.claim('worker'))
+
+    def test_fail_with_pending_duplicate(self):
+        self.enqueue('key')
+        job = CrawlJob.claim('worker')
+        self.enqueue('key')
+        job.fail('网络错误')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.pending_key), (CrawlJob.FAILED, None))
+
+    def test_release_stale(self):
+        self.enqueue('stale')
+        stale = CrawlJob.claim('worker')
+        self.enqueue('fresh', site=Shelf.URL_ZongHeng)
+        fresh = CrawlJob.claim('worker')
+        CrawlJob.objects.filter(pk=stale.pk).update(
+            locked_at=timezone.now() - timedelta(seconds=JOB_LOCK_TIMEOUT + 1))
+        self.assertEqual(CrawlJob.release_stale(), 1)
+        stale.refresh_from_db()
+        fresh.refresh_from_db()
+        self.assertEqual((stale.status, stale.pending_key, stale.worker, stale.locked_at),
+                         (CrawlJob.PENDING, 'stale', '', None))
+        self.assertEqual(fresh.status, CrawlJob.RUNNING)
+        self.assertEqual(CrawlJob.claim('worker').pk, stale.pk)
+
+
+class ShelfQueryTests(LoginTestCase):
+    """
+    每个请求最多查询一次书架, 权限验证与接口共用查询结果; 书架不存在时正常返回错误信息
+    """
+
+    def setUp(self):
+        super().setUp()
+        # 不请求原网站
+        self.spider = mock.Mock()
+        self.spider.get_wallet.return_value = {'balance': 100}
+        patcher = mock.patch.object(Shelf, 'get_spider', return_value=self.spider)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # 第一个请求缓存已验证的token, 之后的请求认证不查询数据库
+        self.get('/api/wallet/', {'shelf_id': self.shelf.id})
+
+    def test_wallet(self):
+        with self.assertNumQueries(1):
+            response = self.get('/api/wallet/', {'shelf_id': self.shelf.id})
+        self.assertEqual(response.json()['data'][str(self.shelf.id)]['wallet'], {'balance': 100})
+        with self.assertNumQueries(1):
+            response = self.get('/api/wallet/')
+        self.assertEqual(len(response.json()['data']), 1)
+
+    def test_wallet_missing_shelf(self):
+        with self.assertNumQueries(1):
+            response = self.get('/api/wallet/', {'shelf_id': self.shelf.id + 1})
+        self.assertEqual(response.status_code, 403)
+        # 不合法的书架id不查询数据库
+        with self.assertNumQueries(0):
+            response = self.get('/api/wallet/', {'shelf_id': 'abc'})
+        self.assertEqual(response.status_code, 403)
+
+    def test_shelf_post(self):
+        # 查询书架与保存书架
+        with self.assertNumQueries(2):
+            response = self.request('POST', '/api/shelf/', {'shelf_id': self.shelf.id, 'shelf_title': '新书架'})
+        self.assertEqual(response.json()['status'], 2000)
+        self.assertEqual(Shelf.objects.get(pk=self.shelf.pk).shelf_title, '新书架')
+
+    def test_shelf_post_missing_shelf(self):
+        with self.assertNumQueries(1):
+            response = self.request('POST', '/api/shelf/', {'shelf_id': self.shelf.id + 1, 'shelf_title': '新书架'})
+        self.assertEqual(response.status_code, 403)
+
+    def test_book(self):
+        ChapterLock.merge(self.shelf, '10', make_book())
+        params = {'shelf_id': self.shelf.id, 'book_id': '10'}
+        # 查询书架, 解锁状态(与书籍一起), 卷与章节
+        with self.assertNumQueries(4):
+            response = self.get('/api/book/', params)
+        self.assertEqual(response.json()['status'], 4000)
+        with self.assertNumQueries(2):
+            self.assertEqual(self.get('/api/book/', params, response['ETag']).status_code, 304)
+
+    def test_book_missing_shelf(self):
+        with self.assertNumQueries(1):
+            response = self.get('/api/book/', {'shelf_id': self.shelf.id + 1, 'book_id': '10'})
+        self.assertEqual(response.json()['status'], 4001)
+
+
+class AsyncWalletTests(SimpleTestCase):
+    """
+    异步爬虫与同步爬虫共用按账号缓存的钱包
+    """
+
+    def setUp(self):
+        patcher = mock.patch.object(Spider_YouDu, 'page_cache', PageCache('default'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.shelf = Shelf(id=10 ** 6, account='account', password='password', web_url=Shelf.URL_YouDu)
+        self.addCleanup(Spider_YouDu.page_cache.cache.clear)
+
+    def test_wallet_cache(self):
+        spider = AsyncSpider_YouDu(self.shelf)
+        spider._request = mock.AsyncMock(return_value=mock.Mock(text='<html></html>'))
+
+        async def main():
+            with mock.patch.object(AsyncSpider_YouDu, 'parse_wallet', side_effect=[{'balance': 1}, {'balance': 2}]):
+                return [await spider.get_wallet(), await spider.get_wallet(),
+                        await spider.get_wallet(fresh=True), await spider.get_wallet()]
+        self.assertEqual(asyncio.run(main()), [{'balance': 1}, {'balance': 1}, {'balance': 2}, {'balance': 2}])
+        self.assertEqual(spider._request.await_count, 2)
+        # 同步爬虫读取同一个缓存
+        self.assertEqual(Spider_YouDu.page_cache.cache.get(spider.get_wallet_key()), {'balance': 2})
+
+
+class GatherTests(SimpleTestCase):
+    """
+    多书架并发查询: 超时的书架单独返回超时状态, 本地数据与原网站数据的结果格式相同
+    """
+
+    @staticmethod
+    def make_shelf(shelf_id, web_url=Shelf.URL_YouDu):
+        spider = mock.Mock()
+        spider.get_rank.return_value = {'books': [shelf_id]}
+        return mock.Mock(id=shelf_id, shelf_title=f'书架{shelf_id}', web_url=web_url, spider=spider)
+
+    def test_gather(self):
+        slow = self.make_shelf(2)
+        slow.spider.get_rank.side_effect = lambda: time.sleep(0.5)
+        data = gather_shelves([self.make_shelf(1), slow], lambda spider: spider.get_rank(), 'rank', timeout=0.1)
+        self.assertEqual((data[1]['status'], data[1]['rank']), (STATUS_OK, {'books': [1]}))
+        self.assertEqual(data[2]['status'], STATUS_TIMEOUT)
+
+    def test_expired_in_queue(self):
+        # 在线程池中排队超过等待时间的书架不再请求原网站
+        shelf = self.make_shelf(1)
+        result = run_shelf_in_thread(shelf, lambda spider: spider.get_rank(), 'rank', time.monotonic() - 1)
+        self.assertEqual(result['status'], STATUS_TIMEOUT)
+        shelf.spider.get_rank.assert_not_called()
+
+    def test_local_or_gather(self):
+        shelves = [self.make_shelf(1), self.make_shelf(2, Shelf.URL_QiDian)]
+        data = local_or_gather(shelves, lambda site: {'books': []} if site == Shelf.URL_YouDu else None,
+                               lambda spider: spider.get_rank(), 'rank')
+        self.assertEqual(data[1], {'shelf_id': 1, 'shelf_title': '书架1', 'status': STATUS_OK, 'msg': 'ok',
+                                   'rank': {'books': []}})
+        self.assertEqual(data[2], {'shelf_id': 2, 'shelf_title': '书架2', 'status': STATUS_OK, 'msg': 'ok',
+                                   'rank': {'books': [2]}})
+
+
+class ExpiryCullingTests(TestCase):
+    """
+    章节存储的数据库缓存超出容量时淘汰最早过期(最久没有读取)的数据, 而不是按缓存键的顺序
+    """
+
+    def test_cull_by_expiry(self):
+        cache = ExpiryCullingDatabaseCache('novel_chapter_cache', {'OPTIONS': {'MAX_ENTRIES': 5, 'CULL_FREQUENCY': 2}})
+        cache.clear()
+        for key, timeout in (('a', 500), ('b', 400), ('c', 300), ('d', 200), ('e', 100)):
+            cache.set(key, key, timeout)
+        # 读取时续期
+        cache.touch('e', 1000)
+        cache.set('f', 'f', 600)
+        # 超出容量, 淘汰最早过期的一半(d, c, b), 按缓存键的顺序会淘汰a, b, c
+        cache.set('g', 'g', 700)
+        self.assertEqual(sorted(cache.get_many('abcdefg')), ['a', 'e', 'f', 'g'])
@@ -2,7 +2,7 @@
 # 每天都要有好心情
 from django.urls import path
 
-from UserApp import views
+from UserApp import views, async_views
 
 app_name = 'user'
 
@@ -15,6 +15,17 @@ urlpatterns = [
     path('rank/', views.RankView.as_view()),
     path('search/', views.SearchView.as_view()),
     path('book/', views.BookView.as_view()),
+    path('book/export/', views.BookExportView.as_view()),
     path('chapter/', views.ChapterView.as_view()),
-    path('lineComment/', views.LineCommentView.as_view())
+    path('lineComment/', views.LineCommentView.as_view()),
+    path('lineComment/batch/', views.LineCommentBatchView.as_view()),
+    # 异步接口, 需要通过asgi运行
+    path('async/shelf/', async_views.AsyncShelfView.as_view()),
+    path('async/wallet/', async_views.AsyncWalletView.as_view()),
+    path('async/rank/', async_views.AsyncRankView.as_view()),
+    path('async/search/', async_views.AsyncSearchView.as_view()),
+    path('async/book/', async_views.AsyncBookView.as_view()),
+    path('async/chapter/', async_views.AsyncChapterView.as_view()),
+    path('async/lineComment/', async_views.AsyncLineCommentView.as_view()),
+    path('async/lineComment/batch/', async_views.AsyncLineCommentBatchView.as_view()),
 ]
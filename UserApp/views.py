@@ -1,18 +1,24 @@
 import time
 import jwt
+from urllib.parse import quote
 from rest_framework.views import APIView
 from rest_framework.generics import GenericAPIView
 from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.contrib.auth import authenticate
+from django.http import StreamingHttpResponse
 
-from UserApp.models import NovelUser, Shelf
-from UserApp.permissions import IsOwnerToShelf
+from UserApp.models import NovelUser, Shelf, ChapterLock, ShelfSnapshot
+from UserApp.permissions import IsOwnerToShelf, IsOwnerToShelfOrAll, get_shelf, get_shelves
 from UserApp.serializers import ShelfSerializer, NovelUserSerializer
 from Novel_Server.settings import SECRET_KEY as key
+from Novel_Server.utils import etags
 from Novel_Server.utils.user_auth import TokenAuthentication
-from Novel_Server.utils.spiders import Spider_YouDu, SPIDERS
+from Novel_Server.utils.gather import gather_shelves, local_or_gather, summary_status
+from Novel_Server.utils.search_index import search_index
+from Novel_Server.utils.spiders_setting import CHAPTER_READ_AHEAD_MAX, LINE_COMMENT_BATCH_MAX
+from Novel_Server.utils.export import EXPORT_FORMATS, export_book
 
 
 # 登录api
@@ -153,7 +159,7 @@ class UserView(APIView):
 
 class PasswordView(APIView):
     authentication_classes = (TokenAuthentication, )
-    permissions_classes = (IsAuthenticated, )
+    permission_classes = (IsAuthenticated, )
 
     def post(self, request: Request):
         response = {
@@ -164,6 +170,8 @@ class PasswordView(APIView):
         new_password = request.data.get('new_password', None)
         if request.user.check_password(old_password):
             request.user.set_password(new_password)
+            # 保存时会使该用户已缓存的token失效
+            request.user.save()
             response['status'] = 1000
             response['msg'] = '修改密码成功'
         else:
@@ -172,9 +180,40 @@ class PasswordView(APIView):
         return Response(response)
 
 
-# 获取书架,如果有id就返回单个书架,否则返回用户的所有书架
-def get_shelf(request, shelf_id):
-    return request.user.user_shelf.all() if not shelf_id else request.user.user_shelf.filter(id=shelf_id)
+# 获取预读章节数, 不传或不合法时不预读, 最多预读 CHAPTER_READ_AHEAD_MAX 章
+def get_read_ahead(data):
+    try:
+        read_ahead = int(data.get('read_ahead', 0))
+    except (TypeError, ValueError):
+        return 0
+    return max(0, min(read_ahead, CHAPTER_READ_AHEAD_MAX))
+
+
+# 获取要返回的段落范围(paragraph_index), 不传或不合法时为None, 即不限制
+def get_paragraph_range(data):
+    paragraph_range = []
+    for name in ('start', 'end'):
+        try:
+            paragraph_range.append(int(data.get(name)))
+        except (TypeError, ValueError):
+            paragraph_range.append(None)
+    return paragraph_range
+
+
+# 获取段落索引列表, 可以是列表或逗号分隔的字符串, 忽略不合法的索引, 最多 LINE_COMMENT_BATCH_MAX 个
+def get_paragraph_indexes(data):
+    indexes = data.get('indexes') or []
+    if isinstance(indexes, str):
+        indexes = indexes.split(',')
+    result = []
+    for index in indexes:
+        try:
+            index = int(index)
+        except (TypeError, ValueError):
+            continue
+        if index not in result:
+            result.append(index)
+    return result[:LINE_COMMENT_BATCH_MAX]
 
 
 # 书架api get获取信息, put绑定书架, post修改书架信息
@@ -187,15 +226,27 @@ class ShelfView(GenericAPIView):
             'msg': None,
         }
         shelf_id = request.data.get('shelf_id')
-        shelf_set = get_shelf(request, shelf_id)
+        shelf_set = get_shelves(request, shelf_id, ('snapshot', ))
         if shelf_set:
-            try:
-                data = ShelfSerializer(shelf_set, many=True, context={'request': request}).data
-                response['msg'] = '获取书架信息成功'
-                response['data'] = data
-            except ValueError as e:
-                response['status'] = 2002
-                response['msg'] = str(e)
+            # 默认直接返回书架快照, 传入refresh时先从原网站更新快照
+            if request.data.get('refresh'):
+                result = gather_shelves(shelf_set, lambda spider: ShelfSnapshot.refresh(spider.shelf), 'snapshot')
+                response['status'], response['msg'] = summary_status(result)
+                # 使用更新后的快照, 不需要重新查询书架
+                for shelf in shelf_set:
+                    snapshot = result[shelf.id]['snapshot']
+                    if snapshot is not None:
+                        shelf.snapshot = snapshot
+            # 快照没有变化时返回304, 不需要序列化快照中的书籍
+            etag = etags.make_weak_etag(response['status'], response['msg'], ShelfSerializer.get_etag(shelf_set))
+            client_etag = etags.match(request, etag)
+            if client_etag:
+                ShelfSerializer.refresh_stale(shelf_set)
+                return etags.not_modified(client_etag)
+            data = ShelfSerializer(shelf_set, many=True, context={'request': request}).data
+            response['msg'] = response['msg'] or '获取书架信息成功'
+            response['data'] = data
+            return etags.set_etag(Response(response), etag)
         else:
             response['status'] = 2001
             response['msg'] = '还没有绑定书架!快去绑定一个吧!'
@@ -236,9 +287,9 @@ class ShelfView(GenericAPIView):
             'status': None,
             'msg': None
         }
-        shelf_id = request.data.get('shelf_id')
-        try:
-            shelf = Shelf.objects.get(id=shelf_id)
+        # 权限验证时已经获取了该书架
+        shelf = get_shelf(request, request.data.get('shelf_id'))
+        if shelf is not None:
             shelf.account = request.data.get('account', shelf.account)
             shelf.password = request.data.get('password', shelf.password)
             shelf.shelf_title = request.data.get('shelf_title', shelf.shelf_title)
@@ -246,7 +297,7 @@ class ShelfView(GenericAPIView):
             shelf.save()
             response['status'] = 2000
             response['msg'] = '修改书架信息成功!'
-        except Shelf.DoesNotExist:
+        else:
             response['status'] = '2001'
             response['msg'] = '未找到书架!'
         return Response(response)
@@ -269,33 +320,21 @@ class WalletView(APIView):
     get: 获取书架中的代币余额.
     """
     authentication_classes = (TokenAuthentication, )
-    permissions_classes = (IsOwnerToShelf, )
+    # 没有shelf_id时查询用户的所有书架
+    permission_classes = (IsOwnerToShelfOrAll, )
 
     def get(self, request):
         response = {
             'status': None,
             'msg': None
         }
-        data = dict()
-        shelf_id = request.data.get('shelf_id', None)
-        if not shelf_id:
-            shelf_set = request.user.user_shelf.all()
-        else:
-            shelf_set = request.user.user_shelf.filter(id=shelf_id)
-        try:
-            for shelf in shelf_set:
-                if shelf.spider:
-                    data[shelf.id] = {
-                        'shelf_id': shelf.id,
-                        'shelf_title': shelf.shelf_title,
-                        'wallet': shelf.spider.get_wallet()
-                    }
-            response['status'] = 2000
-            response['msg'] = '获取钱包信息成功!'
-            response['data'] = data
-        except ValueError as e:
-            response['status'] = 2002
-            response['msg'] = str(e)
+        # 与权限验证使用同一次查询的结果
+        shelf_set = get_shelves(request, request.data.get('shelf_id', None))
+        # 并发查询所有书架, 每个书架单独返回状态
+        data = gather_shelves(shelf_set, lambda spider: spider.get_wallet(), 'wallet')
+        response['status'], response['msg'] = summary_status(data)
+        response['msg'] = response['msg'] or '获取钱包信息成功!'
+        response['data'] = data
         return Response(response)
 
 
@@ -314,27 +353,23 @@ class RankView(APIView):
         rank_type = request.query_params.get('rank_type')
         data_type = request.query_params.get('data_type')
         page = request.query_params.get('page')
-        data = {}
         shelf_id = request.data.get('shelf_id', None)
-        shelf_set = get_shelf(request, shelf_id)
-        try:
-            for shelf in shelf_set:
-                if shelf.spider:
-                    data[shelf.id] = {
-                        'shelf_id': shelf.id,
-                        'shelf_title': shelf.shelf_title,
-                        'rank': shelf.spider.get_rank(rank_type, data_type, page)
-                    }
-            response['status'] = 2000
-            response['msg'] = '获取排行榜信息成功!'
-            response['data'] = data
-        except ValueError as e:
-            response['status'] = 2002
-            response['msg'] = str(e)
+        shelf_set = get_shelves(request, shelf_id)
+        # 并发查询所有书架, 每个书架单独返回状态
+        data = gather_shelves(shelf_set, lambda spider: spider.get_rank(rank_type, data_type, page), 'rank')
+        response['status'], response['msg'] = summary_status(data)
+        response['msg'] = response['msg'] or '获取排行榜信息成功!'
+        response['data'] = data
         return Response(response)
 
 
 class SearchView(APIView):
+    """
+    搜索接口
+    get: 需要keyword, 可选page, shelf_id
+         优先从本地搜索索引返回(结果中source为local), 本地没有结果或传入fresh时搜索原网站
+         传入scope=chapter时在本地保存的章节内容中搜索(需要开启SEARCH_INDEX_CHAPTERS)
+    """
     authentication_classes = (TokenAuthentication, )
 
     def get(self, request):
@@ -346,21 +381,22 @@ class SearchView(APIView):
         page = request.query_params.get('page', 1)
         # 有就单独搜索,没有的话就在所有书架搜索
         shelf_id = request.data.get('shelf_id', None)
-        data = {}
-        if keyword:
-            shelf_set = get_shelf(request, shelf_id)
-            try:
-                for shelf in shelf_set:
-                    if shelf.spider:
-                        data[shelf.id] = {
-                            'shelf_id': shelf.id,
-                            'shelf_title': shelf.shelf_title,
-                            'rank': shelf.spider.search_book(keyword, page)
-                        }
-                response['data'] = data
-            except ValueError as e:
-                response['status'] = 2002
-                response['msg'] = str(e)
+        fresh = request.query_params.get('fresh') or request.data.get('fresh')
+        if keyword and request.query_params.get('scope') == 'chapter':
+            shelf_set = get_shelves(request, shelf_id)
+            data = local_or_gather(shelf_set, lambda site: search_index.search_chapters(site, keyword, page) or {
+                'pages': 0, 'page': page, 'total': 0, 'chapters': [], 'source': 'local'}, None, 'rank')
+            response['status'], response['msg'] = summary_status(data)
+            response['msg'] = response['msg'] or '搜索成功!'
+            response['data'] = data
+        elif keyword:
+            shelf_set = get_shelves(request, shelf_id)
+            # 本地没有结果的书架并发查询原网站, 每个书架单独返回状态
+            data = local_or_gather(shelf_set, lambda site: None if fresh else search_index.search(site, keyword, page),
+                                   lambda spider: spider.search_book(keyword, page), 'rank')
+            response['status'], response['msg'] = summary_status(data)
+            response['msg'] = response['msg'] or '搜索成功!'
+            response['data'] = data
         else:
             response['status'] = 3001
             response['msg'] = '请输入关键词!'
@@ -370,7 +406,7 @@ class SearchView(APIView):
 class BookView(APIView):
     """
     书籍接口
-    get: 获取书籍详情信息,需要 shelf_id, book_id
+    get: 获取书籍详情信息,需要 shelf_id, book_id, 优先从数据库读取, 过期时在后台刷新
     post: 收藏&取消收藏书籍, 需要shelf_id, book_id
     """
     authentication_classes = (TokenAuthentication, )
@@ -383,14 +419,27 @@ class BookView(APIView):
         book_id = request.data.get('book_id', None)
         shelf_id = request.data.get('shelf_id', None)
 
-        if book_id and shelf_id:
-            # 只能获取一个书架的一本书
-            shelf = get_shelf(request, shelf_id)[0]
+        # 只能获取一个书架的一本书
+        shelf = get_shelf(request, shelf_id) if book_id else None
+        if shelf is not None:
             try:
-                if shelf.spider:
+                # 数据库中已有书籍时, 书籍与解锁状态没有变化则返回304, 不需要读取目录
+                lock = ChapterLock.find(shelf, str(book_id))
+                if lock is not None:
+                    client_etag = etags.match(request, lock.etag)
+                    if client_etag:
+                        lock.update_spider(shelf)
+                        return etags.not_modified(client_etag)
+                    data = lock.to_data(shelf)
+                else:
+                    data = ChapterLock.refresh(shelf, str(book_id))
+                    # 刚保存到数据库, 下次请求时可以直接比较
+                    lock = ChapterLock.find(shelf, str(book_id)) if data is not None else None
+                if data is not None:
                     response['status'] = 4000
                     response['msg'] = '获取书籍信息成功'
-                    response['data'] = shelf.spider.get_book(book_id)
+                    response['data'] = data
+                    return etags.set_etag(Response(response), lock.etag) if lock else Response(response)
             except ValueError as e:
                 response['status'] = 2001
                 response['msg'] = str(e)
@@ -404,9 +453,9 @@ class BookView(APIView):
         }
         book_id = request.data.get('book_id', None)
         shelf_id = request.data.get('shelf_id', None)
-        if book_id and shelf_id:
-            # 只能获取一个书架的一本书
-            shelf = get_shelf(request, shelf_id)[0]
+        # 只能获取一个书架的一本书
+        shelf = get_shelf(request, shelf_id) if book_id else None
+        if shelf is not None:
             try:
                 if shelf.spider:
                     response = shelf.spider.favo_book(book_id)
@@ -417,10 +466,49 @@ class BookView(APIView):
         return Response(response)
 
 
+class BookExportView(APIView):
+    """
+    书籍导出接口
+    get: 导出书架可以阅读的所有章节, 需要shelf_id, book_id, 可选type(txt或epub, 默认txt)
+         参数可以放在查询参数中, 方便直接下载
+    """
+    authentication_classes = (TokenAuthentication, )
+
+    def get(self, request):
+        response = {
+            'status': 4001,
+            'msg': '未找到书籍!'
+        }
+        params = request.query_params.dict()
+        params.update(request.data)
+        book_id = params.get('book_id')
+        shelf_id = params.get('shelf_id')
+        export_format = params.get('type', 'txt')
+        if export_format not in EXPORT_FORMATS:
+            response['msg'] = '不支持的格式!'
+        elif book_id and shelf_id:
+            shelf = get_shelf(request, shelf_id)
+            try:
+                book_data = ChapterLock.load(shelf, str(book_id)) if shelf else None
+                spider = shelf.spider if book_data else None
+                if spider:
+                    content_type, extension = EXPORT_FORMATS[export_format]
+                    resp = StreamingHttpResponse(export_book(spider, book_data, export_format),
+                                                 content_type=content_type)
+                    filename = quote(f"{book_data['book_title']}.{extension}")
+                    resp['Content-Disposition'] = f"attachment; filename*=UTF-8''{filename}"
+                    return resp
+            except ValueError as e:
+                response['status'] = 2001
+                response['msg'] = str(e)
+        return Response(response)
+
+
 class ChapterView(APIView):
     """
     章节接口
-    get: 获取章节信息 需要shelf_id, book_id, chapter_id
+    get: 获取章节信息 需要shelf_id, book_id, chapter_id, 可选read_ahead(预读之后的章节数),
+         可选start, end(只返回paragraph_index在[start, end]之间的段落, 同时返回总段数paragraph_count)
     post: 订阅章节 需要shelf_id, book_id, chapter_id
     """
     authentication_classes = (TokenAuthentication, )
@@ -436,13 +524,23 @@ class ChapterView(APIView):
         chapter_id = request.data.get('chapter_id')
         if shelf_id and book_id and chapter_id:
             # 必须传入shelf_id
-            shelf = get_shelf(request, shelf_id)[0]
+            shelf = get_shelf(request, shelf_id)
             try:
-                if shelf and shelf.spider:
-                    data = shelf.spider.get_chapter(chapter_id)
+                spider = shelf.spider if shelf else None
+                if spider:
+                    start, end = get_paragraph_range(request.data)
+                    # 其他进程获取的解锁状态保存在数据库中, 可以阅读的章节才能使用章节存储
+                    ChapterLock.load_spider(shelf, book_id, chapter_id, spider)
+                    chapter = spider.get_packed_chapter(chapter_id, get_read_ahead(request.data))
+                    # 章节没有变化时返回304, 不需要转换与序列化章节数据
+                    etag = etags.make_etag('chapter', chapter.digest(), start, end)
+                    client_etag = etags.match(request, etag)
+                    if client_etag:
+                        return etags.not_modified(client_etag)
                     response['status'] = 2000
                     response['msg'] = '获取章节信息成功'
-                    response['data'] = data
+                    response['data'] = chapter.to_data(start, end)
+                    return etags.set_etag(Response(response), etag)
             except ValueError as e:
                 response['msg'] = str(e)
         return Response(response)
@@ -458,11 +556,13 @@ class ChapterView(APIView):
         chapter_id = request.data.get('chapter_id')
         if shelf_id and book_id and chapter_id:
             # 必须传入shelf_id
-            shelf = get_shelf(request, shelf_id)[0]
+            shelf = get_shelf(request, shelf_id)
             try:
-                if shelf and shelf.spider:
-                    data = shelf.spider.buy_chapter(book_id, chapter_id)
-                    response = data
+                spider = shelf.spider if shelf else None
+                if spider:
+                    response = spider.buy_chapter(book_id, chapter_id)
+                    if spider.can_read(chapter_id):
+                        ChapterLock.unlock(shelf, book_id, chapter_id)
             except ValueError as e:
                 response['msg'] = str(e)
         return Response(response)
@@ -492,7 +592,7 @@ class LineCommentView(APIView):
         index = request.data.get('index')
         if shelf_id and chapter_id and index:
             # 必须传入shelf_id
-            shelf = get_shelf(request, shelf_id)[0]
+            shelf = get_shelf(request, shelf_id)
             try:
                 if shelf and shelf.spider:
                     data = shelf.spider.get_line_comment(chapter_id, count, index)
@@ -521,7 +621,7 @@ class LineCommentView(APIView):
         tsukkomi_content = request.data.get('tsukkomi_content')
         # 都不为空
         if all((shelf_id, book_id, chapter_id, index, line_content, tsukkomi_content)):
-            shelf = get_shelf(request, shelf_id)[0]
+            shelf = get_shelf(request, shelf_id)
             try:
                 if shelf and shelf.spider:
                     data = shelf.spider.send_line_comment(book_id, chapter_id, index,
@@ -530,3 +630,33 @@ class LineCommentView(APIView):
             except ValueError as e:
                 response['msg'] = str(e)
         return Response(response)
+
+
+class LineCommentBatchView(APIView):
+    """
+    批量间贴接口
+    get: 获取一个章节多个段落的间贴, 需要shelf_id, chapter_id, indexes(段落索引列表或逗号分隔的字符串), 可选count
+         返回 {段落索引: 间贴数据}, 间贴数为0的段落不会请求原网站
+    """
+    authentication_classes = (TokenAuthentication, )
+
+    def get(self, request):
+        response = {
+            'status': 2001,
+            'msg': None
+        }
+        shelf_id = request.data.get('shelf_id')
+        chapter_id = request.data.get('chapter_id')
+        count = request.data.get('count', 10)
+        indexes = get_paragraph_indexes(request.data)
+        if shelf_id and chapter_id and indexes:
+            shelf = get_shelf(request, shelf_id)
+            try:
+                if shelf and shelf.spider:
+                    data = shelf.spider.get_line_comments(chapter_id, indexes, count)
+                    response['status'] = 1
+                    response['msg'] = '获取间贴信息成功'
+                    response['data'] = data
+            except ValueError as e:
+                response['msg'] = str(e)
+        return Response(response)
@@ -0,0 +1,74 @@
+#!/user/bin/env python
+# 每天都要有好心情
+"""
+页面解析的性能测试
+对 benchmarks/fixtures/youdu 下的有毒小说网页面样本, 分别使用
+旧的BeautifulSoup解析(legacy_parsers.py)与新的网站配置中编译的lxml XPath解析(sites/youdu.py),
+校验两者结果一致并输出每个页面的平均耗时与加速比.
+
+运行: python -m benchmarks.bench_parsers [-n 次数] [--min-speedup 倍数]
+新解析的加速比低于 --min-speedup 或结果不一致时返回非0, 可以用来发现性能退化
+"""
+import argparse
+import os
+import sys
+import timeit
+
+from benchmarks import legacy_parsers
+from Novel_Server.utils.sites.youdu import SPEC
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'youdu')
+
+# (名称, 样本文件, 旧解析函数, 新解析函数, 额外参数)
+CASES = (
+    ('shelf', 'shelf.html', legacy_parsers.parse_shelf, SPEC.pages['shelf'], ()),
+    ('wallet', 'wallet.html', legacy_parsers.parse_wallet, SPEC.pages['wallet'], ()),
+    ('rank', 'rank.html', legacy_parsers.parse_rank, SPEC.pages['rank'], (1, )),
+    ('search', 'search.html', legacy_parsers.parse_search, SPEC.pages['search'], (1, )),
+    ('book', 'book.html', legacy_parsers.parse_book, SPEC.pages['book'], ()),
+    ('post_data', 'readchapter.html', legacy_parsers.parse_post_data, SPEC.pages['post_data'], ()),
+)
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), encoding='utf-8') as f:
+        return f.read()
+
+
+def normalize(name, data):
+    # 书籍简介是html片段, 两种解析器的格式化方式不同, 不参与比较
+    if name == 'book':
+        data = dict(data, book_disc=None)
+    return data
+
+
+def bench(func, args, number):
+    return min(timeit.repeat(lambda: func(*args), number=number, repeat=3)) / number * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='页面解析性能测试')
+    parser.add_argument('-n', '--number', type=int, default=50, help='每轮解析次数')
+    parser.add_argument('--min-speedup', type=float, default=1.0, help='要求的最小加速比')
+    options = parser.parse_args()
+
+    failed = False
+    print(f"{'page':<12}{'bytes':>8}{'bs4 ms':>10}{'lxml ms':>10}{'speedup':>10}")
+    for name, fixture, legacy, fast, extra in CASES:
+        html = load_fixture(fixture)
+        args = (html, ) + extra
+        if normalize(name, legacy(*args)) != normalize(name, fast(*args)):
+            print(f'{name}: 解析结果与旧解析不一致')
+            failed = True
+            continue
+        legacy_ms = bench(legacy, args, options.number)
+        fast_ms = bench(fast, args, options.number)
+        speedup = legacy_ms / fast_ms
+        print(f'{name:<12}{len(html.encode()):>8}{legacy_ms:>10.3f}{fast_ms:>10.3f}{speedup:>9.1f}x')
+        if speedup < options.min_speedup:
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,228 @@
+#!/user/bin/env python
+# 每天都要有好心情
+"""
+本地的有毒小说网模拟服务器
+使用 benchmarks/fixtures/youdu 下的页面与JSON样本响应 spiders_setting.py 中有毒小说网的所有接口,
+可以设置响应延迟与错误率, 用来在不访问原网站的情况下测试接口的性能.
+爬虫通过环境变量 YOUDU_BASE_URL 指向该服务器, 书架的网站标识不变.
+
+运行: python -m benchmarks.fake_youdu [--port 端口] [--latency 毫秒] [--jitter 毫秒] [--error-rate 比例]
+然后以 YOUDU_BASE_URL=http://127.0.0.1:端口 启动项目
+GET /__stats__ 返回每个接口的请求数, GET /__reset__ 清空统计
+每个响应的 X-Fake-User 与 X-Fake-Referer 头返回请求cookie中的账号与请求的referer, 用来检查并发时请求头是否串用
+"""
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'youdu')
+
+# (请求方法, 路径, 接口名称, 样本文件), 路径与 spiders_setting.py 中的URL对应
+ROUTES = (
+    ('GET', r'/user/favobook', 'shelf', 'shelf.html'),
+    ('GET', r'/user/prepaidrecords', 'wallet', 'wallet.html'),
+    ('GET', r'/book_detail/(?P<id>\d+)', 'book', 'book.html'),
+    ('GET', r'/readchapter/(?P<id>\d+)', 'readchapter', 'readchapter.html'),
+    ('POST', r'/booklibrary/membersinglechapter/chapter_id/(?P<id>\d+)', 'chapter', 'chapter.json'),
+    ('POST', r'/booklibrary/tsukkomilist', 'line_comment', 'tsukkomi.json'),
+    ('POST', r'/booklibrary/tsukkomiadd', 'line_comment_send', 'tsukkomi_add.json'),
+    ('POST', r'/booklibrary/subscribebookaction', 'buy_chapter', 'buy.json'),
+    ('GET', r'/ranking/ranklist/tag/[^/]+/type/[^/?]+', 'rank', 'rank.html'),
+    ('GET', r'/booklibrary/index/str/[^/?]+', 'search', 'search.html'),
+    ('POST', r'/booklibrary/actionfavo', 'favo_book', 'favo.json'),
+)
+LOGIN_COOKIE = 'saveMemberInfo='
+LOGIN_PAGE = '<html><body><form action="/user/login">请登录</form></body></html>'
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), encoding='utf-8') as f:
+        return f.read()
+
+
+def get_cookie_user(cookie):
+    """
+    cookie中saveMemberInfo保存的账号, 没有时返回None
+    """
+    for item in (cookie or '').split(';'):
+        name, _, value = item.strip().partition('=')
+        if name == 'saveMemberInfo':
+            try:
+                return json.loads(unquote(value)).get('username')
+            except ValueError:
+                return None
+    return None
+
+
+def render_readchapter(page, chapter_id):
+    # 样本页面是第60011章, 上一章与下一章按钮改为请求的章节前后的章节
+    chapter_id = int(chapter_id)
+    return page.replace('/readchapter/60010', f'/readchapter/{chapter_id - 1}') \
+        .replace('/readchapter/60012', f'/readchapter/{chapter_id + 1}')
+
+
+def render_chapter(page, chapter_id):
+    data = json.loads(page)
+    data['data']['id'] = int(chapter_id)
+    return json.dumps(data, ensure_ascii=False)
+
+
+RENDERERS = {
+    'readchapter': render_readchapter,
+    'chapter': render_chapter,
+}
+
+
+class FakeYouDuHandler(BaseHTTPRequestHandler):
+    # 使用长连接, 与爬虫的连接池行为一致
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def handle_request(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        path = self.path.split('?', 1)[0]
+        if path == '/__stats__':
+            return self.send(200, json.dumps(self.server.stats_snapshot()), 'application/json')
+        if path == '/__reset__':
+            self.server.reset_stats()
+            return self.send(200, '{}', 'application/json')
+        if path == '/user/login':
+            return self.send(200, LOGIN_PAGE, 'text/html; charset=utf-8')
+        for route_method, pattern, name, fixture in self.server.routes:
+            match = pattern.fullmatch(path)
+            if route_method == method and match:
+                break
+        else:
+            return self.send(404, 'not found', 'text/plain')
+        self.server.count(name)
+        self.server.delay()
+        if self.server.should_fail():
+            self.server.count('error')
+            return self.send(500, 'server error', 'text/plain')
+        if LOGIN_COOKIE not in (self.headers.get('Cookie') or ''):
+            # 没有登录信息时与原网站一样重定向到登录页面
+            if method == 'GET' and name == 'shelf':
+                self.send_response(302)
+                self.send_header('Location', '/user/login')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            return self.send(200, LOGIN_PAGE, 'text/html; charset=utf-8')
+        body = self.server.fixtures[fixture]
+        if name in RENDERERS:
+            body = RENDERERS[name](body, match.group('id'))
+        content_type = 'application/json' if fixture.endswith('.json') else 'text/html; charset=utf-8'
+        self.send(200, body, content_type)
+
+    def send(self, status, body, content_type):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        user = get_cookie_user(self.headers.get('Cookie'))
+        if user is not None:
+            self.send_header('X-Fake-User', quote(user))
+        if self.headers.get('Referer'):
+            self.send_header('X-Fake-Referer', self.headers['Referer'])
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeYouDuServer(ThreadingHTTPServer):
+    """
+    模拟服务器
+    :param latency: 平均响应延迟(毫秒)
+    :param jitter: 延迟的随机浮动范围(毫秒)
+    :param error_rate: 返回500错误的比例(0-1)
+    """
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0, jitter=0, error_rate=0, verbose=False):
+        super().__init__((host, port), FakeYouDuHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.verbose = verbose
+        self.routes = [(method, re.compile(pattern), name, fixture) for method, pattern, name, fixture in ROUTES]
+        self.fixtures = {fixture: load_fixture(fixture) for _, _, _, fixture in ROUTES}
+        self.stats = Counter()
+        self.stats_lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def count(self, name):
+        with self.stats_lock:
+            self.stats[name] += 1
+
+    def stats_snapshot(self):
+        with self.stats_lock:
+            return dict(self.stats)
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.stats.clear()
+
+    def delay(self):
+        seconds = (self.latency + random.uniform(-self.jitter, self.jitter)) / 1000
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def should_fail(self):
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+    def start(self):
+        """
+        在后台线程中运行服务器
+        :return: 服务器地址
+        """
+        self.thread = threading.Thread(target=self.serve_forever, name='fake-youdu', daemon=True)
+        self.thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地的有毒小说网模拟服务器')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=50, help='平均响应延迟(毫秒)')
+    parser.add_argument('--jitter', type=float, default=20, help='延迟的随机浮动范围(毫秒)')
+    parser.add_argument('--error-rate', type=float, default=0, help='返回500错误的比例(0-1)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='输出每个请求')
+    options = parser.parse_args()
+    server = FakeYouDuServer(options.host, options.port, options.latency, options.jitter,
+                             options.error_rate, options.verbose)
+    print(f'有毒小说网模拟服务器: {server.base_url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
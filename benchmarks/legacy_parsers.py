@@ -0,0 +1,191 @@
+#!/user/bin/env python
+# 每天都要有好心情
+# 改用lxml XPath之前基于BeautifulSoup的解析函数, 只用于解析性能对比与结果校验
+import re
+
+from bs4 import BeautifulSoup
+
+
+def parse_shelf(html):
+    """
+    解析书架页面
+    :param html: 书架页面
+    :return: 书架中的书籍
+    """
+    soup = BeautifulSoup(html, 'lxml')
+    book_list = soup.find('div', class_='favoList').findAll('li')
+    books = {}
+
+    for book in book_list:
+        title = book.find('a')['title']
+        last_chapter = book.find('div', class_='updateChapter').find('a')
+        books[title] = {
+            'id': book.find('a')['href'].split('/')[-1],
+            'title': title,
+            'cover': book.find('img')['data-original'],
+            'last_chapter': last_chapter.get_text().strip(),
+            'last_chapter_id': last_chapter['href'].split('/')[-1]
+        }
+    return books
+
+
+def parse_wallet(html):
+    """
+    解析钱包页面
+    :param html: 钱包页面
+    :return: 钱包信息
+    """
+    soup = BeautifulSoup(html, 'lxml')
+    my_wallet = soup.find('div', class_='Top').findAll('li')
+
+    my_wallet_data = dict()
+    my_wallet_data['re_ticket'] = my_wallet[0].find('em').get_text()
+    my_wallet_data['mon_ticket'] = my_wallet[1].find('em').get_text()
+    my_wallet_data['san'] = my_wallet[2].find('em').get_text()
+    my_wallet_data['temp_san'] = my_wallet[3].find('em').get_text()
+    return my_wallet_data
+
+
+def parse_rank(html, page):
+    """
+    解析排行榜页面
+    :param html: 排行榜页面
+    :param page: 页数
+    :return: 排行榜数据
+    """
+    soup = BeautifulSoup(html, 'lxml')
+    book_list = soup.find('div', class_='piclist').findAll('li')
+    data = {
+        'total': len(book_list),
+        'page': page,
+        'books': []
+    }
+    for book in book_list:
+        data['books'].append({
+            'book_id': book.find('a')['href'].split('/')[-1],
+            'book_title': book.find('a')['title'],
+            'book_cover': book.find('img')['data-original'],
+            'book_author': book.find('div', class_='nicheng').get_text().strip(),
+            'book_favo': book.find('div', class_='shoucang').get_text().strip(),
+            'book_popalrity': book.find('div', class_='renqi').get_text().strip()
+        })
+    return data
+
+
+def parse_search(html, page):
+    """
+    解析搜索结果页面
+    :param html: 搜索结果页面
+    :param page: 页数
+    :return: 搜索结果
+    """
+    soup = BeautifulSoup(html, 'lxml')
+    book_list = soup.find('div', class_='BooklibraryList').findAll('li')[:-1]
+    book_page = soup.find('div', class_='pageInfo').findAll('em')
+    pages = int(book_page[-3].get_text()) if book_page else 0
+    data = {
+        'pages': pages,
+        'page': page,
+        'total': 0,
+        'books': []
+    }
+    for book in book_list:
+        # 因为网页中有<li class='clear'>..</li>的标签,所以需要过滤掉这部分
+        if 'class' in book.attrs:
+            continue
+        data['books'].append({
+            'book_id': book.find('a')['href'].split('/')[-1],
+            'book_title': book.find('a')['title'],
+            'book_cover': book.find('img', class_='img1')['data-original'],
+            'book_author': book.find('dd', class_='nickname').get_text().strip(),
+            'book_favo': book.find('dd', class_='favo').get_text().strip(),
+            'book_popalrity': book.find('dd', class_='hit').get_text().strip()
+        })
+    data['total'] = len(data['books'])
+    return data
+
+
+def parse_book(html):
+    """
+    解析书籍详情页面
+    :param html: 书籍详情页面
+    :return: 书籍信息的dict
+    """
+    soup = BeautifulSoup(html, 'lxml')
+
+    title_author = soup.find('div', class_='title')
+    book_labels = soup.find('div', class_='label').findAll('li')
+    book_fonts = soup.find('div', class_='Font').findAll('span')
+    book_Reward = soup.find('ul', class_='Reward').findAll('li')
+    book_data = {
+        'book_title': title_author.find('span').get_text().strip(),
+        'book_author': title_author.find('em').get_text().strip(),
+        'book_label': [label.get_text().strip() for label in book_labels],
+        'book_fonts': book_fonts[0].get_text().strip(),
+        'book_click': book_fonts[1].get_text().strip(),
+        'book_favo': book_fonts[2].get_text().strip(),
+        'book_reward': {
+            'book_monTicket': book_Reward[0].get_text().strip(),
+            'book_reTicket': book_Reward[1].get_text().strip(),
+            'book_money': book_Reward[2].get_text().strip(),
+            'book_fuck': book_Reward[3].get_text().strip()
+        },
+        'book_cover': soup.find('div', class_='pic').find('img')['data-original'],
+        'book_disc': soup.find('div', class_='synopsisCon').prettify(),
+        'book_volume_list': [],
+        'chapter_lock': {},
+    }
+    # 书籍卷名
+    book_volume_list = soup.findAll('div', class_='volume_name')
+    book_chapter_list = soup.findAll('div', class_='chapter_list')
+    for volume in book_volume_list:
+        book_data['book_volume_list'].append({
+            'volume_name': volume.get_text().strip(),
+            'chapter_list': []
+        })
+    # 每卷包含的章节列表
+    for idx, volume in enumerate(book_data['book_volume_list']):
+        chapter_list = book_chapter_list[idx].findAll('li')
+        for chapter in chapter_list:
+            status = chapter.attrs.get('class', None)
+            if status:
+                # 未解锁
+                if status[0] == 'lock_fill':
+                    is_lock = 1
+                # 已解锁
+                else:
+                    is_lock = 0
+            # 免费章节
+            else:
+                is_lock = -1
+            chapter_id = chapter.find('a')['href'].split('/')[-1]
+            volume['chapter_list'].append({
+                'chapter_title': chapter.find('a').get_text().strip(),
+                'chapter_id': chapter_id,
+                'is_lock': is_lock
+            })
+            book_data['chapter_lock'][chapter_id] = is_lock
+    return book_data
+
+
+def parse_post_data(html):
+    """
+    解析章节阅读页面中的上下章按钮与caonima字符串
+    :param html: 章节阅读页面
+    :return: 上下章按钮, post数据
+    """
+    soup = BeautifulSoup(html, 'lxml')
+    btn_list = soup.find('div', class_='chapterBtn').findAll('a')
+    # 上一章
+    prev_btn = btn_list[0]['href'].split('/')[-1] if btn_list[0]['href'] != "javascript:void(0);" else None
+    # 下一章
+    next_btn = btn_list[-1]['href'].split('/')[-1] if btn_list[-1]['href'] != "javascript:void(0);" else None
+    btns = {
+        'prev_btn': prev_btn,
+        'next_btn': next_btn
+    }
+    data = {
+        'sign': 'a3NvcnQoJHBhcmEpOw==',
+        'caonima': re.findall(r'MemberSingleChapter.+?;', html)[-1].split('"')[-2]
+    }
+    return btns, data
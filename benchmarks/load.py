@@ -0,0 +1,360 @@
+#!/user/bin/env python
+# 每天都要有好心情
+"""
+接口的负载测试
+在进程内通过 django.test.Client 并发调用真实的DRF接口(包括认证, 中间件与爬虫),
+爬虫请求本地的有毒小说网模拟服务器(fake_youdu.py), 输出每个接口的吞吐量与 p50/p95/p99 延迟.
+
+运行: python -m benchmarks.load [-c 并发数] [-d 秒数] [-e 接口,接口] [--latency 毫秒] [--error-rate 比例]
+         [--accept 媒体类型] [--accept-encoding 压缩方式]
+默认在后台线程启动模拟服务器, 传入 --base-url 时使用已经运行的模拟服务器.
+每个接口同时输出响应的平均大小(压缩后)与序列化加压缩的平均耗时(来自响应头Server-Timing的render与compress).
+数据库与缓存使用 benchmarks/settings.py (SQLite, 文件位于 cache/bench), 每次运行前可以删除该目录从空缓存开始.
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlencode
+
+from benchmarks.fake_youdu import FakeYouDuServer, load_fixture
+
+# 书籍详情样本中的书籍
+BOOK_ID = '4000'
+
+
+def decode_body(response):
+    """
+    按Content-Encoding与Content-Type解码响应
+    :return: 解码后的数据
+    """
+    body = response.content
+    encoding = response.get('Content-Encoding')
+    if encoding == 'gzip':
+        body = gzip.decompress(body)
+    elif encoding == 'br':
+        import brotli
+        body = brotli.decompress(body)
+    if response.get('Content-Type', '').startswith('application/msgpack'):
+        import msgpack
+        return msgpack.unpackb(body, strict_map_key=False)
+    return json.loads(body)
+
+
+def parse_server_timing(value):
+    """
+    解析响应头Server-Timing
+    :return: {阶段: 耗时(毫秒)}
+    """
+    phases = {}
+    for item in (value or '').split(','):
+        name, *params = item.strip().split(';')
+        for param in params:
+            if param.startswith('dur='):
+                phases[name] = float(param[4:])
+    return phases
+
+
+def percentile(values, percent):
+    """
+    最近秩法计算百分位数
+    :param values: 已排序的数据
+    :param percent: 百分位(0-100)
+    """
+    if not values:
+        return 0
+    index = max(0, min(len(values) - 1, int(round(percent / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+class Scenario(object):
+    """
+    一个接口的请求方式
+    :param name: 名称
+    :param path: 接口地址
+    :param params: params(context) 返回请求参数
+    :param success: 表示成功的status
+    """
+
+    def __init__(self, name, path, params, success):
+        self.name = name
+        self.path = path
+        self.params = params
+        self.success = success
+
+    def check(self, response):
+        if response.status_code != 200:
+            return False
+        if response.get('Content-Type', '').startswith(('application/json', 'application/msgpack')):
+            return decode_body(response).get('status') in self.success
+        return True
+
+
+def make_scenarios():
+    def shelf(context):
+        return {'shelf_id': random.choice(context['shelves'])}
+
+    def chapter(context):
+        return dict(shelf(context), book_id=BOOK_ID, chapter_id=random.choice(context['chapters']))
+
+    return {scenario.name: scenario for scenario in (
+        Scenario('shelf', '/api/shelf/', lambda context: {}, (2000, )),
+        Scenario('wallet', '/api/wallet/', shelf, (2000, )),
+        Scenario('rank', '/api/rank/', lambda context: {'page': random.randint(1, 3)}, (2000, )),
+        Scenario('search', '/api/search/', lambda context: {'keyword': random.choice(context['keywords'])}, (2000, )),
+        Scenario('book', '/api/book/', lambda context: dict(shelf(context), book_id=BOOK_ID), (4000, )),
+        Scenario('chapter', '/api/chapter/', chapter, (2000, )),
+        Scenario('line_comment', '/api/lineComment/',
+                 lambda context: dict(chapter(context), index=random.randint(1, 80)), (1, )),
+        Scenario('line_comment_batch', '/api/lineComment/batch/',
+                 lambda context: dict(chapter(context), indexes=','.join(map(str, range(1, 41)))), (1, )),
+    )}
+
+
+def setup_data(shelf_count):
+    """
+    创建数据表, 测试用户与书架
+    :return: (token, 书架id列表)
+    """
+    from django.core.management import call_command
+    from django.db import connection
+    from rest_framework_jwt.settings import api_settings
+    from UserApp.models import NovelUser, Shelf
+
+    if connection.vendor == 'sqlite':
+        # WAL模式下读写互不阻塞, 避免并发请求时出现 database is locked
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode=WAL')
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    call_command('createcachetable', verbosity=0)
+    user = NovelUser.objects.filter(username='bench').first() or \
+        NovelUser.objects.create_user('bench', 'bench', 'bench@example.com', 'bench')
+    shelves = []
+    for i in range(shelf_count):
+        shelf, _ = Shelf.objects.get_or_create(user=user, shelf_title=f'bench{i}', defaults={
+            'account': f'bench{i}', 'password': 'bench', 'web_url': Shelf.URL_YouDu})
+        shelves.append(shelf.id)
+    token = api_settings.JWT_ENCODE_HANDLER(api_settings.JWT_PAYLOAD_HANDLER(user))
+    return token, shelves
+
+
+def make_context(shelves):
+    from Novel_Server.utils.sites.youdu import SPEC
+
+    book = SPEC.extract('book', load_fixture('book.html'))
+    search = SPEC.extract('search', load_fixture('search.html'), 1)
+    return {
+        'shelves': shelves,
+        # 免费与已解锁的章节
+        'chapters': [chapter_id for chapter_id, lock in book['chapter_lock'].items() if lock in (-1, 0)],
+        'keywords': [item['book_title'][:2] for item in search['books']],
+    }
+
+
+class LoadRunner(object):
+    """
+    多个线程按顺序轮流请求各个接口, 直到达到运行时间或请求数
+    """
+
+    def __init__(self, token, scenarios, context, concurrency, duration, requests, headers=None):
+        self.token = token
+        # 每个请求附加的请求头, 如Accept与Accept-Encoding
+        self.headers = headers or {}
+        self.scenarios = scenarios
+        self.context = context
+        self.concurrency = concurrency
+        self.duration = duration
+        self.requests = requests
+        self.results = defaultdict(list)
+        # 响应大小(字节)与序列化加压缩的耗时(毫秒)
+        self.sizes = defaultdict(list)
+        self.encode_times = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.samples = {}
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.elapsed = 0
+
+    def next_request(self):
+        with self.lock:
+            if self.requests and self.sent >= self.requests:
+                return None
+            self.sent += 1
+            return self.scenarios[self.sent % len(self.scenarios)]
+
+    def worker(self, deadline):
+        from django.db import connections
+        from django.test import Client
+
+        client = Client(HTTP_AUTHORIZATION=self.token, **self.headers)
+        try:
+            while time.monotonic() < deadline:
+                scenario = self.next_request()
+                if scenario is None:
+                    break
+                start = time.perf_counter()
+                params = scenario.params(self.context)
+                try:
+                    # 部分接口从请求体读取GET参数, 查询参数与JSON请求体都发送
+                    response = client.generic('GET', f'{scenario.path}?{urlencode(params)}', json.dumps(params),
+                                              content_type='application/json')
+                    # 流式响应需要读完才算完成
+                    if response.streaming:
+                        size = len(b''.join(response.streaming_content))
+                        ok = bool(size)
+                    else:
+                        size = len(response.content)
+                        ok = scenario.check(response)
+                    phases = parse_server_timing(response.get('Server-Timing'))
+                    encode = phases.get('render', 0) + phases.get('compress', 0)
+                    error = None if ok else response.content[:200].decode(errors='replace')
+                except Exception as e:
+                    ok, error, size, encode = False, repr(e), 0, 0
+                elapsed = time.perf_counter() - start
+                with self.lock:
+                    self.results[scenario.name].append(elapsed)
+                    self.sizes[scenario.name].append(size)
+                    self.encode_times[scenario.name].append(encode)
+                    if not ok:
+                        self.errors[scenario.name] += 1
+                        # 保留每个接口的第一个错误, 便于排查
+                        self.samples.setdefault(scenario.name, error)
+        finally:
+            connections.close_all()
+
+    def warmup(self, rounds):
+        """
+        计时之前按顺序请求每个接口, 使书籍目录, 解锁状态与登录会话先保存下来, 结果不计入统计
+        """
+        from django.test import Client
+
+        client = Client(HTTP_AUTHORIZATION=self.token, **self.headers)
+        for _ in range(rounds):
+            for shelf_id in self.context['shelves']:
+                for scenario in self.scenarios:
+                    params = dict(scenario.params(self.context), shelf_id=shelf_id)
+                    client.generic('GET', f'{scenario.path}?{urlencode(params)}', json.dumps(params),
+                                   content_type='application/json')
+
+    def run(self):
+        deadline = time.monotonic() + (self.duration if self.duration else float('inf'))
+        threads = [threading.Thread(target=self.worker, args=(deadline, )) for _ in range(self.concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.elapsed = time.perf_counter() - start
+
+    def report(self):
+        rows = []
+        for name in [scenario.name for scenario in self.scenarios]:
+            values = sorted(self.results.get(name, ()))
+            if not values:
+                continue
+            rows.append({
+                'endpoint': name,
+                'requests': len(values),
+                'errors': self.errors.get(name, 0),
+                'rps': len(values) / self.elapsed,
+                'mean_ms': sum(values) / len(values) * 1000,
+                'p50_ms': percentile(values, 50) * 1000,
+                'p95_ms': percentile(values, 95) * 1000,
+                'p99_ms': percentile(values, 99) * 1000,
+                'max_ms': values[-1] * 1000,
+                'bytes': sum(self.sizes[name]) / len(self.sizes[name]),
+                'encode_ms': sum(self.encode_times[name]) / len(self.encode_times[name]),
+            })
+        return rows
+
+
+def print_report(rows, elapsed):
+    print(f"{'endpoint':<20}{'reqs':>7}{'errs':>6}{'rps':>9}{'mean':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}"
+          f"{'bytes':>9}{'encode':>8}")
+    for row in rows:
+        print(f"{row['endpoint']:<20}{row['requests']:>7}{row['errors']:>6}{row['rps']:>9.1f}{row['mean_ms']:>9.1f}"
+              f"{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['max_ms']:>9.1f}"
+              f"{row['bytes']:>9.0f}{row['encode_ms']:>8.2f}")
+    total = sum(row['requests'] for row in rows)
+    print(f"{'total':<20}{total:>7}{sum(row['errors'] for row in rows):>6}{total / elapsed:>9.1f}"
+          f"   (ms, {elapsed:.1f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='接口负载测试')
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help='并发线程数')
+    parser.add_argument('-d', '--duration', type=float, default=10, help='运行时间(秒), 为0时只按请求数运行')
+    parser.add_argument('-n', '--requests', type=int, default=0, help='总请求数, 为0时只按运行时间运行')
+    parser.add_argument('-e', '--endpoints', help='逗号分隔的接口名称, 默认全部')
+    parser.add_argument('--shelves', type=int, default=2, help='测试用户的书架数')
+    parser.add_argument('--base-url', help='已经运行的模拟服务器地址')
+    parser.add_argument('--latency', type=float, default=50, help='模拟服务器的平均延迟(毫秒)')
+    parser.add_argument('--jitter', type=float, default=20, help='模拟服务器延迟的随机浮动范围(毫秒)')
+    parser.add_argument('--error-rate', type=float, default=0, help='模拟服务器返回500错误的比例(0-1)')
+    parser.add_argument('--warmup', type=int, default=1, help='计时之前按顺序请求每个接口的轮数')
+    parser.add_argument('--no-rate-limit', action='store_true', help='不限制请求模拟服务器的速度')
+    parser.add_argument('--accept', default='application/json',
+                        help='请求头Accept, application/msgpack需要安装msgpack')
+    parser.add_argument('--accept-encoding', default='',
+                        help='请求头Accept-Encoding, 如gzip或br, 默认不压缩')
+    parser.add_argument('--json', help='把结果保存为JSON文件')
+    options = parser.parse_args()
+    if not options.duration and not options.requests:
+        parser.error('需要 --duration 或 --requests')
+
+    server = None
+    if options.base_url:
+        base_url = options.base_url
+    else:
+        server = FakeYouDuServer(latency=options.latency, jitter=options.jitter, error_rate=options.error_rate)
+        base_url = server.start()
+    # 需要在加载爬虫配置之前设置
+    os.environ['YOUDU_BASE_URL'] = base_url
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    import django
+    django.setup()
+    from Novel_Server.utils.transport import stats
+
+    if options.no_rate_limit:
+        from Novel_Server.utils.spiders import Spider_YouDu
+        Spider_YouDu.rate_limiter = None
+    scenarios = make_scenarios()
+    names = options.endpoints.split(',') if options.endpoints else list(scenarios)
+    unknown = [name for name in names if name not in scenarios]
+    if unknown:
+        parser.error(f"未知的接口: {', '.join(unknown)}, 可选: {', '.join(scenarios)}")
+    token, shelves = setup_data(options.shelves)
+    headers = {'HTTP_ACCEPT': options.accept}
+    if options.accept_encoding:
+        headers['HTTP_ACCEPT_ENCODING'] = options.accept_encoding
+    runner = LoadRunner(token, [scenarios[name] for name in names], make_context(shelves),
+                        options.concurrency, options.duration, options.requests, headers)
+    print(f'模拟服务器 {base_url}, 并发 {options.concurrency}, 接口 {len(names)} 个, '
+          f'Accept: {options.accept}, Accept-Encoding: {options.accept_encoding or "-"}')
+    runner.warmup(options.warmup)
+    runner.run()
+    rows = runner.report()
+    print_report(rows, runner.elapsed)
+    for name, error in runner.samples.items():
+        print(f'{name} error: {error}')
+    upstream = server.stats_snapshot() if server else {}
+    if upstream:
+        print('upstream', json.dumps(upstream, sort_keys=True))
+    print('transport', json.dumps(stats.snapshot(), sort_keys=True))
+    if options.json:
+        with open(options.json, 'w', encoding='utf-8') as f:
+            json.dump({'elapsed': runner.elapsed, 'concurrency': options.concurrency, 'accept': options.accept,
+                       'accept_encoding': options.accept_encoding, 'endpoints': rows,
+                       'upstream': upstream, 'transport': stats.snapshot()}, f, ensure_ascii=False, indent=2)
+    if server:
+        server.stop()
+    return 1 if any(row['errors'] for row in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,33 @@
+#!/user/bin/env python
+# 每天都要有好心情
+"""
+性能测试使用的Django配置
+数据库使用SQLite, 所有文件缓存与本地搜索索引放在 cache/bench 下, 不影响正式的数据
+使用: DJANGO_SETTINGS_MODULE=benchmarks.settings
+"""
+from Novel_Server.settings import *  # noqa: F401,F403
+
+DEBUG = False
+
+BENCH_DIR = os.path.join(BASE_DIR, 'cache', 'bench')
+os.makedirs(BENCH_DIR, exist_ok=True)
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('BENCH_DB', os.path.join(BENCH_DIR, 'bench.sqlite3')),
+        'OPTIONS': {
+            'timeout': 30,
+        }
+    }
+}
+
+CACHES = dict(CACHES)
+for alias in ('auth', 'spider_sessions'):
+    CACHES[alias] = dict(CACHES[alias], LOCATION=os.path.join(BENCH_DIR, alias))
+
+SEARCH_INDEX_PATH = os.path.join(BENCH_DIR, 'search_index.sqlite3')
+
+# 与正式环境一样不使用BrowsableAPIRenderer
+REST_FRAMEWORK = dict(REST_FRAMEWORK, DEFAULT_RENDERER_CLASSES=[
+    renderer for renderer in REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] if not renderer.endswith('BrowsableAPIRenderer')])
@@ -0,0 +1,199 @@
+#!/user/bin/env python
+# 每天都要有好心情
+"""
+爬虫的并发压力测试
+多个线程同时使用同一批书架的爬虫(与gthread等多线程worker相同), 随机获取书架, 钱包, 书籍详情, 章节与间贴,
+并不断让爬虫重新登录, 请求本地的有毒小说网模拟服务器(fake_youdu.py).
+模拟服务器在响应头中返回请求cookie中的账号与referer, 每个请求检查:
+    - cookie中的账号与爬虫所属书架的账号一致(请求头没有在书架之间串用)
+    - 只有获取章节的请求带有referer, 且与章节对应(referer只加在这次请求上)
+结束后检查请求头模板 YOUDU_HEADERS 没有被修改.
+
+运行: python -m benchmarks.stress_spiders [-t 线程数] [-n 每个线程的操作数] [--shelves 书架数]
+有异常或检查不通过时返回非0
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from urllib.parse import unquote
+
+from benchmarks.fake_youdu import FakeYouDuServer
+from benchmarks.load import BOOK_ID, setup_data, make_context
+
+
+class RequestChecker(object):
+    """
+    检查每个发往模拟服务器的请求使用的请求头
+    """
+
+    def __init__(self, read_chapter_url, chapter_json_url):
+        self.read_chapter_url = read_chapter_url
+        self.chapter_json_prefix = chapter_json_url.format('')
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = []
+
+    def check(self, spider, method, url, resp):
+        problems = []
+        user = unquote(resp.headers.get('X-Fake-User', ''))
+        if user != spider.shelf.account:
+            problems.append(f'账号为{user!r}, 应为{spider.shelf.account!r}')
+        referer = resp.headers.get('X-Fake-Referer')
+        if url.startswith(self.chapter_json_prefix):
+            expected = self.read_chapter_url.format(url[len(self.chapter_json_prefix):])
+            if referer != expected:
+                problems.append(f'referer为{referer!r}, 应为{expected!r}')
+        elif referer is not None:
+            problems.append(f'不应带有referer, 实际为{referer!r}')
+        with self.lock:
+            self.requests += 1
+            if problems:
+                self.failures.append(f"{method} {url}: {', '.join(problems)}")
+
+    def install(self, spider_class):
+        """
+        在爬虫发送请求后进行检查
+        """
+        request = spider_class._request
+        checker = self
+
+        def checked_request(spider, method, url, **kwargs):
+            resp = request(spider, method, url, **kwargs)
+            checker.check(spider, method, url, resp)
+            return resp
+        spider_class._request = checked_request
+
+
+def make_operations(spider_class, context):
+    def relogin(spider):
+        # 清除登录状态, 部分情况下同时清除共享的会话, 使登录时重新验证
+        if random.random() < 0.5:
+            spider_class.session_store.delete(spider.site, spider.shelf)
+        spider.is_login = False
+        spider.login()
+
+    def shelf(spider):
+        assert spider.get_shelf(), '书架为空'
+
+    def wallet(spider):
+        assert set(spider.get_wallet()) == {'re_ticket', 'mon_ticket', 'san', 'temp_san'}
+
+    def book(spider):
+        assert spider.get_book(BOOK_ID)['book_volume_list'], '书籍没有章节'
+
+    def chapter(spider):
+        chapter_id = random.choice(context['chapters'])
+        assert str(spider.get_chapter(chapter_id)['chapter_id']) == chapter_id
+
+    def line_comment(spider):
+        spider.get_line_comment(random.choice(context['chapters']), 10, random.randint(1, 80))
+
+    return {func.__name__: func for func in (relogin, shelf, wallet, book, chapter, line_comment)}
+
+
+class StressRunner(object):
+    def __init__(self, spider_class, shelves, operations, threads, iterations):
+        self.spider_class = spider_class
+        self.shelves = shelves
+        self.operations = operations
+        self.threads = threads
+        self.iterations = iterations
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.errors = Counter()
+        self.samples = {}
+        self.elapsed = 0
+
+    def worker(self, barrier):
+        from django.db import connections
+
+        names = list(self.operations)
+        barrier.wait()
+        try:
+            for _ in range(self.iterations):
+                name = random.choice(names)
+                try:
+                    spider = self.spider_class(random.choice(self.shelves))
+                    if not spider.is_login:
+                        spider.login()
+                    self.operations[name](spider)
+                    error = None
+                except Exception as e:
+                    error = repr(e)
+                with self.lock:
+                    self.counts[name] += 1
+                    if error:
+                        self.errors[name] += 1
+                        self.samples.setdefault(name, error)
+        finally:
+            connections.close_all()
+
+    def run(self):
+        # 所有线程同时开始, 尽量让同一个书架的登录与请求重叠
+        barrier = threading.Barrier(self.threads)
+        threads = [threading.Thread(target=self.worker, args=(barrier, )) for _ in range(self.threads)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.elapsed = time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='爬虫的并发压力测试')
+    parser.add_argument('-t', '--threads', type=int, default=32, help='并发线程数')
+    parser.add_argument('-n', '--iterations', type=int, default=50, help='每个线程的操作数')
+    parser.add_argument('--shelves', type=int, default=4, help='书架数, 小于线程数时多个线程共用同一个书架的爬虫')
+    parser.add_argument('--latency', type=float, default=5, help='模拟服务器的平均延迟(毫秒)')
+    parser.add_argument('--jitter', type=float, default=5, help='模拟服务器延迟的随机浮动范围(毫秒)')
+    parser.add_argument('--rate-limit', action='store_true', help='保留请求原网站的限速')
+    options = parser.parse_args()
+
+    server = FakeYouDuServer(latency=options.latency, jitter=options.jitter)
+    base_url = server.start()
+    # 需要在加载爬虫配置之前设置
+    os.environ['YOUDU_BASE_URL'] = base_url
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    import django
+    django.setup()
+    from Novel_Server.utils.spiders import Spider_YouDu
+    from Novel_Server.utils.spiders_setting import YOUDU_HEADERS
+    from Novel_Server.utils.transport import stats
+    from UserApp.models import Shelf
+
+    if not options.rate_limit:
+        Spider_YouDu.rate_limiter = None
+    headers = dict(YOUDU_HEADERS)
+    spec = Spider_YouDu.get_spec()
+    checker = RequestChecker(spec.urls['read_chapter'], spec.urls['chapter_json'])
+    checker.install(Spider_YouDu)
+    _, shelf_ids = setup_data(options.shelves)
+    shelves = list(Shelf.objects.filter(id__in=shelf_ids))
+    runner = StressRunner(Spider_YouDu, shelves, make_operations(Spider_YouDu, make_context(shelf_ids)),
+                          options.threads, options.iterations)
+    print(f'模拟服务器 {base_url}, 线程 {options.threads}, 书架 {len(shelves)}, 每个线程 {options.iterations} 次操作')
+    runner.run()
+    server.stop()
+
+    print(f"{'operation':<16}{'count':>8}{'errors':>8}")
+    for name in runner.operations:
+        print(f'{name:<16}{runner.counts[name]:>8}{runner.errors[name]:>8}')
+    print(f'{sum(runner.counts.values())} 次操作, {checker.requests} 个请求, {runner.elapsed:.1f}s')
+    for name, error in runner.samples.items():
+        print(f'{name} error: {error}')
+    for failure in checker.failures[:10]:
+        print(f'请求头错误: {failure}')
+    template_changed = dict(YOUDU_HEADERS) != headers
+    if template_changed:
+        print('请求头模板 YOUDU_HEADERS 被修改')
+    print('transport', stats.snapshot())
+    return 1 if runner.errors or checker.failures or template_changed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,22 @@
+#!/user/bin/env python
+# 每天都要有好心情
+# 生产环境的gunicorn配置, 通过wsgi运行所有同步接口
+# 启动: gunicorn -c gunicorn.conf.py
+# 异步接口(/api/async/...)由单独的asgi进程提供, 见gunicorn_asgi.conf.py
+import multiprocessing
+import os
+
+# wsgi入口
+wsgi_app = 'Novel_Server.wsgi:application'
+# 多线程worker, 等待原网站响应时其他线程可以继续处理请求(爬虫可以在多个线程中共用, 见benchmarks/stress_spiders.py)
+worker_class = 'gthread'
+bind = os.environ.get('NOVEL_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('NOVEL_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('NOVEL_THREADS', 16))
+# 等待原网站响应的时间较长, 适当放宽超时时间
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+# 定期重启worker, 释放爬虫会话占用的内存
+max_requests = 10000
+max_requests_jitter = 1000
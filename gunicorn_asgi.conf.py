@@ -0,0 +1,21 @@
+#!/user/bin/env python
+# 每天都要有好心情
+# 异步接口的gunicorn配置, 通过asgi运行, 一个进程可以同时保持大量原网站请求
+# 启动: gunicorn -c gunicorn_asgi.conf.py
+# 只有 /api/async/... 需要转发到这里, 同步接口在asgi中只能在一个线程中依次执行, 仍由gunicorn.conf.py的wsgi进程提供
+import multiprocessing
+import os
+
+# asgi入口
+wsgi_app = 'Novel_Server.asgi:application'
+# 使用uvicorn的asgi worker
+worker_class = 'uvicorn.workers.UvicornWorker'
+bind = os.environ.get('NOVEL_ASGI_BIND', '0.0.0.0:8001')
+workers = int(os.environ.get('NOVEL_ASGI_WORKERS', max(multiprocessing.cpu_count() // 2, 1)))
+# 等待原网站响应的时间较长, 适当放宽超时时间
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+# 定期重启worker, 释放爬虫会话占用的内存
+max_requests = 10000
+max_requests_jitter = 1000